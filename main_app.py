@@ -1,9 +1,11 @@
 import logging.config
 import streamlit as st
 from src.controler import Controler
+from src.monitoring.metrics import registry
 import logging
 import os
 import pandas as pd
+from uuid import uuid4
 
 console_handler = logging.StreamHandler()
 logger = logging.getLogger(__name__)
@@ -48,46 +50,72 @@ def get_metrics():
     return metrics
 
 
+def db_ready() -> bool:
+    """
+    Check the collection and its vectors once per session, on the first query,
+    so the connection to the database is not opened when the app starts.
+    """
+    if not st.session_state.get("db_ready"):
+        st.session_state["db_ready"] = bool(
+            controler.db_check_collection() and controler.db_check_vector()
+        )
+    return st.session_state["db_ready"]
+
+
 # Load data and controler
 metrics = get_metrics()
 controler = get_controler()
-db_status_collection = controler.db_check_collection()
-db_status_vectors = controler.db_check_vector()
 
 if st.button("Ejecutar pipeline",type="primary"):
     with st.spinner("Ejecutando pipeline..."):
         controler.init_pipeline()
-    db_status_vectors = controler.db_check_vector()
+    st.session_state["db_ready"] = bool(controler.db_check_vector())
 
 
 st.sidebar.title("Menú")
-page = st.sidebar.radio("Seleccione una opción", ["Chat", "Métricas"])
+page = st.sidebar.radio("Seleccione una opción", ["Chat", "Métricas", "Rendimiento"])
 
 if page == "Chat":
-    if db_status_collection and db_status_vectors:
-        st.title("Reglamentación alimentaria Argentina")
+    st.title("Reglamentación alimentaria Argentina")
 
-        with st.chat_message("assistant"):
-            st.write(
-                "Bienvenido a la aplicación de búsqueda de reglamentación alimentaria Argentina"
-            )
+    with st.chat_message("assistant"):
+        st.write(
+            "Bienvenido a la aplicación de búsqueda de reglamentación alimentaria Argentina"
+        )
 
-        if prompt := st.chat_input("Ingrese su consulta"):
+    if prompt := st.chat_input("Ingrese su consulta"):
+        if not db_ready():
+            st.warning("La base de datos no tiene documentos, ejecute el pipeline")
+        else:
             with st.chat_message("user"):
                 st.write(prompt)
-            with st.spinner("Buscando respuesta..."):
-                respuesta_naive, respuesta_enhanced = controler.process_query(prompt)
 
             with st.chat_message("assistant"):
                 st.markdown(":blue-background[Respuesta Advanced:]")
-                st.text(respuesta_enhanced)
+                panel_enhanced = st.empty()
                 st.divider()
 
             with st.chat_message("assistant"):
                 st.markdown(":red-background[Respuesta basic:]")
-                st.text(respuesta_naive)
+                panel_naive = st.empty()
                 st.divider()
 
+            # Both answers are rendered token by token as they are generated
+            paneles = {"enhanced": panel_enhanced, "naive": panel_naive}
+            respuestas = {"enhanced": "", "naive": ""}
+            panel_enhanced.text("Buscando respuesta...")
+            panel_naive.text("Buscando respuesta...")
+            # Each browser session has its own queue in the scheduler of the controler
+            session_id = st.session_state.setdefault("session_id", str(uuid4()))
+            try:
+                for metodo, token in controler.stream_query(prompt, session_id=session_id):
+                    respuestas[metodo] += token
+                    paneles[metodo].text(respuestas[metodo])
+            except ConnectionRefusedError as e:
+                panel_enhanced.empty()
+                panel_naive.empty()
+                st.warning(str(e))
+
 elif page == "Métricas":
     st.title("Métricas")
     st.title("Métricas Basic")
@@ -120,3 +148,31 @@ elif page == "Métricas":
         ],
         height=500,
     )
+
+elif page == "Rendimiento":
+    st.title("Rendimiento")
+    resumen = registry.summary()
+
+    st.subheader("Latencia por etapa (ms)")
+    etapas = pd.DataFrame(
+        [fila for fila in resumen["histograms"] if fila["metric"] == "stage_latency_ms"]
+    )
+    if etapas.empty:
+        st.info("Todavía no se registraron consultas ni ejecuciones del pipeline")
+    else:
+        st.dataframe(
+            etapas.drop(columns=["metric"]).sort_values("p95", ascending=False),
+            height=400,
+        )
+
+    st.subheader("Tokens enviados al LLM")
+    contadores = pd.DataFrame(resumen["counters"])
+    if not contadores.empty and "chain" in contadores:
+        tokens = contadores[contadores.metric == "llm_tokens_total"]
+        st.dataframe(tokens.pivot_table(index="chain", columns="kind", values="value", aggfunc="sum"))
+
+    st.subheader("Caches y arranque")
+    st.dataframe(pd.Series(resumen["gauges"], name="valor"))
+
+    st.subheader("Exportación Prometheus")
+    st.download_button("Descargar métricas", registry.prometheus(), file_name="metrics.prom")
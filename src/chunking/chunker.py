@@ -1,11 +1,12 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 import logging
-import os
-from dotenv import load_dotenv
-from langchain_community.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
 from collections import namedtuple
-import json
+import bisect
+import itertools
+import re
+import numpy as np
+from .tokenizer import get_tokenizer
+from ..loaders.staging import StagingStore
 
 
 """
@@ -13,107 +14,184 @@ import json
  """
 logger = logging.getLogger(__name__)
 
+# `start`/`end` are the character offsets of the chunk in the text of its chapter,
+# None for the table chunks. `summary` is filled by the summarization stage of the ingestion.
+# `fields` holds the structured metadata of the chunk (see `Chunker.fields`)
+Chunk = namedtuple(
+    "Chunk", ["contenido", "metadata", "start", "end", "summary", "fields"], defaults=(None, None, None, None))
+
+# Lines where a new article or resolution begins
+SECTION_PATTERN = re.compile(r"^(?:Artículo|Resolución|RESOLUCION)", re.MULTILINE)
+LINE_PATTERN = re.compile(r"\n")
+# Structured metadata: chapter of the document, article headings and resolutions cited
+CHAPTER_PATTERN = re.compile(r"^CAP[IÍ]TULO\s+([IVXLC]+)\b", re.MULTILINE)
+ARTICLE_PATTERN = re.compile(r"^Art[íi]culo\s+(\d+)(?:\s*(bis|tris|ter|quater)\b)?", re.MULTILINE | re.IGNORECASE)
+RESOLUTION_PATTERN = re.compile(
+    r"\b(?:Res\b\.?|Resoluci[oó]n)(?:[^\n\d]{0,60}?N\s*[°º]\s*|\s+)(\d+)(?:\s*/\s*(\d+))?", re.IGNORECASE)
+
 
 class Chunker:
-    def __init__(self, data, max_chunk_size=500, output_path="./data/staging/"):
-        load_dotenv()
-        os.getenv("OPENAI_API_KEY")
-        self.llm = ChatOpenAI(
-            model_name="gpt-4o-mini"
-        )  
+    def __init__(self, data, max_chunk_size=500, overlap_size=100, output_path="./data/staging/"):
         self.data = data
         self.chunk_size = max_chunk_size
+        self.overlap_size = overlap_size
         self.output_path = output_path
+        self.staging = StagingStore(output_path)
+        self.tokenizer = get_tokenizer()
 
-    
-    def process_text(self, text: str) -> List[str]:
+    def process_text(self, text: str, token_starts: np.ndarray) -> Iterator[Tuple[int, int]]:
         """
-        Processes the text into a list of sentence chunks. A new chunk is created if:
-        - The sentence starts with 'Resolución' or 'Artículo'.
-        - The chunk exceeds a predefined size limit (`self.chunk_size`).
+        Splits the text into sections. A new section is created if:
+        - The line starts with 'Resolución' or 'Artículo'.
+        - The section exceeds `self.chunk_size` tokens, in which case it is cut at the
+          last line break before the limit (or at the limit if the line is longer).
 
         Args:
         - text: A string containing the text to be processed.
+        - token_starts: character offset of each token of the text.
 
-        Returns:
-        - A list of sentence chunks.
+        Yields:
+        - The (start, end) character offsets of each section.
         """
-        chunk_sentences = []
-        sentences = text.split("\n")
-        text_block = []
-
-        for sentence in sentences:
-            if (
-                sentence.startswith("Artículo")
-                or sentence.startswith("Resolución")
-                or sentence.startswith("RESOLUCION")
-                or len(text_block) >= self.chunk_size
-            ):
-                if text_block:
-                    chunk_sentences.append(" ".join(text_block))
-                text_block = [sentence]
-            else:
-                text_block.append(sentence)
-
-        if text_block:
-            chunk_sentences.append(" ".join(text_block))
-
-        return chunk_sentences
-    def chunking_overlap(self, text: List[str],overlap_size=750) -> List[str]:
+        line_starts = np.fromiter(
+            (match.end() for match in LINE_PATTERN.finditer(text)), dtype=np.int64)
+        bounds = [0] + [match.start() for match in SECTION_PATTERN.finditer(text)] + [len(text)]
+
+        for section_start, section_end in zip(bounds, bounds[1:]):
+            start = section_start
+            first = int(np.searchsorted(token_starts, start))
+            last = int(np.searchsorted(token_starts, section_end))
+            while last - first > self.chunk_size:
+                cut = int(token_starts[first + self.chunk_size])
+                line = int(np.searchsorted(line_starts, cut, side="right")) - 1
+                if line >= 0 and line_starts[line] > start:
+                    cut = int(line_starts[line])
+                yield start, cut
+                start = cut
+                first = int(np.searchsorted(token_starts, start))
+            if last > first:
+                yield start, section_end
+
+    def chunking_overlap(
+        self, spans: Iterable[Tuple[int, int]], token_starts: np.ndarray, overlap_size=100
+    ) -> Iterator[Tuple[int, int]]:
         """
-        Function which performs overlap chunking on the data. It processes the text and returns a list of chunks.
+        Function which performs overlap chunking on the data: every section but the first one
+        is extended backwards `overlap_size` tokens, without going past the start of the previous one.
 
         Args:
-            text (List[str]): A list of strings containing the text to be processed.
-            overlap_size (int): The size of the overlap.
-
-        Returns:
-            List[str]: A list of chunks.
-        """
-        chunks = []
-        for i, chunk in enumerate(text):
-            if i == 0:
-            
-                chunks.append(chunk)
-            else:
-           
-                last_chunk = chunks[-1]
-            
-            
-                overlap = last_chunk[-overlap_size:] if len(last_chunk) >= overlap_size else last_chunk
-            
-            
-                final_chunk = overlap + "\n" + chunk
-            
-            
-                chunks.append(final_chunk)
-        return chunks
-
-    def chunking_hybrid(self) -> Dict[str, Any]:
-        """
-        Function which performs hybrid chunking on the data. It processes the text and tables in the data and returns a list of chunks.
-
-        Returns:
-            Dict[str, Any]: A dictionary containing the chunks.
-        """
-        chunks: tuple = []
-        name_file=''
-        Chunk: tuple = namedtuple("Chunk", ["contenido", "metadata"])
-        for chapter in self.data:
-            name_file=chapter["file_name"]
-            sentences = self.process_text(chapter["text"])
-            sentences = self.chunking_overlap(sentences)
+            spans (Iterable[Tuple[int, int]]): The (start, end) offsets of the sections.
+            token_starts (np.ndarray): character offset of each token of the text.
+            overlap_size (int): The size of the overlap in tokens.
 
-            for sentence in sentences:
-                chunk_sentece=Chunk(contenido=sentence,metadata=chapter["file_name"])
-                chunks.append(chunk_sentece)
+        Yields:
+            Tuple[int, int]: The (start, end) offsets of the chunks.
+        """
+        previous = None
+        for start, end in spans:
+            if previous is not None and overlap_size:
+                token = int(np.searchsorted(token_starts, start))
+                floor = int(np.searchsorted(token_starts, previous))
+                start = int(token_starts[max(token - overlap_size, floor)])
+            previous = start
+            yield start, end
+
+    def chunk_text(self, text: str) -> Iterator[Tuple[int, int]]:
+        """
+        Offsets of the chunks of a text, the text is tokenized only once
+        """
+        token_starts = np.asarray(self.tokenizer.offsets(text), dtype=np.int64)
+        spans = self.process_text(text, token_starts)
+        return self.chunking_overlap(spans, token_starts, overlap_size=self.overlap_size)
 
-            for table_summary in chapter["tables"]:
-                chunk_table=Chunk(contenido=table_summary,metadata=chapter["file_name"])
-                chunks.append(chunk_table)
+    @staticmethod
+    def article_id(number: str, suffix: str = None) -> str:
+        """
+        Normalized article id: "155", "155 bis"
+        """
+        return f"{int(number)} {suffix.lower()}" if suffix else str(int(number))
 
-        chunks_dict = [chunk._asdict() for chunk in chunks]
-        with open(f"{self.output_path}{name_file}_chunked.json", "w",encoding='utf-8') as f:
-            json.dump(chunks_dict, f)
+    @staticmethod
+    def resolution_id(number: str, year: str = None) -> str:
+        """
+        Normalized resolution id: "1546/1990" (two-digit years are expanded) or "1546"
+        when no year is given, without leading zeros
+        """
+        if not year:
+            return str(int(number))
+        year = int(year)
+        if year < 100:
+            year += 2000 if year < 50 else 1900
+        return f"{int(number)}/{year}"
+
+    @classmethod
+    def cited_resolutions(cls, text: str) -> List[str]:
+        """
+        Ids of the resolutions cited in the text, as specific as the citation
+        """
+        return list(dict.fromkeys(cls.resolution_id(*found) for found in RESOLUTION_PATTERN.findall(text)))
 
-        return chunks
+    @classmethod
+    def resolutions(cls, text: str) -> List[str]:
+        """
+        Ids stored for the resolutions cited in a chunk: "number/year" and also "number", so
+        questions naming a resolution without its year match it
+        """
+        ids = []
+        for number, year in RESOLUTION_PATTERN.findall(text):
+            ids.append(cls.resolution_id(number, year))
+            ids.append(cls.resolution_id(number))
+        return list(dict.fromkeys(ids))
+
+    def fields(
+        self, text: str, chapter: str, headings: Tuple[List[int], List[str]], start: int = None, end: int = None
+    ) -> Dict[str, Any]:
+        """
+        Structured metadata of a chunk:
+         - chapter: roman numeral of the chapter of the document
+         - article: articles the chunk belongs to (the one in force at its start and the ones starting inside)
+         - resolution: resolutions cited in the chunk
+         - is_table: the chunk is a table of the document
+        `headings` holds the offsets of the article headings of the chapter and their ids
+        """
+        articles = []
+        if start is not None:
+            positions, ids = headings
+            first = bisect.bisect_right(positions, start) - 1
+            last = bisect.bisect_left(positions, end)
+            articles = ids[max(first, 0) : last]
+        return {
+            "chapter": chapter,
+            "article": list(dict.fromkeys(articles)),
+            "resolution": self.resolutions(text),
+            "is_table": start is None,
+        }
+
+    def chunking_hybrid(self) -> Iterator[Chunk]:
+        """
+        Function which performs hybrid chunking on the data. It processes the text and tables in the data and
+        yields the chunks as they are produced, each chapter is also streamed into its own chunks staging file.
+
+        Yields:
+            Chunk: the chunks with the content, the file name as metadata and the offsets of the content.
+        """
+        for chapter in self.data:
+            name_file = chapter["file_name"]
+            text = chapter["text"]
+            found = CHAPTER_PATTERN.search(text)
+            chapter_number = found.group(1) if found else None
+            matches = list(ARTICLE_PATTERN.finditer(text))
+            headings = ([match.start() for match in matches], [self.article_id(*match.groups()) for match in matches])
+            chunks = itertools.chain(
+                (Chunk(contenido=text[start:end], metadata=name_file, start=start, end=end,
+                       fields=self.fields(text[start:end], chapter_number, headings, start, end))
+                 for start, end in self.chunk_text(text)),
+                (Chunk(contenido=table_summary, metadata=name_file,
+                       fields=self.fields(table_summary, chapter_number, headings))
+                 for table_summary in chapter["tables"]),
+            )
+
+            with self.staging.chunks(name_file).writer() as append:
+                for chunk in chunks:
+                    append(chunk._asdict())
+                    yield chunk
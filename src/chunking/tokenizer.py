@@ -0,0 +1,74 @@
+from functools import lru_cache
+from typing import List, Optional
+import logging
+import os
+import re
+
+"""
+  Local token counting used to size chunks and prompts
+ """
+logger = logging.getLogger(__name__)
+
+# Approximation of a BPE pre-tokenizer: words, numbers and single punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+def tokenizer_name() -> str:
+    """
+    Tokenizer configured with PIPE_TOKENIZER, recorded in the manifest since it decides the chunks
+    """
+    return os.getenv("PIPE_TOKENIZER", DEFAULT_ENCODING)
+
+
+class Tokenizer:
+    """
+    Counts tokens with the tiktoken encoding of the OpenAI models (`PIPE_TOKENIZER`,
+    cl100k_base by default). The encoding file must be available (TIKTOKEN_CACHE_DIR or
+    downloadable), otherwise a ValueError is raised: the chunks depend on the tokenizer, so it
+    never changes silently. `PIPE_TOKENIZER=regex` approximates the tokens with a regular expression.
+    """
+
+    def __init__(self, encoding_name: Optional[str] = None):
+        self.encoding_name: str = encoding_name or tokenizer_name()
+        self.encoding = None
+        if self.encoding_name != "regex":
+            try:
+                import tiktoken
+
+                self.encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                raise ValueError(
+                    f"No se pudo cargar el tokenizador {self.encoding_name}: {e}. Guarde la codificacion en "
+                    f"TIKTOKEN_CACHE_DIR o configure PIPE_TOKENIZER=regex para usar la aproximacion"
+                ) from e
+
+    def count(self, text: str) -> int:
+        """
+        Number of tokens of the text
+        """
+        if self.encoding is not None:
+            return len(self.encoding.encode_ordinary(text))
+        return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+    def offsets(self, text: str) -> List[int]:
+        """
+        Character offset where each token of the text starts
+        """
+        if self.encoding is not None:
+            _, offsets = self.encoding.decode_with_offsets(self.encoding.encode_ordinary(text))
+            return offsets
+        return [match.start() for match in TOKEN_PATTERN.finditer(text)]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding_name: Optional[str] = None) -> Tokenizer:
+    """
+    Shared tokenizer, the encoding is loaded only once per process
+    """
+    return Tokenizer(encoding_name)
+
+
+def count_tokens(text: str) -> int:
+    return get_tokenizer().count(text)
@@ -1,14 +1,27 @@
-from typing import Any, Dict, List
-from langchain_core.documents import Document
-from .vector_store_client.vector_client import VectorStoreClient
-from .loaders.proccesing import Processing
-from .retrievers.retriever import Retriever
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .vector_store_client.results import SearchResult
+from .loaders.manifest import Manifest
+from .loaders.staging import StagingFile, StagingStore
+from .retrievers.answer_cache import AnswerCache
+from .retrievers.context import ContextBuilder
+from .retrievers.router import QueryRouter
+from .retrievers.scheduler import QueryScheduler, run_sync
+from .monitoring.metrics import registry
 import logging
-import glob
-from .chunking.chunker import Chunker
-import json
+import os
+import time
+from .chunking.chunker import Chunk, Chunker
+from .chunking.tokenizer import tokenizer_name
 from typing import List, Dict
 import asyncio
+import json
+import queue
+import threading
+
+if TYPE_CHECKING:
+    from .vector_store_client.vector_client import VectorStoreClient
+    from .retrievers.retriever import Retriever
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +34,8 @@ class Controler:
      - Chunking: Establish and apply the strategies to divide the documents
      - Processing: Handles the pre-processing logic responsible for data cleaning
      - Retrieval  LLM component use to retrieve the most similar documents
+    The vector store client and the retriever (and the libraries they import) are built
+    on first use, the time spent starting each component is kept in `startup_timings`.
     """
 
     _instance = None
@@ -34,67 +49,327 @@ class Controler:
     def __init__(self, data_path="./data/staging", **kwargs):
         """
         Initialize the controler class
-        estabilish the connection with the vector store client
-        raises an error if the connection is not possible
+        the connection with the vector store client is estabilished on first use
         """
+        self.startup_timings: Dict[str, float] = {}
         try:
-            self.client: VectorStoreClient = VectorStoreClient(**kwargs)
-            self.retriever = Retriever()
-            self.path: str = data_path
-
+            with self.startup_timer("controler"):
+                self._client_kwargs: Dict[str, Any] = kwargs
+                self._client = None
+                self._retriever = None
+                # Concurrent sessions may request the lazy components at the same time
+                self._components_lock = threading.Lock()
+                self.path: str = data_path
+                self.chunker_params: Dict[str, Any] = {"max_chunk_size": 500, "overlap_size": 100}
+                self.ingestion_params: Dict[str, Any] = {
+                    "batch_size": int(os.getenv("PIPE_EMBEDDING_BATCH_SIZE", 100)),
+                    "concurrency": int(os.getenv("PIPE_EMBEDDING_CONCURRENCY", 4)),
+                }
+                # Summaries of the chunks computed during the ingestion for the enhanced answer
+                self.summary_params: Dict[str, Any] = {
+                    "enabled": os.getenv("PIPE_CHUNK_SUMMARIES", "false").lower() == "true",
+                    "concurrency": int(os.getenv("PIPE_SUMMARY_CONCURRENCY", 8)),
+                }
+                # Questions naming a chapter, article or resolution are searched only in the matching chunks
+                self.router: Optional[QueryRouter] = (
+                    QueryRouter() if os.getenv("PIPE_QUERY_ROUTER", "true").lower() == "true" else None)
+                self.context_builder: ContextBuilder = ContextBuilder(
+                    max_tokens=int(os.getenv("PIPE_CONTEXT_TOKENS", 4000)),
+                )
+                self.staging: StagingStore = StagingStore(data_path)
+                self.manifest: Manifest = Manifest(os.path.join(data_path, "manifest.json"))
+                similarity = os.getenv("PIPE_ANSWER_CACHE_SIMILARITY")
+                self.answer_cache: AnswerCache = AnswerCache(
+                    max_entries=int(os.getenv("PIPE_ANSWER_CACHE_SIZE", 512)),
+                    ttl=float(os.getenv("PIPE_ANSWER_CACHE_TTL", 3600)),
+                    similarity_threshold=float(similarity) if similarity else None,
+                    embed=lambda query: self.client.embed_query(query),
+                )
+                registry.register_collector("answer_cache", self.answer_cache.stats)
+                registry.register_collector(
+                    "embedding_cache", lambda: self._client.cache_stats() if self._client else {})
+                registry.register_collector("startup_ms", self.startup_report)
+                # The Controler is a singleton, a new instance keeps the running scheduler
+                self.scheduler: QueryScheduler = getattr(self, "scheduler", None) or QueryScheduler(
+                    max_concurrency=int(os.getenv("PIPE_MAX_CONCURRENT_QUERIES", 4)),
+                    max_session_queue=int(os.getenv("PIPE_SESSION_QUEUE_SIZE", 4)),
+                    max_pending=int(os.getenv("PIPE_MAX_PENDING_QUERIES", 64)),
+                )
+                if os.getenv("PIPE_METRICS_PORT"):
+                    registry.serve(int(os.getenv("PIPE_METRICS_PORT")))
         except ValueError as e:
             raise ValueError(
                 f"Problema estableciendo la conguracion inicial del programa {e}"
             )
 
-    def init_chunking(self) -> List[Dict[str, Any]]:
+    @contextmanager
+    def startup_timer(self, component: str) -> Iterator[None]:
+        """
+        Record the time spent starting a component
+        """
+        start = time.perf_counter()
+        yield
+        self.startup_timings[component] = (time.perf_counter() - start) * 1000
+        logger.info(f"{component} iniciado en {self.startup_timings[component]:.0f} ms")
+
+    def startup_report(self) -> Dict[str, float]:
+        """
+        Milliseconds spent starting each component initialized so far
+        """
+        return dict(self.startup_timings)
+
+    @property
+    def client(self) -> "VectorStoreClient":
+        """
+        Vector store client, connects to the database and checks the collection on first use
+        raises an error if the connection is not possible
+        """
+        if self._client is None:
+            with self._components_lock:
+                if self._client is None:
+                    try:
+                        with self.startup_timer("vector_store"):
+                            from .vector_store_client.vector_client import VectorStoreClient
+
+                            self._client = VectorStoreClient(**self._client_kwargs)
+                    except ValueError as e:
+                        raise ValueError(
+                            f"Problema estableciendo la conguracion inicial del programa {e}"
+                        )
+        return self._client
+
+    @property
+    def retriever(self) -> "Retriever":
+        if self._retriever is None:
+            with self._components_lock:
+                if self._retriever is None:
+                    with self.startup_timer("retriever"):
+                        from .retrievers.retriever import Retriever
+
+                        self._retriever = Retriever()
+        return self._retriever
+
+    def init_chunking(self, files: List[str] = None) -> Iterator[Chunk]:
+        """
+        Split the extracted documents (pages staging files, all the files in the staging
+        path by default) into chunks
+        Chunks are yielded as they are produced, only one document is kept in memory at a time
+        """
         try:
             logging.info("Iniciando el proceso de segmentación")
-            data_content=glob.glob(self.path + "/*_pre.json")
-            data_store: List[str] = []
+            data_content = files if files is not None else self.staging.staged()
+            total = 0
             for file in data_content:
-                with open(file, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-                    chunker = Chunker(data)
-                    chunks: List[Dict[str, Any]] = chunker.chunking_hybrid()
-                    data_store = [chunk for chunk in chunks]
+                data = [self.staging.document(file)]
+                chunker = Chunker(data, output_path=self.path, **self.chunker_params)
+                for chunk in chunker.chunking_hybrid():
+                    total += 1
+                    yield chunk
 
-            logger.info(f"Se generaron {len(data_store)} chunks")
+            logger.info(f"Se generaron {total} chunks")
         except ValueError as e:
             raise ValueError(f"Problema con la segmentación de los documentos{e}")
-        return data_store
 
-    def init_loading(self):
+    def staged_chunks(self, file_names: List[str] = None) -> Iterator[Chunk]:
+        """
+        Stream the chunks already stored in the staging path (all the documents by default),
+        used by `reindex` to embed them again without extracting and chunking the documents
+        """
+        if file_names is None:
+            files = [StagingFile(path) for path in self.staging.staged(StagingStore.CHUNKS)]
+        else:
+            files = [self.staging.chunks(file_name) for file_name in file_names]
+        for chunks in files:
+            if not chunks.exists():
+                raise ValueError(f"No existen chunks en {chunks.path}")
+            for record in chunks:
+                yield Chunk(**record)
+
+    def init_loading(self, pdf_files: List[str] = None) -> Iterator[Tuple[str, str]]:
         """
         Extraction and cleaning of the data
+        Yields the path of each PDF and of its pages staging file as soon as it is extracted
         """
         try:
             logger.info("Inicializando el proceso de carga de datos")
-            p = Processing()
-            p.pdf_to_json()
+            from .loaders.proccesing import Processing
+
+            p = Processing(output=self.path)
+            yield from p.extract(pdf_files)
 
         except ValueError:
             raise ValueError("Problema con la carga de datos")
 
-    def init_embedding(self, data):
+    def manifest_params(self) -> Dict[str, Any]:
+        """
+        Parameters recorded in the manifest, a document is re-ingested when they change
+        """
+        # Version of the structured metadata stored in the payload of the chunks
+        params = {**self.chunker_params, "tokenizer": tokenizer_name(), "metadata": 2}
+        if self.summary_params["enabled"]:
+            params["summaries"] = True
+        return params
+
+    def init_summarizer(self):
         """
-        Load embedding into the database
+        Summarizer of the chunks, None if the summaries are disabled
+        """
+        if not self.summary_params["enabled"]:
+            return None
+        from .retrievers.summaries import ChunkSummarizer
+
+        summarizer = ChunkSummarizer(
+            self.retriever.llm,
+            cache_path=os.path.join(self.path, "summaries_cache.sqlite"),
+            concurrency=self.summary_params["concurrency"],
+        )
+        registry.register_collector("chunk_summaries", summarizer.stats)
+        return summarizer
+
+    def init_embedding(self, data: Iterable[Chunk], on_written=None) -> List[str]:
+        """
+        Summarize (if enabled) and embed the chunks and load them into the database
+        `on_written` receives the points of each batch written
+        Returns the ids of the inserted points
         """
         try:
             logger.info("Inicializando el proceso de embedding")
-            for i in range(0, len(data), 1000):
-                asyncio.run(self.client.insert_embeddings(data[i : i + 1000]))
+            from .vector_store_client.ingestion import IngestionPipeline
+
+            pipeline = IngestionPipeline(
+                self.client,
+                summarizer=self.init_summarizer(),
+                on_written=on_written,
+                **self.ingestion_params,
+            )
+            ids: List[str] = asyncio.run(pipeline.run(data))
         except ValueError:
             raise ValueError("Problema generando los embeddings")
-        return data
+        return ids
 
     def init_pipeline(self):
         """
         Orchestrates the pipeline execution steps
+        Only the documents that are new or changed since the last run (according to the
+        manifest) are extracted, chunked and embedded. Points of removed documents and
+        stale points of changed documents are deleted from the collection.
+        The stages are chained as a stream: each document is chunked as soon as it is
+        extracted and its chunks are embedded while the next documents are processed.
         """
-        self.init_loading()
-        data: List[Dict[str, Any]] = self.init_chunking()
-        data: List[Dict[str, Any]] = self.init_embedding(data)
+        with registry.span("pipeline"):
+            self._init_pipeline()
+        registry.export()
+
+    def _init_pipeline(self):
+        from .loaders.proccesing import Processing
+
+        pdf_files: List[str] = Processing().load_pdfs()
+        if not self.client.vector_check():
+            # Empty collection (new collection, embedding model or backend): the documents whose
+            # chunks are staged with the current parameters are embedded again without extracting them
+            params = self.manifest_params()
+            self.reindex([
+                path for path in pdf_files
+                if self.manifest.is_current(path, params) and self.staging.chunks(path).exists()
+            ])
+
+        removed: List[str] = self.manifest.removed(pdf_files)
+        with registry.span("pipeline_cleanup"):
+            for file_name in removed:
+                logger.info(f"El documento {file_name} ya no existe, eliminando sus puntos")
+                self.client.delete_points(self.manifest.point_ids(file_name))
+                self.manifest.remove(file_name)
+            self.manifest.save()
+
+        changed: List[str] = self.manifest.changed(pdf_files, self.manifest_params())
+        logger.info(
+            f"{len(changed)} de {len(pdf_files)} documentos son nuevos o fueron modificados"
+        )
+        if removed or changed:
+            self.answer_cache.clear()
+        if not changed:
+            with registry.span("lexical_index"):
+                if removed:
+                    self.client.lexical_index.commit(replaced_files=removed)
+                elif not self.client.lexical_index.exists() and self.manifest.entries:
+                    self.client.rebuild_lexical_index()
+            return
+
+        # Documents without a manifest entry may have points written before the manifest existed
+        # (random ids, not replaced by the new ones), they are removed before ingesting the document
+        untracked = [
+            os.path.basename(pdf_path) for pdf_path in changed
+            if os.path.basename(pdf_path) not in self.manifest.entries
+        ]
+        if untracked:
+            with registry.span("pipeline_cleanup"):
+                logger.info(f"{len(untracked)} documentos no estan en el manifiesto, eliminando sus puntos previos")
+                self.client.delete_files(untracked)
+
+        ids_by_file: Dict[str, List[str]] = {}
+
+        def stream() -> Iterator[Chunk]:
+            # Extraction and chunking run interleaved with the embedding, only the time
+            # spent producing the documents and the chunks is recorded for each stage
+            for pdf_path, pre_file in registry.timed(self.init_loading(changed), "extraction", per_item=True):
+                file_ids = ids_by_file.setdefault(os.path.basename(pdf_path), [])
+                for chunk in registry.timed(self.init_chunking([pre_file]), "chunking"):
+                    file_ids.append(self.client.point_id(chunk.metadata, chunk.contenido))
+                    yield chunk
+
+        with registry.span("pipeline_ingestion"):
+            self.init_embedding(stream(), on_written=self.stage_lexical)
+
+        with registry.span("pipeline_cleanup"):
+            for pdf_path in changed:
+                file_name = os.path.basename(pdf_path)
+                ids = ids_by_file.get(file_name, [])
+                stale = set(self.manifest.point_ids(file_name)) - set(ids)
+                self.client.delete_points(list(stale))
+                self.manifest.record(pdf_path, self.manifest_params(), ids)
+            self.manifest.save()
+        with registry.span("lexical_index"):
+            self.client.lexical_index.commit(
+                replaced_files=removed + [os.path.basename(pdf_path) for pdf_path in changed])
+        # Answers cached while the ingestion was running may be based on the old collection
+        self.answer_cache.clear()
+
+    def stage_lexical(self, points) -> None:
+        """
+        Stage the written points in the lexical index, once written so the lexical documents
+        carry the summaries of the chunks
+        """
+        for point in points:
+            self.client.lexical_index.stage(
+                point.id, point.payload["metadata"]["file_name"],
+                point.payload["page_content"], point.payload.get("summary"), point.payload["metadata"])
+
+    def reindex(self, pdf_files: List[str]) -> None:
+        """
+        Rebuild the empty collection and the lexical index from the staged chunks of the documents,
+        the manifest only keeps these documents, the others are processed again by the pipeline
+        """
+        self.manifest.clear()
+        self.client.lexical_index.build([])
+        if pdf_files:
+            total = sum(len(self.staging.chunks(pdf_path)) for pdf_path in pdf_files)
+            logger.info(f"Reindexando {len(pdf_files)} documentos desde los {total} chunks guardados")
+            ids_by_file: Dict[str, List[str]] = {}
+
+            def stream() -> Iterator[Chunk]:
+                for pdf_path in pdf_files:
+                    file_ids = ids_by_file.setdefault(os.path.basename(pdf_path), [])
+                    for chunk in self.staged_chunks([pdf_path]):
+                        file_ids.append(self.client.point_id(chunk.metadata, chunk.contenido))
+                        yield chunk
+
+            with registry.span("pipeline_reindex"):
+                self.init_embedding(stream(), on_written=self.stage_lexical)
+            for pdf_path in pdf_files:
+                self.manifest.record(pdf_path, self.manifest_params(), ids_by_file.get(os.path.basename(pdf_path), []))
+            with registry.span("lexical_index"):
+                self.client.lexical_index.commit()
+        self.manifest.save()
 
     def db_check_vector(self) -> None:
         """
@@ -116,11 +391,220 @@ class Controler:
         except ValueError:
             raise ValueError("Problema con la base de datos")
 
-    def process_query(self, query: str) -> List[Document]:
+    def export_snapshot(self, path: str, dtype: str = "float32") -> Dict[str, Any]:
+        """
+        Export the collection (vectors, payloads, schema) and the manifest of the documents to `path`
+        """
+        from .vector_store_client.snapshot import export_snapshot
+
+        return export_snapshot(self.client, path, manifest_path=self.manifest.path, dtype=dtype)
+
+    def import_snapshot(self, path: str, replace: bool = False, **kwargs) -> Dict[str, Any]:
+        """
+        Bootstrap the collection from a snapshot without extracting the documents nor calling
+        the embedding model. A missing collection is created with the schema of the snapshot
+        and its manifest replaces the local one, so the pipeline only processes the documents
+        that changed since the export.
+        """
+        from .vector_store_client.schema import params_from_dict
+        from .vector_store_client.snapshot import MANIFEST_FILE, import_snapshot, read_snapshot
+
+        info = read_snapshot(path)
+        if self._client is None:
+            self._client_kwargs.setdefault("vector_params", params_from_dict(info["vector_params"]))
+        result = import_snapshot(
+            self.client, path, replace=replace,
+            batch_size=kwargs.get("batch_size", self.ingestion_params["batch_size"]),
+            concurrency=kwargs.get("concurrency", self.ingestion_params["concurrency"]))
+        if info["manifest"]:
+            with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as file:
+                self.manifest.entries = json.load(file)
+        else:
+            self.manifest.clear()
+        self.manifest.save()
+        self.answer_cache.clear()
+        return result
+
+    def retrieve(self, query: str) -> List[SearchResult]:
+        """
+        Search the query, restricted to the chapter, articles or resolutions named in it
+        The whole collection is searched if no chunk matches the references
+        """
+        return self.retrieve_batch([query])[0]
+
+    def retrieve_batch(self, queries: List[str]) -> List[List[SearchResult]]:
+        """
+        Batch version of `retrieve`, the queries with the same filters are searched together
+        """
+        routes = [self.router.route(query) if self.router else {} for query in queries]
+        groups: Dict[str, List[int]] = {}
+        for index, filters in enumerate(routes):
+            groups.setdefault(json.dumps(filters, sort_keys=True), []).append(index)
+        results: List[List[SearchResult]] = [[] for _ in queries]
+        for indexes in groups.values():
+            filters = routes[indexes[0]]
+            found = self.client.search_batch([queries[index] for index in indexes], filters=filters or None)
+            for index, resultados in zip(indexes, found):
+                results[index] = resultados
+                if filters:
+                    registry.increment("routed_queries_total", matched=bool(resultados))
+        unmatched = [index for index, filters in enumerate(routes) if filters and not results[index]]
+        if unmatched:
+            logger.info(f"{len(unmatched)} consultas no coinciden con sus filtros, se busca en toda la coleccion")
+            found = self.client.search_batch([queries[index] for index in unmatched])
+            for index, resultados in zip(unmatched, found):
+                results[index] = resultados
+        return results
+
+    def process_query(self, query: str, session_id: str = "default") -> Tuple[str, str]:
+        """
+        Answer the query with the naive and the enhanced methods
+        Cached answers are returned right away, other queries go through the scheduler: they wait
+        for a free slot (in round-robin order with the other sessions) and identical questions
+        in flight are answered only once
+        """
+        cached = self.answer_cache.get(query)
+        if cached is not None:
+            logger.info("Respuesta obtenida del cache")
+            return cached
+        return self.scheduler.run(
+            session_id, AnswerCache.normalize(query), lambda: self.aprocess_query(query))
+
+    async def aprocess_query(self, query: str) -> Tuple[str, str]:
+        """
+        Answer the query with the naive and the enhanced methods, both answers are generated concurrently
+        """
         logger.info(f"Procesando la consulta: {query}")
-        lista_resultados,query_results = self.client.search(query)
-        contenido = "\n".join([doc.get("page_content") for doc in lista_resultados])
-        respuesta_naive,respuesta_enhanced = self.retriever.process_query(list_documents=query_results,question=query, context=contenido)
+        with registry.span("query"):
+            # Cache and search calls may block on the network, they run outside the event loop
+            cached = await asyncio.to_thread(self.answer_cache.get, query)
+            if cached is not None:
+                logger.info("Respuesta obtenida del cache")
+                return cached
+            with registry.span("retrieval"):
+                resultados: List[SearchResult] = await asyncio.to_thread(self.retrieve, query)
+            with registry.span("context_selection"):
+                resultados = self.context_builder.select(resultados)
+            contenido = "\n".join([resultado.text for resultado in resultados])
+            with registry.span("generation"):
+                respuesta_naive,respuesta_enhanced = await self.retriever.aprocess_query(list_documents=resultados,question=query, context=contenido)
 
-        # respuesta_formateada=Formater.format_data(respuesta)
+            # respuesta_formateada=Formater.format_data(respuesta)
+            await asyncio.to_thread(self.answer_cache.put, query, (respuesta_naive, respuesta_enhanced))
+        registry.export()
         return respuesta_naive,respuesta_enhanced
+
+    def process_queries(
+        self,
+        queries: List[str],
+        max_concurrency: int = 4,
+        results: Optional[List[List[SearchResult]]] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Answer several queries with the naive and the enhanced methods
+        Synchronous wrapper of `aprocess_queries`, use `aprocess_queries` inside a running event loop
+        """
+        return run_sync(
+            lambda: self.aprocess_queries(queries, max_concurrency=max_concurrency, results=results),
+            "aprocess_queries(...)")
+
+    async def aprocess_queries(
+        self,
+        queries: List[str],
+        max_concurrency: int = 4,
+        results: Optional[List[List[SearchResult]]] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Answer several queries, the retrieval of all the queries is done with one batch search
+        and at most `max_concurrency` queries are sent to the LLM at the same time
+        When the `results` of a previous `retrieve_batch` of the queries are given, the answers
+        are generated from them without searching again, the answer cache is neither read nor
+        written since the answers depend on the given context
+        """
+        logger.info(f"Procesando {len(queries)} consultas")
+        given = results is not None
+        if given:
+            if len(results) != len(queries):
+                raise ValueError(f"Se recibieron {len(results)} resultados para {len(queries)} consultas")
+            retrieved: Dict[str, List[SearchResult]] = {}
+            for query, resultados in zip(queries, results):
+                retrieved.setdefault(query, resultados)
+            cached = {query: None for query in retrieved}
+            pending = list(retrieved)
+            results = list(retrieved.values())
+        else:
+            # Cache and search calls may block on the network, they run outside the event loop
+            cached = await asyncio.to_thread(
+                lambda: {query: self.answer_cache.get(query) for query in dict.fromkeys(queries)})
+            pending = [query for query, answer in cached.items() if answer is None]
+            with registry.span("retrieval", batch=True):
+                results = await asyncio.to_thread(self.retrieve_batch, pending)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(query: str, resultados: List[SearchResult]) -> None:
+            resultados = self.context_builder.select(resultados)
+            contenido = "\n".join([resultado.text for resultado in resultados])
+            async with semaphore:
+                cached[query] = await self.retriever.aprocess_query(
+                    list_documents=resultados, question=query, context=contenido)
+            if not given:
+                await asyncio.to_thread(self.answer_cache.put, query, cached[query])
+
+        with registry.span("generation", batch=True):
+            await asyncio.gather(*[answer(query, result) for query, result in zip(pending, results)])
+        registry.export()
+        return [cached[query] for query in queries]
+
+    def stream_query(self, query: str, session_id: str = "default") -> Iterator[Tuple[str, str]]:
+        """
+        Stream the tokens of the naive and enhanced answers as they are generated.
+        The asynchronous stream runs in the scheduler loop so the tokens can be consumed
+        from synchronous code such as the Streamlit script. When the same question is
+        already being answered for another request, the final answers are yielded whole.
+
+        Yields:
+            Tuple[str, str]: the method ("naive" or "enhanced") and the token.
+        """
+        logger.info(f"Procesando la consulta en streaming: {query}")
+        cached = self.answer_cache.get(query)
+        if cached is not None:
+            logger.info("Respuesta obtenida del cache")
+            yield "naive", cached[0]
+            yield "enhanced", cached[1]
+            return
+        started = time.perf_counter()
+        tokens: queue.Queue = queue.Queue()
+        done = object()
+
+        async def produce() -> Tuple[str, str]:
+            respuestas = {"naive": "", "enhanced": ""}
+            try:
+                with registry.span("retrieval"):
+                    resultados: List[SearchResult] = await asyncio.to_thread(self.retrieve, query)
+                with registry.span("context_selection"):
+                    resultados = self.context_builder.select(resultados)
+                contenido = "\n".join([resultado.text for resultado in resultados])
+                async for item in self.retriever.astream_query(
+                    list_documents=resultados, question=query, context=contenido
+                ):
+                    respuestas[item[0]] += item[1]
+                    tokens.put(item)
+            finally:
+                tokens.put(done)
+            respuesta = (respuestas["naive"], respuestas["enhanced"])
+            await asyncio.to_thread(self.answer_cache.put, query, respuesta)
+            return respuesta
+
+        future, leader = self.scheduler.submit(session_id, AnswerCache.normalize(query), produce)
+        if not leader:
+            logger.info("La consulta ya se esta respondiendo, se espera su resultado")
+            respuesta_naive, respuesta_enhanced = future.result()
+            yield "naive", respuesta_naive
+            yield "enhanced", respuesta_enhanced
+            return
+        while (item := tokens.get()) is not done:
+            yield item
+        # Surface the errors raised while answering
+        future.result()
+        registry.observe("stage_latency_ms", (time.perf_counter() - started) * 1000, stage="query", streaming=True)
+        registry.export()
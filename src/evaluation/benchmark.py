@@ -0,0 +1,427 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+from langchain_core.embeddings import Embeddings
+import argparse
+import ast
+import asyncio
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from ..chunking.chunker import Chunk, Chunker
+from ..loaders.proccesing import Processing
+from ..loaders.staging import StagingStore
+from ..vector_store_client.ingestion import IngestionPipeline
+from ..vector_store_client.lexical_index import tokenize
+from ..vector_store_client.schema import QUANTIZATIONS, vector_params
+from ..vector_store_client.vector_client import VectorStoreClient
+
+"""
+    Offline benchmark of the ingestion and the retrieval stack
+
+    python -m src.evaluation.benchmark --pdfs data/reglamentacion data/archivos
+"""
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings computed locally: each word and pair of words is hashed
+    into one of `size` dimensions. Keeps the benchmark runnable without network when
+    no recorded embeddings are available, the quality metrics are then lexical.
+    """
+
+    def __init__(self, size: int = 1536):
+        self.size: int = size
+
+    def embed(self, text: str) -> List[float]:
+        terms = tokenize(text)
+        terms += [f"{first} {second}" for first, second in zip(terms, terms[1:])]
+        vector = np.zeros(self.size, dtype=np.float32)
+        if terms:
+            hashes = np.fromiter((zlib.crc32(term.encode("utf-8")) for term in terms), dtype=np.int64)
+            np.add.at(vector, hashes % self.size, np.where(hashes & (1 << 31), -1.0, 1.0))
+            vector /= np.linalg.norm(vector) or 1
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed(text)
+
+
+class RecordedEmbeddings(Embeddings):
+    """
+    Placeholder model behind the embedding cache when replaying recorded embeddings,
+    any text that was not recorded is an error instead of a call to the API
+    """
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise ValueError(f"No hay embeddings grabados para {len(texts)} textos, ejecute con --embeddings record")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """
+    Summary of a list of latencies in milliseconds
+    """
+    if not values:
+        return {}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def coverage(reference: str, text: str, size: int = 3) -> float:
+    """
+    Fraction of the word n-grams of the reference that appear in the text
+    """
+    reference_terms = tokenize(reference)
+    text_terms = tokenize(text)
+    reference_grams = {tuple(reference_terms[i : i + size]) for i in range(max(len(reference_terms) - size + 1, 1))}
+    text_grams = {tuple(text_terms[i : i + size]) for i in range(max(len(text_terms) - size + 1, 1))}
+    return len(reference_grams & text_grams) / len(reference_grams) if reference_grams else 0.0
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    Questions of the metrics file with their reference answer and the contexts retrieved
+    when the metrics were computed, each question is kept once
+    """
+    metrics = pd.read_csv(path)
+    questions = []
+    for _, row in metrics.drop_duplicates("user_input").iterrows():
+        contexts = row.get("retrieved_contexts")
+        questions.append({
+            "question": row["user_input"],
+            "reference": row["reference"] if isinstance(row["reference"], str) else "",
+            "contexts": ast.literal_eval(contexts) if isinstance(contexts, str) else [],
+        })
+    return questions
+
+
+class RetrievalBenchmark:
+    """
+    Runs the ingestion of a set of PDFs into a local backend and replays the questions
+    of `data/metrics.csv` against the retrieval stack, without calling the OpenAI API:
+     - embeddings="recorded": embeddings read from the cache recorded by a previous run
+     - embeddings="record": embeddings computed with the OpenAI model and recorded
+     - embeddings="hashing": local hashing embeddings, cached inside `workdir` so they never
+       mix with the recorded ones
+    Everything is written inside `workdir`, which is cleared unless `reuse_staging`
+    keeps the extracted pages of a previous run.
+    """
+
+    def __init__(
+        self,
+        pdf_paths: List[str],
+        metrics_path: str = "./data/metrics.csv",
+        workdir: str = "./data/benchmark",
+        embeddings: str = "hashing",
+        embedding_cache: str = "./benchmark/fixtures/embeddings_cache.sqlite",
+        model_name: str = "text-embedding-ada-002",
+        ks: Sequence[int] = (1, 5, 10),
+        repeat: int = 3,
+        hybrid: bool = True,
+        coverage_threshold: float = 0.5,
+        reuse_staging: bool = False,
+        quantizations: Sequence[str] = QUANTIZATIONS,
+        oversamplings: Sequence[float] = (1.0, 2.0, 4.0),
+    ):
+        self.pdf_paths: List[str] = pdf_paths
+        self.metrics_path: str = metrics_path
+        self.workdir: str = workdir
+        self.embeddings: str = embeddings
+        self.embedding_cache: str = embedding_cache
+        self.model_name: str = model_name
+        self.ks: List[int] = sorted(ks)
+        self.repeat: int = repeat
+        self.hybrid: bool = hybrid
+        self.coverage_threshold: float = coverage_threshold
+        self.reuse_staging: bool = reuse_staging
+        self.quantizations: List[str] = list(quantizations)
+        self.oversamplings: List[float] = list(oversamplings)
+        self.staging_path: str = os.path.join(workdir, "staging")
+
+    def pdf_files(self) -> List[str]:
+        files = []
+        for path in self.pdf_paths:
+            files.extend(sorted(glob.glob(os.path.join(path, "*.pdf"))) if os.path.isdir(path) else [path])
+        return files
+
+    def embedding_model(self) -> Embeddings:
+        if self.embeddings == "hashing":
+            return HashingEmbeddings()
+        if self.embeddings == "recorded":
+            if not os.path.exists(self.embedding_cache):
+                raise ValueError(
+                    f"No existe el cache de embeddings grabados {self.embedding_cache}, ejecute con --embeddings record")
+            return RecordedEmbeddings()
+        if self.embeddings == "record":
+            from langchain_openai import OpenAIEmbeddings
+
+            return OpenAIEmbeddings(model=self.model_name)
+        raise ValueError(f"Modo de embeddings no soportado: {self.embeddings}")
+
+    def build_client(self) -> VectorStoreClient:
+        # The hashing vectors are cached apart from the recorded ones
+        hashing = self.embeddings == "hashing"
+        return VectorStoreClient(
+            type="local",
+            path=os.path.join(self.workdir, "local_store"),
+            collection="benchmark",
+            embeddings=self.embedding_model(),
+            model_name="hashing" if hashing else self.model_name,
+            embedding_cache=os.path.join(self.workdir, "embeddings_cache.sqlite") if hashing else self.embedding_cache,
+            lexical_index=os.path.join(self.workdir, "lexical_index"),
+        )
+
+    def run_ingestion(self, client: VectorStoreClient) -> Dict[str, Any]:
+        """
+        Extract, chunk and embed the PDFs, measuring the throughput of each stage
+        """
+        pdf_files = self.pdf_files()
+        pdf_mb = sum(os.path.getsize(path) for path in pdf_files) / 2**20
+        staging = StagingStore(self.staging_path)
+
+        started = time.perf_counter()
+        reused = self.reuse_staging and len(staging.staged()) == len(pdf_files)
+        if reused:
+            pages_files = staging.staged()
+        else:
+            pages_files = Processing(output=self.staging_path).pdf_to_json(pdf_files)
+        extraction_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        chunks: List[Chunk] = []
+        for pages_file in pages_files:
+            chunker = Chunker([staging.document(pages_file)], output_path=self.staging_path)
+            chunks.extend(chunker.chunking_hybrid())
+        chunking_s = time.perf_counter() - started
+        text_mb = sum(len(chunk.contenido.encode("utf-8")) for chunk in chunks) / 2**20
+
+        started = time.perf_counter()
+        pipeline = IngestionPipeline(client)
+        asyncio.run(pipeline.run(iter(chunks)))
+        ingestion_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        client.rebuild_lexical_index()
+        indexing_s = time.perf_counter() - started
+
+        def stage(seconds: float) -> Dict[str, float]:
+            return {"seconds": seconds, "pdf_mb_per_s": pdf_mb / seconds if seconds else None}
+
+        return {
+            "documents": len(pdf_files),
+            "pdf_mb": pdf_mb,
+            "chunks": len(chunks),
+            "chunk_text_mb": text_mb,
+            "extraction": {**stage(extraction_s), "reused_staging": reused},
+            "chunking": {**stage(chunking_s), "chunks_per_s": len(chunks) / chunking_s if chunking_s else None},
+            "ingestion": {**stage(ingestion_s), "chunks_per_s": len(chunks) / ingestion_s if ingestion_s else None},
+            "lexical_indexing": stage(indexing_s),
+            "embedding_cache": client.cache_stats(),
+        }
+
+    def run_queries(self, client: VectorStoreClient) -> Dict[str, Any]:
+        """
+        Latency, throughput and recall@k of the questions of the metrics file
+        """
+        questions = load_questions(self.metrics_path)
+        texts = [question["question"] for question in questions]
+        limit = max(self.ks)
+        # Warm-up: embeddings of the questions and page cache of the collection
+        client.search_batch(texts, limit=limit, hybrid=self.hybrid)
+
+        latencies: List[float] = []
+        stages: Dict[str, List[float]] = {}
+        results = {}
+        started = time.perf_counter()
+        for _ in range(self.repeat):
+            for text in texts:
+                query_started = time.perf_counter()
+                results[text] = client.search(text, limit=limit, hybrid=self.hybrid)
+                latencies.append((time.perf_counter() - query_started) * 1000)
+                for name, value in client.timings.items():
+                    stages.setdefault(name, []).append(value)
+        sequential_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(self.repeat):
+            client.search_batch(texts, limit=limit, hybrid=self.hybrid)
+        batch_s = time.perf_counter() - started
+
+        recall = {k: 0 for k in self.ks}
+        reference_recall = {k: 0 for k in self.ks}
+        per_question = []
+        for question in questions:
+            retrieved = results[question["question"]]
+            scores = [coverage(question["reference"], result.text) for result in retrieved]
+            # Rank of the first retrieved chunk covering each of the original contexts
+            context_ranks = [
+                next((rank for rank, result in enumerate(retrieved)
+                      if coverage(context, result.text) >= self.coverage_threshold), None)
+                for context in question["contexts"]
+            ]
+            for k in self.ks:
+                if any(score >= self.coverage_threshold for score in scores[:k]):
+                    recall[k] += 1
+                if context_ranks:
+                    found = sum(1 for rank in context_ranks if rank is not None and rank < k)
+                    reference_recall[k] += found / len(context_ranks)
+            per_question.append({
+                "question": question["question"],
+                "best_coverage": max(scores, default=0.0),
+                "first_hit": next((rank + 1 for rank, score in enumerate(scores) if score >= self.coverage_threshold), None),
+                "contexts_found": sum(1 for rank in context_ranks if rank is not None),
+            })
+
+        total = len(questions) or 1
+        return {
+            "questions": len(questions),
+            "limit": limit,
+            "hybrid": self.hybrid,
+            "latency_ms": percentiles(latencies),
+            "stages_ms": {name: percentiles(values) for name, values in stages.items()},
+            "throughput_qps": len(latencies) / sequential_s if sequential_s else None,
+            "batch_throughput_qps": len(texts) * self.repeat / batch_s if batch_s else None,
+            # A question is answered at k if a chunk of the top k covers the reference answer
+            "recall_at_k": {str(k): hits / total for k, hits in recall.items()},
+            # Fraction of the contexts retrieved when the metrics were computed found in the top k
+            "context_recall_at_k": {str(k): hits / total for k, hits in reference_recall.items()},
+            "per_question": per_question,
+        }
+
+    def run_quantization(self, client: VectorStoreClient) -> List[Dict[str, Any]]:
+        """
+        Memory, latency and recall of the dense search with each quantization and oversampling,
+        the recall@k is the fraction of the exact top k (original vectors) retrieved
+        """
+        texts = [question["question"] for question in load_questions(self.metrics_path)]
+        limit = max(self.ks)
+        backend = client.client
+        original = backend.params
+        exact = client.search_batch(texts, limit=limit, hybrid=False, exact=True)
+        exact_ids = [[result.id for result in results] for results in exact]
+
+        report = []
+        try:
+            for quantization in self.quantizations:
+                params = vector_params(
+                    original.size, quantization=quantization, on_disk=original.on_disk)
+                backend.update_params(params)
+                for oversampling in (self.oversamplings if quantization != "none" else [None]):
+                    # Warm-up: quantized vectors and page cache of the collection
+                    client.search_batch(texts, limit=limit, hybrid=False, oversampling=oversampling)
+                    latencies: List[float] = []
+                    recall = {k: 0.0 for k in self.ks}
+                    for _ in range(self.repeat):
+                        for text, expected in zip(texts, exact_ids):
+                            results = client.search(text, limit=limit, hybrid=False, oversampling=oversampling)
+                            latencies.append(client.timings["database_ms"])
+                            retrieved = [result.id for result in results]
+                            for k in self.ks:
+                                recall[k] += len(set(retrieved[:k]) & set(expected[:k])) / max(len(expected[:k]), 1)
+                    total = len(texts) * self.repeat or 1
+                    report.append({
+                        "quantization": quantization,
+                        "oversampling": oversampling,
+                        **backend.memory_usage(),
+                        "search_latency_ms": percentiles(latencies),
+                        "recall_at_k": {str(k): hits / total for k, hits in recall.items()},
+                    })
+        finally:
+            backend.update_params(original)
+        return report
+
+    def run(self) -> Dict[str, Any]:
+        if not self.reuse_staging:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        else:
+            for name in ("local_store", "lexical_index"):
+                shutil.rmtree(os.path.join(self.workdir, name), ignore_errors=True)
+        os.makedirs(self.staging_path, exist_ok=True)
+        client = self.build_client()
+        return {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "config": {
+                "pdfs": self.pdf_paths,
+                "metrics": self.metrics_path,
+                "embeddings": self.embeddings,
+                "model_name": self.model_name,
+                "ks": self.ks,
+                "repeat": self.repeat,
+                "coverage_threshold": self.coverage_threshold,
+            },
+            "ingestion": self.run_ingestion(client),
+            "queries": self.run_queries(client),
+            "quantization": self.run_quantization(client) if self.quantizations else [],
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark offline de la ingesta y la recuperacion")
+    parser.add_argument("--pdfs", nargs="+", default=["./data/reglamentacion", "./data/archivos"])
+    parser.add_argument("--metrics", default="./data/metrics.csv")
+    parser.add_argument("--workdir", default="./data/benchmark")
+    parser.add_argument("--embeddings", choices=["recorded", "record", "hashing"], default="hashing",
+                        help="'record' graba los embeddings de OpenAI en --embedding-cache y 'recorded' los reutiliza")
+    parser.add_argument("--embedding-cache", default="./benchmark/fixtures/embeddings_cache.sqlite",
+                        help="cache de los embeddings grabados, no se usa con --embeddings hashing")
+    parser.add_argument("--model", default=os.getenv("PIPE_EMBEDDING_MODEL", "text-embedding-ada-002"))
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 5, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dense", action="store_true", help="desactiva la busqueda hibrida")
+    parser.add_argument("--reuse-staging", action="store_true")
+    parser.add_argument("--quantization", nargs="*", choices=QUANTIZATIONS, default=list(QUANTIZATIONS),
+                        help="cuantizaciones comparadas con la busqueda exacta, ninguna para omitir la comparacion")
+    parser.add_argument("--oversampling", nargs="+", type=float, default=[1.0, 2.0, 4.0])
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    benchmark = RetrievalBenchmark(
+        args.pdfs,
+        metrics_path=args.metrics,
+        workdir=args.workdir,
+        embeddings=args.embeddings,
+        embedding_cache=args.embedding_cache,
+        model_name=args.model,
+        ks=args.k,
+        repeat=args.repeat,
+        hybrid=not args.dense,
+        reuse_staging=args.reuse_staging,
+        quantizations=args.quantization,
+        oversamplings=args.oversampling,
+    )
+    results = benchmark.run()
+
+    output = args.output or os.path.join(
+        "./benchmark/results", f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    queries = results["queries"]
+    logger.info(
+        f"Resultados guardados en {output}: p50 {queries['latency_ms']['p50']:.1f} ms, "
+        f"p95 {queries['latency_ms']['p95']:.1f} ms, recall@k {queries['recall_at_k']}"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=" %(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
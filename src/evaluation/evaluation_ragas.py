@@ -1,13 +1,184 @@
-from datasets import Dataset 
-import os
-from ragas import evaluate
-from ragas.metrics import context_precision, faithfulness, answer_relevancy, LLMContextRecall
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence
+import argparse
+import hashlib
+import json
+import logging
 import os
+import sqlite3
+import threading
+import pandas as pd
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Columns of the metrics file read by main_app.get_metrics
+METRICS_COLUMNS = [
+    "user_input", "retrieved_contexts", "response", "reference",
+    "context_precision", "faithfulness", "answer_relevancy", "context_recall", "retrieval",
+]
+METRIC_NAMES = ["context_precision", "faithfulness", "answer_relevancy", "context_recall"]
+
+
+def ragas_metrics(names: Sequence[str]) -> List[Any]:
+    """
+    RAGAS metric objects by name, ragas is imported on demand
+    """
+    from ragas.metrics import context_precision, faithfulness, answer_relevancy, LLMContextRecall
+
+    available = {
+        "context_precision": context_precision,
+        "faithfulness": faithfulness,
+        "answer_relevancy": answer_relevancy,
+        "context_recall": LLMContextRecall(),
+    }
+    return [available[name] for name in names]
 
-# Set the OpenAI API key
-os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
 
-def evaluate_ragas(query: str, answer: str,chunks, ground_truth):
+class RagasEvaluator:
+    """
+    Batch RAGAS evaluation of (question, answer, contexts, reference) rows.
+    Each run builds one dataset and `ragas.evaluate` scores it with at most `max_workers`
+    judge calls in flight. Scores are cached on disk by row content and metric, so
+    re-running an evaluation only calls the judge for new or modified rows.
+    """
+
+    def __init__(
+        self,
+        cache_path: str = "./data/staging/ragas_cache.sqlite",
+        max_workers: int = 8,
+        metrics: Sequence[str] = METRIC_NAMES,
+    ):
+        load_dotenv()
+        self.metrics: List[str] = list(metrics)
+        self.max_workers: int = max_workers
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(row: Dict[str, Any], metric: str) -> str:
+        content = json.dumps(
+            [row["user_input"], row["response"], list(row["retrieved_contexts"]), row["reference"], metric],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def cached(self, row: Dict[str, Any], metric: str) -> Optional[float]:
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT score FROM scores WHERE key = ?", (self.key(row, metric),)
+            ).fetchone()
+        return found[0] if found else None
+
+    def store(self, row: Dict[str, Any], metric: str, score: Optional[float]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)",
+                (self.key(row, metric), score),
+            )
+            self._conn.commit()
+
+    def score(self, rows: List[Dict[str, Any]], metrics: Sequence[str]) -> pd.DataFrame:
+        """
+        Evaluate the rows with the metrics in a single ragas run
+        """
+        from datasets import Dataset
+        from ragas import evaluate
+        from ragas.run_config import RunConfig
+
+        dataset = Dataset.from_dict({
+            "user_input": [row["user_input"] for row in rows],
+            "response": [row["response"] for row in rows],
+            "retrieved_contexts": [list(row["retrieved_contexts"]) for row in rows],
+            "reference": [row["reference"] for row in rows],
+        })
+        result = evaluate(
+            dataset,
+            metrics=ragas_metrics(metrics),
+            run_config=RunConfig(max_workers=self.max_workers),
+            raise_exceptions=False,
+        )
+        return result.to_pandas()
+
+    def evaluate(self, rows: List[Dict[str, Any]]) -> pd.DataFrame:
+        """
+        Scores of every row for every metric, only the missing scores are computed
+        Returns a DataFrame with the columns of the metrics file (plus the ones of the rows)
+        """
+        scores: List[Dict[str, Optional[float]]] = []
+        pending: Dict[FrozenSet[str], List[int]] = {}
+        for index, row in enumerate(rows):
+            row_scores = {metric: self.cached(row, metric) for metric in self.metrics}
+            scores.append(row_scores)
+            missing = frozenset(metric for metric, value in row_scores.items() if value is None)
+            if missing:
+                pending.setdefault(missing, []).append(index)
+
+        logger.info(
+            f"Evaluando {sum(len(indexes) for indexes in pending.values())} de {len(rows)} filas, "
+            f"el resto se obtiene del cache"
+        )
+        # Rows missing the same metrics are evaluated together
+        for missing, indexes in pending.items():
+            metrics = [metric for metric in self.metrics if metric in missing]
+            result = self.score([rows[index] for index in indexes], metrics)
+            for index, (_, evaluated) in zip(indexes, result.iterrows()):
+                for metric in metrics:
+                    value = evaluated.get(metric)
+                    value = None if pd.isna(value) else float(value)
+                    scores[index][metric] = value
+                    # Failed judge calls (NaN) are retried in the next run
+                    if value is not None:
+                        self.store(rows[index], metric, value)
+
+        return pd.DataFrame([{**row, **row_scores} for row, row_scores in zip(rows, scores)])
+
+
+def append_metrics(results: pd.DataFrame, path: str = "./data/metrics.csv") -> None:
+    """
+    Append the evaluated rows to the metrics file read by the application
+    """
+    results = results.copy()
+    results["retrieved_contexts"] = results["retrieved_contexts"].apply(lambda contexts: str(list(contexts)))
+    for column in METRICS_COLUMNS:
+        if column not in results:
+            results[column] = None
+    exists = os.path.exists(path)
+    results[METRICS_COLUMNS].to_csv(path, mode="a", header=not exists, index=False)
+    logger.info(f"Se agregaron {len(results)} filas a {path}")
+
+
+def answer_rows(controler, questions: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Answer the questions with the controler and build one row per retrieval method:
+    'Basic' (naive answer) and 'Advanced' (answer over the summarized context)
+    """
+    texts = [question["user_input"] for question in questions]
+    retrieved = controler.retrieve_batch(texts)
+    contexts = [
+        [result.text for result in controler.context_builder.select(results)]
+        for results in retrieved
+    ]
+    # The answers are generated from the same results that are evaluated as contexts
+    answers = controler.process_queries(texts, results=retrieved)
+    rows = []
+    for question, context, (naive, enhanced) in zip(questions, contexts, answers):
+        for retrieval, response in (("Basic", naive), ("Advanced", enhanced)):
+            rows.append({
+                "user_input": question["user_input"],
+                "retrieved_contexts": context,
+                "response": response,
+                "reference": question["reference"],
+                "retrieval": retrieval,
+            })
+    return rows
+
+
+def evaluate_ragas(query: str, answer: str, chunks, ground_truth):
     """
     Evaluate the generated answer with the given query and chunks using RAGAS evaluation metrics.
 
@@ -20,24 +191,35 @@ def evaluate_ragas(query: str, answer: str,chunks, ground_truth):
     Returns:
         pd.DataFrame: A DataFrame containing the evaluation metrics.
     """
-    data = {
-        'question': [
-            query
-        ],
-        'response': [
-                answer
-        ],
-        'contexts': [
-                chunks
-        ],
-        'ground_truth': [
-            ground_truth
-        ]
-    }
+    row = {"user_input": query, "response": answer, "retrieved_contexts": chunks, "reference": ground_truth}
+    return RagasEvaluator().evaluate([row])
+
+
+def main(argv: Optional[List[str]] = None) -> pd.DataFrame:
+    parser = argparse.ArgumentParser(description="Evaluacion RAGAS de las respuestas del sistema")
+    parser.add_argument("--questions", default="./data/questions.csv",
+                        help="csv con las columnas user_input y reference")
+    parser.add_argument("--output", default="./data/metrics.csv",
+                        help="csv de metricas leido por la aplicacion, se agregan las filas evaluadas")
+    parser.add_argument("--cache", default="./data/staging/ragas_cache.sqlite")
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args(argv)
+    if os.path.abspath(args.questions) == os.path.abspath(args.output):
+        parser.error("--questions y --output deben ser archivos distintos")
+
+    from ..controler import Controler
+
+    questions = (
+        pd.read_csv(args.questions)[["user_input", "reference"]]
+        .drop_duplicates("user_input")
+        .to_dict("records")
+    )
+    rows = answer_rows(Controler(), questions)
+    results = RagasEvaluator(args.cache, max_workers=args.max_workers).evaluate(rows)
+    append_metrics(results, args.output)
+    return results
 
-    dataset = Dataset.from_dict(data)
 
-    context_recall = LLMContextRecall()
-    score = evaluate(dataset, metrics=[context_precision, faithfulness, answer_relevancy, context_recall])
-    df = score.to_pandas()
-    return df
\ No newline at end of file
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=" %(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
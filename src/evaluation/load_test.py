@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import pandas as pd
+from .benchmark import HashingEmbeddings, percentiles
+
+"""
+    Load test of the query path with several concurrent sessions, the LLM is
+    replaced by a stub with a fixed latency so no API is called
+
+    python -m src.evaluation.benchmark --embeddings hashing
+    python -m src.evaluation.load_test --sessions 16 --queries 5
+"""
+logger = logging.getLogger(__name__)
+
+
+def run_session(controler, session_id: str, questions: List[str], queries: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Send `queries` questions one after the other, as a user of the chat would
+    """
+    rng = random.Random(seed)
+    records = []
+    for _ in range(queries):
+        question = rng.choice(questions)
+        started = time.perf_counter()
+        try:
+            controler.process_query(question, session_id=session_id)
+            status = "ok"
+        except ConnectionRefusedError:
+            status = "rejected"
+        records.append({
+            "session": session_id,
+            "status": status,
+            "latency_ms": (time.perf_counter() - started) * 1000,
+        })
+    return records
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Prueba de carga de las consultas con varias sesiones")
+    parser.add_argument("--workdir", default="./data/benchmark",
+                        help="directorio de un benchmark ejecutado con --embeddings hashing")
+    parser.add_argument("--metrics", default="./data/metrics.csv")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=5, help="consultas por sesion")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="segundos por respuesta del LLM simulado")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    os.environ["PIPE_LLM"] = "stub"
+    os.environ["PIPE_STUB_LLM_LATENCY"] = str(args.llm_latency)
+    from ..controler import Controler
+    from ..monitoring.metrics import registry
+
+    questions = pd.read_csv(args.metrics)["user_input"].dropna().drop_duplicates().tolist()
+    with tempfile.TemporaryDirectory(prefix="load_test_") as cache_dir:
+        controler = Controler(
+            data_path=os.path.join(args.workdir, "staging"),
+            type="local",
+            path=os.path.join(args.workdir, "local_store"),
+            collection="benchmark",
+            embeddings=HashingEmbeddings(),
+            model_name="hashing",
+            # The query embeddings of the run never reach the cache of the application
+            embedding_cache=os.path.join(cache_dir, "embeddings_cache.sqlite"),
+            lexical_index=os.path.join(args.workdir, "lexical_index"),
+        )
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+            sessions = [
+                executor.submit(run_session, controler, f"session-{i}", questions, args.queries, i)
+                for i in range(args.sessions)
+            ]
+            records = [record for session in sessions for record in session.result()]
+        elapsed = time.perf_counter() - started
+
+    answered = [record["latency_ms"] for record in records if record["status"] == "ok"]
+    waits = [
+        row for row in registry.summary()["histograms"] if row["metric"] == "scheduler_wait_ms"
+    ]
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "queries": len(records),
+        "answered": len(answered),
+        "throughput_qps": len(answered) / elapsed if elapsed else 0.0,
+        "latency_ms": percentiles(answered),
+        "scheduler_wait_ms": waits[0] if waits else {},
+        "scheduler": controler.scheduler.stats(),
+    }
+
+    output = args.output or os.path.join(
+        "./benchmark/results", f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    logger.info(
+        f"Resultados guardados en {output}: {results['answered']} de {results['queries']} consultas respondidas, "
+        f"p95 {results['latency_ms'].get('p95', 0):.1f} ms, "
+        f"{results['scheduler']['coalesced']} agrupadas, {results['scheduler']['rejected']} rechazadas"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=" %(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
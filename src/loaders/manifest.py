@@ -0,0 +1,99 @@
+from typing import Any, Dict, List
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    Persistent record of the ingested documents.
+    Each entry is keyed by the PDF file name and stores the content hash of the file,
+    the chunker parameters used to process it and the ids of the points written to
+    the vector store, so unchanged documents can be skipped on the next run.
+    """
+
+    def __init__(self, path: str = "./data/staging/manifest.json"):
+        self.path: str = path
+        self.entries: Dict[str, Dict[str, Any]] = self.load()
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Load the manifest from disk, an empty manifest is returned if the file does not exist
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except json.JSONDecodeError:
+            logger.warning(f"El manifiesto {self.path} esta corrupto, se ignora")
+            return {}
+
+    def save(self) -> None:
+        """
+        Write the manifest atomically
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """
+        SHA-256 of the file content
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_current(self, path: str, params: Dict[str, Any], content_hash: str = None) -> bool:
+        """
+        Check if the file was already ingested with the same content and chunker parameters
+        """
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None:
+            return False
+        content_hash = content_hash or self.file_hash(path)
+        return entry.get("hash") == content_hash and entry.get("params") == params
+
+    def changed(self, paths: List[str], params: Dict[str, Any]) -> List[str]:
+        """
+        Return the files that are new or whose content or parameters changed
+        """
+        return [path for path in paths if not self.is_current(path, params)]
+
+    def removed(self, paths: List[str]) -> List[str]:
+        """
+        Return the file names registered in the manifest that no longer exist
+        """
+        current = {os.path.basename(path) for path in paths}
+        return [file_name for file_name in self.entries if file_name not in current]
+
+    def point_ids(self, file_name: str) -> List[str]:
+        """
+        Ids of the points stored for the file
+        """
+        return self.entries.get(file_name, {}).get("point_ids", [])
+
+    def record(self, path: str, params: Dict[str, Any], point_ids: List[str]) -> None:
+        """
+        Register a processed file
+        """
+        self.entries[os.path.basename(path)] = {
+            "hash": self.file_hash(path),
+            "params": params,
+            "point_ids": point_ids,
+        }
+
+    def remove(self, file_name: str) -> None:
+        self.entries.pop(file_name, None)
+
+    def clear(self) -> None:
+        self.entries = {}
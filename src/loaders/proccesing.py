@@ -1,10 +1,12 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import glob
 import re
-import json
 import logging
 import pdfplumber
 import os
+import numpy as np
+from .staging import StagingStore
 
 logger = logging.getLogger(__name__)
 
@@ -16,11 +18,20 @@ class Processing:
     """
 
     def __init__(
-        self, path: str = "./data/reglamentacion/", output: str = "./data/staging/"
+        self,
+        path: str = "./data/reglamentacion/",
+        output: str = "./data/staging/",
+        max_workers: Optional[int] = None,
+        pages_per_task: int = 50,
+        skip_unruled_pages: bool = True,
     ):
         self.path:str = path
         self.output:str = output
         self.hooks:List = []
+        self.max_workers: Optional[int] = max_workers
+        self.pages_per_task: int = pages_per_task
+        self.skip_unruled_pages: bool = skip_unruled_pages
+        self.staging: StagingStore = StagingStore(output)
 
     def load_pdfs(self):
         """
@@ -31,63 +42,135 @@ class Processing:
 
         return pdfs
 
-    def not_within_bboxes(self, obj, bboxes):
-        """Check if the object is in any of the table's bbox."""
-
-        def obj_in_bbox(_bbox):
-            v_mid = (obj["top"] + obj["bottom"]) / 2
-            h_mid = (obj["x0"] + obj["x1"]) / 2
-            x0, top, x1, bottom = _bbox
-            return (
-                (h_mid >= x0) and (h_mid < x1) and (v_mid >= top) and (v_mid < bottom)
-            )
-
-        return not any(obj_in_bbox(__bbox) for __bbox in bboxes)
+    def within_bboxes(self, objs: List[Dict[str, Any]], bboxes: List[Tuple[float, float, float, float]]) -> np.ndarray:
+        """
+        Mask of the objects whose center lies in any of the table's bbox,
+        computed for all the objects and bboxes at once.
+        """
+        if not objs or not bboxes:
+            return np.zeros(len(objs), dtype=bool)
+        coords = np.array([(obj["x0"], obj["x1"], obj["top"], obj["bottom"]) for obj in objs], dtype=np.float64)
+        h_mid = ((coords[:, 0] + coords[:, 1]) / 2)[:, None]
+        v_mid = ((coords[:, 2] + coords[:, 3]) / 2)[:, None]
+        x0, top, x1, bottom = np.asarray(bboxes, dtype=np.float64).T
+        inside = (h_mid >= x0) & (h_mid < x1) & (v_mid >= top) & (v_mid < bottom)
+        return inside.any(axis=1)
+
+    def has_ruling_lines(self, page) -> bool:
+        """
+        Tables are detected from the ruling lines of the page (lines, rectangles and
+        curves), pages without them cannot contain a table.
+        """
+        return bool(page.lines or page.rects or page.curves)
 
     def process_table(self, table):
         """Convert a table (list of lists) into a single string."""
         return "\n".join([" ".join(map(str, row)) for row in table])
 
-    def pdf_to_json(self):
-        """Extract text and tables from a set of PDFs."""
-
-        pdf_files = self.load_pdfs()
-        extracted_data = []
-
-        for pdf_path in pdf_files:
-            pdf_data = {
-                "file_name": os.path.basename(pdf_path),
-                "text": "",
-                "tables": [],
-            }
-
-            with pdfplumber.open(pdf_path) as pdf:
-                full_text = []
-                processed_tables = []
-                for page in pdf.pages:
-                    # Extract tables
-                    tables = page.extract_tables()
-                    processed_tables.extend(
-                        [self.process_table(table) for table in tables]
-                    )
-
-                    # Get text outside tables
-                    bboxes = [
-                        table.bbox for table in page.find_tables()
-                    ]  # Find table bounding boxes
-                    page_text = page.filter(
-                        lambda obj: self.not_within_bboxes(obj, bboxes)
-                    ).extract_text()
-                    if page_text:
-                        full_text.append(page_text)
-
-                pdf_data["text"] = "\n".join(full_text)
-                pdf_data["tables"] = processed_tables
-
-            extracted_data.append(pdf_data)
-            json_path = os.path.join(
-                self.output, os.path.basename(pdf_path).split(".pdf")[0] + "_pre.json"
+    def page_ranges(self, pdf_path: str) -> List[Tuple[int, int]]:
+        """
+        Split the pages of a PDF into ranges of at most `pages_per_task` pages,
+        so very large codes are spread across several workers.
+        """
+        with pdfplumber.open(pdf_path) as pdf:
+            total_pages = len(pdf.pages)
+        step = max(self.pages_per_task, 1)
+        return [
+            (start, min(start + step, total_pages))
+            for start in range(0, total_pages, step)
+        ] or [(0, 0)]
+
+    def extract_pages(self, pdf_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+        """
+        Extract text and tables from the pages [start, end) of a PDF.
+        Runs inside a worker process.
+        """
+        file_name = os.path.basename(pdf_path)
+        pages = []
+        with pdfplumber.open(pdf_path) as pdf:
+            for number, page in enumerate(pdf.pages[start:end], start=start):
+                # Tables are detected once, the result gives both their text and their bboxes
+                tables = []
+                if not self.skip_unruled_pages or self.has_ruling_lines(page):
+                    tables = page.find_tables()
+                processed_tables = [self.process_table(table.extract()) for table in tables]
+
+                # Get text outside tables
+                if tables:
+                    chars = page.chars
+                    inside = self.within_bboxes(chars, [table.bbox for table in tables])
+                    excluded = {id(char) for char, masked in zip(chars, inside) if masked}
+                    page = page.filter(lambda obj: id(obj) not in excluded)
+                pages.append({
+                    "file_name": file_name,
+                    "page": number,
+                    "text": page.extract_text() or "",
+                    "tables": processed_tables,
+                })
+
+        return pages
+
+    def save_document(self, pdf_path: str, parts: List[List[Dict[str, Any]]]) -> str:
+        """
+        Write the extracted page ranges of a document in page order to its pages
+        staging file.
+        """
+        pages = self.staging.pages(pdf_path)
+        logger.info(f"Guardando los datos en el archivo {pages.path}")
+        pages.write(page for part in parts for page in part)
+        return pages.path
+
+    def extract(self, pdf_files: Optional[List[str]] = None) -> Iterator[Tuple[str, str]]:
+        """
+        Extract text and tables from a set of PDFs.
+
+        Each PDF (or each page range of a large PDF) is processed by a worker of a
+        process pool and every document is written to its own pages staging file as soon
+        as all of its pages are done. With `max_workers=1` the extraction runs in the
+        current process.
+
+        Yields:
+            Tuple[str, str]: the PDF path and the path of its pages staging file.
+        """
+        if pdf_files is None:
+            pdf_files = self.load_pdfs()
+        os.makedirs(self.output, exist_ok=True)
+
+        if self.max_workers == 1:
+            for pdf_path in pdf_files:
+                parts = [
+                    self.extract_pages(pdf_path, start, end)
+                    for start, end in self.page_ranges(pdf_path)
+                ]
+                yield pdf_path, self.save_document(pdf_path, parts)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            pending: Dict[str, List[Optional[List[Dict[str, Any]]]]] = {}
+            for pdf_path in pdf_files:
+                ranges = self.page_ranges(pdf_path)
+                pending[pdf_path] = [None] * len(ranges)
+                for index, (start, end) in enumerate(ranges):
+                    future = executor.submit(self.extract_pages, pdf_path, start, end)
+                    futures[future] = (pdf_path, index)
+            logger.info(
+                f"Extrayendo {len(pdf_files)} pdfs en {len(futures)} bloques de paginas"
             )
-            with open(json_path, "w", encoding="utf-8") as file:
-                logger.info(f"Guardando los datos en el archivo {json_path}")
-                json.dump(extracted_data, file, ensure_ascii=False)
+
+            for future in as_completed(futures):
+                pdf_path, index = futures[future]
+                parts = pending[pdf_path]
+                parts[index] = future.result()
+                if all(part is not None for part in parts):
+                    del pending[pdf_path]
+                    yield pdf_path, self.save_document(pdf_path, parts)
+
+    def pdf_to_json(self, pdf_files: Optional[List[str]] = None) -> List[str]:
+        """
+        Extract text and tables from a set of PDFs.
+
+        Returns:
+            List[str]: paths of the generated pages staging files.
+        """
+        return [json_path for _, json_path in self.extract(pdf_files)]
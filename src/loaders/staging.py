@@ -0,0 +1,192 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import glob
+import json
+import logging
+import mmap
+import os
+import numpy as np
+
+"""
+    Staging files shared by the extraction, the chunking and the ingestion stages
+"""
+logger = logging.getLogger(__name__)
+
+
+class StagingFile:
+    """
+    JSON Lines file with an offset index, read by streaming or by record number.
+
+    Files:
+     - <name>.jsonl: one record per line
+     - <name>.idx.npy: byte offset of each record, loaded by memory-map
+    Files are written to a temporary path and swapped in once complete, so an
+    interrupted stage never leaves a truncated file behind. The embeddings of the
+    chunks are not staged, they are kept by the embedding cache.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._base: str = path[: -len(".jsonl")] if path.endswith(".jsonl") else path
+        self._offsets: Optional[np.ndarray] = None
+        self._map: Optional[mmap.mmap] = None
+
+    @property
+    def index_path(self) -> str:
+        return self._base + ".idx.npy"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def writer(self) -> Iterator[Callable[[Dict[str, Any]], None]]:
+        """
+        Context manager yielding a function that appends a record,
+        the file and its index replace the previous ones on exit
+        """
+        self.close()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        offsets: List[int] = []
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+
+            def append(record: Dict[str, Any]) -> None:
+                offsets.append(file.tell())
+                file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+            try:
+                yield append
+            except BaseException:
+                file.close()
+                os.remove(tmp_path)
+                raise
+
+        self._save_index(offsets)
+        os.replace(tmp_path, self.path)
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Write all the records, returns the number of records written
+        """
+        total = 0
+        with self.writer() as append:
+            for record in records:
+                append(record)
+                total += 1
+        return total
+
+    def _save_index(self, offsets: List[int]) -> None:
+        # The index is replaced first, a file newer than its index gets a new one on read
+        with open(self.index_path + ".tmp", "wb") as index:
+            np.save(index, np.asarray(offsets, dtype=np.int64))
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def offsets(self) -> np.ndarray:
+        """
+        Byte offset of each record, the index is rebuilt from the file when it is
+        missing or older than the file (files staged before the index existed)
+        """
+        if self._offsets is None:
+            if (not os.path.exists(self.index_path)
+                    or os.path.getmtime(self.index_path) < os.path.getmtime(self.path)):
+                offsets: List[int] = []
+                with open(self.path, "rb") as file:
+                    position = 0
+                    for line in file:
+                        offsets.append(position)
+                        position += len(line)
+                self._save_index(offsets)
+            self._offsets = np.load(self.index_path, mmap_mode="r")
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets())
+
+    def __getitem__(self, number: int) -> Dict[str, Any]:
+        """
+        Read a record by its number without reading the rest of the file
+        """
+        offsets = self.offsets()
+        if self._map is None:
+            with open(self.path, "rb") as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = int(offsets[number])
+        end = self._map.find(b"\n", start)
+        return json.loads(self._map[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                yield json.loads(line)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._offsets = None
+
+
+class StagingStore:
+    """
+    Staging files of each document inside `path`:
+     - <document>.pages.jsonl: text and tables extracted from each page of the PDF
+     - <document>.chunks.jsonl: chunks of the document (Chunk fields), embedded again
+       without extracting the document when the collection has to be rebuilt
+    each one with its offset index (<document>.pages.idx.npy, <document>.chunks.idx.npy)
+    so single pages and chunks are read by position
+    """
+
+    PAGES = ".pages.jsonl"
+    CHUNKS = ".chunks.jsonl"
+
+    def __init__(self, path: str = "./data/staging/"):
+        self.path: str = path
+
+    @staticmethod
+    def stem(file_name: str) -> str:
+        """
+        Name of the document without directory and extension
+        """
+        return os.path.basename(file_name).split(".pdf")[0]
+
+    def pages(self, file_name: str) -> StagingFile:
+        return StagingFile(os.path.join(self.path, self.stem(file_name) + self.PAGES))
+
+    def chunks(self, file_name: str) -> StagingFile:
+        return StagingFile(os.path.join(self.path, self.stem(file_name) + self.CHUNKS))
+
+    def page(self, file_name: str, number: int) -> Dict[str, Any]:
+        """
+        Extracted text and tables of one page of the document (by position in the PDF)
+        """
+        return self.pages(file_name)[number]
+
+    def chunk(self, file_name: str, number: int) -> Dict[str, Any]:
+        """
+        One chunk of the document by its position, without reading the others
+        """
+        return self.chunks(file_name)[number]
+
+    def staged(self, suffix: str = PAGES) -> List[str]:
+        """
+        Paths of the pages files (or chunks files) of all the staged documents
+        """
+        return sorted(glob.glob(os.path.join(self.path, "*" + suffix)))
+
+    @staticmethod
+    def document(pages_path: str) -> Dict[str, Any]:
+        """
+        Rebuild a document (file name, text and tables) from its pages file,
+        the text of the pages is joined with line breaks
+        """
+        file_name = None
+        texts: List[str] = []
+        tables: List[str] = []
+        for page in StagingFile(pages_path):
+            file_name = page["file_name"]
+            if page["text"]:
+                texts.append(page["text"])
+            tables.extend(page["tables"])
+        if file_name is None:
+            file_name = os.path.basename(pages_path)[: -len(StagingStore.PAGES)] + ".pdf"
+        return {"file_name": file_name, "text": "\n".join(texts), "tables": tables}
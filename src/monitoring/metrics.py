@@ -0,0 +1,258 @@
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+import math
+import os
+import threading
+import time
+import numpy as np
+
+"""
+    Latency histograms, counters and gauges of the pipeline, exported in Prometheus text format
+"""
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds of the latency buckets
+DEFAULT_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, math.inf)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Cumulative bucket counts plus the last `max_recent` values, used for the percentiles
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, max_recent: int = 1024):
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * len(buckets)
+        self.sum: float = 0.0
+        self.count: int = 0
+        self.recent: Deque[float] = deque(maxlen=max_recent)
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        values = np.asarray(self.recent, dtype=np.float64)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (0.0, 0.0, 0.0)
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of the metrics of the process.
+     - span(stage): context manager recording the duration of a stage in the
+       `stage_latency_ms` histogram (and `stage_errors_total` when it raises)
+     - observe / increment: histograms and counters with labels
+     - register_collector: gauges computed when the metrics are exported (cache hit rates, ...)
+    The metrics are exported in Prometheus text format to a file (`PIPE_METRICS_FILE`)
+    or served over HTTP on /metrics (`PIPE_METRICS_PORT`).
+    """
+
+    def __init__(self, prefix: str = "rag"):
+        self.prefix: str = prefix
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, self._labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def span(self, stage: str, **labels) -> Iterator[None]:
+        """
+        Record the duration in milliseconds of the block as a stage of the pipeline
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment("stage_errors_total", stage=stage, **labels)
+            raise
+        finally:
+            self.observe("stage_latency_ms", (time.perf_counter() - started) * 1000, stage=stage, **labels)
+
+    def timed(self, items: Iterable[Any], stage: str, per_item: bool = False, **labels) -> Iterator[Any]:
+        """
+        Iterate over `items` recording the time spent producing them (not the time the
+        consumer spends between items): one observation per item or one for the whole iteration
+        """
+        iterator = iter(items)
+        total = 0.0
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            elapsed = (time.perf_counter() - started) * 1000
+            total += elapsed
+            if per_item:
+                self.observe("stage_latency_ms", elapsed, stage=stage, **labels)
+            yield item
+        total += (time.perf_counter() - started) * 1000
+        if not per_item:
+            self.observe("stage_latency_ms", total, stage=stage, **labels)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, float]]) -> None:
+        """
+        Register a function returning gauges, exported as `<name>_<key>`
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def gauges(self) -> Dict[str, float]:
+        with self._lock:
+            collectors = dict(self._collectors)
+        values: Dict[str, float] = {}
+        for name, collector in collectors.items():
+            try:
+                for key, value in collector().items():
+                    if isinstance(value, (int, float)):
+                        values[f"{name}_{key}"] = float(value)
+            except Exception as e:
+                logger.warning(f"No se pudieron obtener las metricas de {name}: {e}")
+        return values
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Percentiles of the histograms, counters and gauges, used by the Rendimiento page
+        """
+        with self._lock:
+            histograms = [
+                {"metric": name, **dict(labels), **histogram.summary()}
+                for (name, labels), histogram in self._histograms.items()
+            ]
+            counters = [
+                {"metric": name, **dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ]
+        return {"histograms": histograms, "counters": counters, "gauges": self.gauges()}
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ""
+        escaped = (
+            (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for key, value in labels
+        )
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    def prometheus(self) -> str:
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        lines: List[str] = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            typed = set()
+            for (name, labels), histogram in histograms:
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+                    lines.append(f"{metric}_bucket{self._format_labels(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{metric}_sum{self._format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{self._format_labels(labels)} {histogram.count}")
+            for (name, labels), value in counters:
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{self._format_labels(labels)} {value}")
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Optional[str] = None) -> Optional[str]:
+        """
+        Write the metrics to `path` (`PIPE_METRICS_FILE` by default), nothing is written
+        if no file is configured
+        """
+        path = path or os.getenv("PIPE_METRICS_FILE")
+        if not path:
+            return None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+        return path
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> None:
+        """
+        Serve the metrics on http://host:port/metrics from a background thread
+        """
+        if self._server is not None:
+            return
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.warning(f"No se pudo exponer las metricas en el puerto {port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"Metricas disponibles en http://{host}:{port}/metrics")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+# Registry shared by all the modules of the process
+registry = MetricsRegistry()
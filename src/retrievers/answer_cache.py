@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    In-memory cache of the answers given to previous questions.
+    Questions are matched exactly after normalization and, when an embedding function and a
+    similarity threshold are provided, by cosine similarity of their embeddings.
+    Entries expire after `ttl` seconds and the least recently used ones are evicted once the
+    cache holds `max_entries`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 3600,
+        similarity_threshold: Optional[float] = None,
+        embed: Optional[Callable[[str], List[float]]] = None,
+    ):
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.similarity_threshold: Optional[float] = similarity_threshold
+        self.embed = embed
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self) -> bool:
+        return self.embed is not None and self.similarity_threshold is not None
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """
+        Lowercase the query, remove accents, punctuation and repeated whitespace
+        """
+        query = unicodedata.normalize("NFKD", query.lower())
+        query = "".join(char for char in query if not unicodedata.combining(char))
+        query = re.sub(r"[^\w\s]", " ", query)
+        return " ".join(query.split())
+
+    def _expire(self) -> None:
+        limit = time.monotonic() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry["created"] < limit]:
+            del self._entries[key]
+
+    def _vector(self, query: str) -> Optional[np.ndarray]:
+        if not self.semantic:
+            return None
+        vector = np.asarray(self.embed(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _semantic_match(self, vector: np.ndarray) -> Optional[str]:
+        keys = [key for key, entry in self._entries.items() if entry["vector"] is not None]
+        if not keys:
+            return None
+        matrix = np.stack([self._entries[key]["vector"] for key in keys])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+            return keys[best]
+        return None
+
+    def get(self, query: str) -> Optional[Tuple[str, str]]:
+        """
+        Return the cached answer of the query, None if there is no valid entry
+        """
+        key = self.normalize(query)
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                return self._hit(key)
+            search_similar = self.semantic and bool(self._entries)
+
+        if search_similar:
+            # The embedding is computed outside the lock, it may call the embedding service
+            vector = self._vector(query)
+            with self._lock:
+                match = self._semantic_match(vector)
+                if match is not None:
+                    return self._hit(match)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _hit(self, key: str) -> Tuple[str, str]:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]["answer"]
+
+    def put(self, query: str, answer: Tuple[str, str]) -> None:
+        """
+        Store the answer of the query
+        """
+        key = self.normalize(query)
+        vector = self._vector(query)
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "vector": vector,
+                "created": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Invalidate all the entries, used when the collection changes
+        """
+        with self._lock:
+            self._entries.clear()
+        logger.info("Se invalido el cache de respuestas")
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
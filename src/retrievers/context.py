@@ -0,0 +1,134 @@
+from typing import List, Optional, Set
+import logging
+from ..chunking.tokenizer import get_tokenizer
+from ..vector_store_client.results import SearchResult
+
+logger = logging.getLogger(__name__)
+
+
+class ContextBuilder:
+    """
+    Assembles the context sent to the LLM from the retrieved chunks:
+     - Merges neighbours of the same file whose texts overlap (the overlap added by
+       `Chunker.chunking_overlap`), keeping the overlapping span only once.
+       `overlap_size` is the longest overlap looked for, in characters.
+     - Drops chunks whose word shingles are mostly contained in a chunk already selected.
+     - Fills a token budget in order of retrieval score, the chunk that overflows the
+       budget is truncated if at least `min_tokens` tokens are left.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4000,
+        overlap_size: int = 2000,
+        min_overlap: int = 50,
+        shingle_size: int = 5,
+        duplicate_threshold: float = 0.8,
+        min_tokens: int = 100,
+    ):
+        self.max_tokens: int = max_tokens
+        self.overlap_size: int = overlap_size
+        self.min_overlap: int = min_overlap
+        self.shingle_size: int = shingle_size
+        self.duplicate_threshold: float = duplicate_threshold
+        self.min_tokens: int = min_tokens
+
+    @property
+    def tokenizer(self):
+        # Loaded on first use, the encoding takes a while to load
+        return get_tokenizer()
+
+    def overlap(self, first: str, second: str) -> int:
+        """
+        Length of the longest suffix of `first` (within its last `overlap_size` characters)
+        that is a prefix of `second`, 0 if it is shorter than `min_overlap`
+        """
+        tail = first[-self.overlap_size:]
+        probe = second[: self.min_overlap]
+        if len(probe) < self.min_overlap:
+            return 0
+        position = tail.find(probe)
+        while position != -1:
+            if second.startswith(tail[position:]):
+                return len(tail) - position
+            position = tail.find(probe, position + 1)
+        return 0
+
+    def merge(self, first: SearchResult, second: SearchResult) -> Optional[SearchResult]:
+        """
+        Merge two chunks of the same file if one continues the other
+        """
+        if first.file_name != second.file_name:
+            return None
+        for left, right in ((first, second), (second, first)):
+            size = self.overlap(left.text, right.text)
+            if size:
+                return first._replace(
+                    text=left.text + right.text[size:],
+                    score=max(first.score or 0, second.score or 0),
+                    summary=(
+                        f"{left.summary}\n{right.summary}" if left.summary and right.summary else None
+                    ),
+                )
+        return None
+
+    def merge_neighbours(self, results: List[SearchResult]) -> List[SearchResult]:
+        merged: List[SearchResult] = []
+        for result in results:
+            for i, current in enumerate(merged):
+                joined = self.merge(current, result)
+                if joined is not None:
+                    merged[i] = joined
+                    break
+            else:
+                merged.append(result)
+        return merged
+
+    def shingles(self, text: str) -> Set[int]:
+        words = text.lower().split()
+        size = self.shingle_size
+        return {hash(" ".join(words[i : i + size])) for i in range(max(len(words) - size + 1, 1))}
+
+    def deduplicate(self, results: List[SearchResult]) -> List[SearchResult]:
+        selected: List[SearchResult] = []
+        selected_shingles: List[Set[int]] = []
+        for result in results:
+            shingles = self.shingles(result.text)
+            duplicated = any(
+                len(shingles & other) / len(shingles) >= self.duplicate_threshold
+                for other in selected_shingles
+            )
+            if not duplicated:
+                selected.append(result)
+                selected_shingles.append(shingles)
+        return selected
+
+    def select(self, results: List[SearchResult]) -> List[SearchResult]:
+        """
+        Chunks that make up the context, ordered by score and within the token budget
+        """
+        ordered = sorted(results, key=lambda result: result.score or 0, reverse=True)
+        candidates = self.deduplicate(self.merge_neighbours(ordered))
+        selected: List[SearchResult] = []
+        used = 0
+        for result in candidates:
+            remaining = self.max_tokens - used
+            tokens = self.tokenizer.count(result.text)
+            if tokens <= remaining:
+                selected.append(result)
+                used += tokens
+            elif remaining >= self.min_tokens:
+                # Keep the beginning of a chunk (usually a merged group) that does not fit
+                cut = self.tokenizer.offsets(result.text)[remaining]
+                selected.append(result._replace(text=result.text[:cut]))
+                used = self.max_tokens
+        logger.info(
+            f"Contexto: {len(selected)} de {len(results)} chunks, {used} tokens"
+        )
+        return selected
+
+    def build(self, results: List[SearchResult]) -> str:
+        """
+        Context string for the prompt
+        """
+        return "\n".join(result.text for result in self.select(results))
@@ -3,9 +3,15 @@ from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate
 from langchain.chains import MapReduceDocumentsChain, ReduceDocumentsChain
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
-from langchain.chains.llm import LLMChain
+from typing import AsyncIterator, List, Tuple
+import asyncio
 import os
 import logging
+import time
+from ..chunking.tokenizer import count_tokens
+from ..monitoring.metrics import registry
+from ..vector_store_client.results import SearchResult
+from .scheduler import run_sync
 
 logger = logging.getLogger(__name__)
 
@@ -14,41 +20,155 @@ class Retriever:
     def __init__(self):
         load_dotenv()
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.llm = ChatOpenAI(model_name="gpt-3.5-turbo")
+        if os.getenv("PIPE_LLM") == "stub":
+            from .stub_llm import StubChatModel
 
-    def process_query(self, list_documents: str, enhanced=True, **kwargs) -> str:
+            # Simulated latency, used to load test the pipeline without calling the API
+            self.llm = StubChatModel(latency=float(os.getenv("PIPE_STUB_LLM_LATENCY", "0.5")))
+        else:
+            self.llm = ChatOpenAI(model_name="gpt-3.5-turbo")
+
+    def process_query(self, list_documents: List[SearchResult], enhanced=True, **kwargs) -> Tuple[str, str]:
+        """
+        Process the query using the defined retriever mechanims naive and advanced using summarization for the context.
+        Synchronous wrapper of `aprocess_query`, use `aprocess_query` inside a running event loop.
+        """
+        return run_sync(
+            lambda: self.aprocess_query(list_documents, enhanced=enhanced, **kwargs), "aprocess_query(...)")
+
+    async def aprocess_query(self, list_documents: List[SearchResult], enhanced=True, **kwargs) -> Tuple[str, str]:
         """
         Process the query using the defined retriever mechanims naive and advanced using summarization for the context.
+        The naive answer does not depend on the summary, so it runs concurrently with the
+        summarization -> enhanced answer chain and the latency is the one of the longest chain.
+        """
+        naive = self.naive_answer(context=kwargs["context"], question=kwargs["question"])
+        if not enhanced:
+            return (await naive, None)
+
+        content_naive, summary_method_answer = await asyncio.gather(
+            naive, self.enhanced_answer(list_documents, question=kwargs["question"])
+        )
+        return (content_naive, summary_method_answer)
+
+    def naive_prompt(self, context: str, question: str):
+        """
+        Prompt of the naive method, the retrieved documents are used as context
         """
-        context = """You are a food safety officer seeking detailed information about food safety regulations. You can only use the  {context} to answer 
+        template = """You are a food safety officer seeking detailed information about food safety regulations. You can only use the  {context} to answer 
                      answer the following question {question} Reply with N/A if the context is not relevant to the question.
                      Always answer in spanish"""
-        if enhanced:
-            content_summarization = self.summarization(list_documents)
-            template_sumarrization = """You are a food safety officer seeking detailed information about food safety regulations.
+        prompt = ChatPromptTemplate.from_template(template)
+        return prompt.invoke(input={"context": context, "question": question})
+
+    def enhanced_prompt(self, content_summarization: str, question: str):
+        """
+        Prompt of the enhanced method, the summaries of the retrieved documents are used as context
+        """
+        template_sumarrization = """You are a food safety officer seeking detailed information about food safety regulations.
             Taking into account the summaries of the documents {content}, please answer the following question: {question} if Reply with N/A if the context is not relevant to the question.
             For the summaries provided don't forget to include the reference to the document that supports each theme.
             Answer should always be in spanish.
             """
-            prompt_summarization = ChatPromptTemplate.from_template(
-                template_sumarrization
-            )
-            prompt_summarization = prompt_summarization.invoke(
-                input={"content": content_summarization, "question": kwargs["question"]}
-            )
-            summary_method_answer = self.llm.invoke(prompt_summarization).content
-
-        # Process documents  extract
-
-        prompt = ChatPromptTemplate.from_template(context)
-        prompt = prompt.invoke(
-            input={"context": kwargs["context"], "question": kwargs["question"]}
+        prompt_summarization = ChatPromptTemplate.from_template(
+            template_sumarrization
+        )
+        return prompt_summarization.invoke(
+            input={"content": content_summarization, "question": question}
         )
 
-        content_naive = self.llm.invoke(prompt).content
-        return (content_naive, summary_method_answer)
+    async def naive_answer(self, context: str, question: str) -> str:
+        """
+        Answer the question using the retrieved documents as context
+        """
+        prompt = self.naive_prompt(context, question)
+        with registry.span("naive_generation"):
+            answer = (await self.llm.ainvoke(prompt)).content
+        self.record_tokens("naive", prompt.to_string(), answer)
+        return answer
 
-    def summarization(self, retrieved_queries: str) -> str:
+    async def enhanced_answer(self, list_documents: List[SearchResult], question: str) -> str:
+        """
+        Answer the question using the summaries of the retrieved documents
+        """
+        content_summarization = await self.summarization(list_documents)
+        prompt = self.enhanced_prompt(content_summarization, question)
+        with registry.span("enhanced_generation"):
+            answer = (await self.llm.ainvoke(prompt)).content
+        self.record_tokens("enhanced", prompt.to_string(), answer)
+        return answer
+
+    async def astream_query(
+        self, list_documents: List[SearchResult], enhanced=True, **kwargs
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Stream the tokens of the naive and enhanced answers as they are generated.
+        Both answers are produced concurrently and their tokens are interleaved.
+
+        Yields:
+            Tuple[str, str]: the method ("naive" or "enhanced") and the token.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def stream(method: str, prompt_factory) -> None:
+            try:
+                prompt = await prompt_factory()
+                started = time.perf_counter()
+                answer = ""
+                async for chunk in self.llm.astream(prompt):
+                    if chunk.content:
+                        if not answer:
+                            registry.observe(
+                                "time_to_first_token_ms", (time.perf_counter() - started) * 1000, chain=method)
+                        answer += chunk.content
+                        await queue.put((method, chunk.content))
+                registry.observe(
+                    "stage_latency_ms", (time.perf_counter() - started) * 1000, stage=f"{method}_generation")
+                self.record_tokens(method, prompt.to_string(), answer)
+            finally:
+                await queue.put((method, None))
+
+        async def naive_prompt():
+            return self.naive_prompt(kwargs["context"], kwargs["question"])
+
+        async def enhanced_prompt():
+            content_summarization = await self.summarization(list_documents)
+            return self.enhanced_prompt(content_summarization, kwargs["question"])
+
+        tasks = [asyncio.create_task(stream("naive", naive_prompt))]
+        if enhanced:
+            tasks.append(asyncio.create_task(stream("enhanced", enhanced_prompt)))
+
+        pending = len(tasks)
+        try:
+            while pending:
+                method, token = await queue.get()
+                if token is None:
+                    pending -= 1
+                    continue
+                yield method, token
+            # Surface the errors raised inside the streams
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def summarization(self, retrieved_queries: List[SearchResult]) -> str:
+        """
+        Summaries of the retrieved documents: the summaries stored during the ingestion are
+        assembled without calling the LLM, only the documents without a stored summary are
+        summarized with the LLM
+        """
+        stored = [result for result in retrieved_queries if result.summary]
+        missing = [result for result in retrieved_queries if not result.summary]
+        registry.increment("context_summaries_total", len(stored), source="stored")
+        registry.increment("context_summaries_total", len(missing), source="generated")
+        parts = [f"[{result.file_name}] {result.summary}" for result in stored]
+        if missing:
+            parts.append(await self.summarize_documents(missing))
+        return "\n\n".join(parts)
+
+    async def summarize_documents(self, retrieved_queries: List[SearchResult]) -> str:
         """
         Summarize the text using the LLM
         """
@@ -59,7 +179,21 @@ class Retriever:
                         Taking into account the metadata use the filename of each document don't forget to include the reference to the document that supports each theme if posible inlcude the article related to each source
                         Helpful Answer:"""
         map_prompt = ChatPromptTemplate.from_template(map_template)
-        map_chain = LLMChain(llm=self.llm, prompt=map_prompt)
 
-        answer = map_chain.invoke(retrieved_queries)['docs']
+        docs = "\n\n".join(
+            f"[{result.file_name}] {result.text}" for result in retrieved_queries
+        )
+        prompt = map_prompt.invoke({"docs": docs})
+        with registry.span("summarization"):
+            answer = (await self.llm.ainvoke(prompt)).content
+        self.record_tokens("summarization", prompt.to_string(), answer)
         return answer
+
+    @staticmethod
+    def record_tokens(chain: str, prompt: str, completion: str) -> None:
+        """
+        Count the prompt and completion tokens sent to the LLM (local tokenizer)
+        """
+        registry.increment("llm_tokens_total", count_tokens(prompt), chain=chain, kind="prompt")
+        registry.increment("llm_tokens_total", count_tokens(completion or ""), chain=chain, kind="completion")
+        registry.increment("llm_requests_total", chain=chain)
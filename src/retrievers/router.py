@@ -0,0 +1,66 @@
+from typing import Any, Dict, List, Optional
+import logging
+import re
+from ..chunking.chunker import Chunker
+
+"""
+    Rule-based routing of the questions to the chapter, articles or resolutions they name
+"""
+logger = logging.getLogger(__name__)
+
+ARTICLES_PATTERN = re.compile(
+    r"\bart(?:[íi]culos?|s?\.)\s*(\d+(?:\s*(?:bis|tris|ter|quater)\b)?(?:\s*(?:,|y|e|o)\s*\d+(?:\s*(?:bis|tris|ter|quater)\b)?)*)",
+    re.IGNORECASE)
+ARTICLE_PATTERN = re.compile(r"(\d+)(?:\s*(bis|tris|ter|quater)\b)?", re.IGNORECASE)
+CHAPTER_PATTERN = re.compile(r"\bcap[íi]tulo\s+([IVXLC]+|\d+)\b", re.IGNORECASE)
+ROMAN_NUMERALS = [(100, "C"), (90, "XC"), (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I")]
+
+
+def to_roman(number: int) -> str:
+    roman = ""
+    for value, numeral in ROMAN_NUMERALS:
+        while number >= value:
+            roman += numeral
+            number -= value
+    return roman
+
+
+class QueryRouter:
+    """
+    Derives the metadata filters of a question from the references it names:
+     - "artículo 155", "art. 155 bis", "artículos 155 y 156" -> article
+     - "capítulo III", "capítulo 3" -> chapter
+     - "Resolución GMC N° 12/11", "Res. 1546" -> resolution
+    Questions without references are not filtered.
+    """
+
+    def articles(self, query: str) -> List[str]:
+        articles = []
+        for match in ARTICLES_PATTERN.finditer(query):
+            articles.extend(Chunker.article_id(*article) for article in ARTICLE_PATTERN.findall(match.group(1)))
+        return list(dict.fromkeys(articles))
+
+    def chapter(self, query: str) -> Optional[str]:
+        match = CHAPTER_PATTERN.search(query)
+        if match is None:
+            return None
+        chapter = match.group(1)
+        return to_roman(int(chapter)) if chapter.isdigit() else chapter.upper()
+
+    def route(self, query: str) -> Dict[str, Any]:
+        """
+        Filters of the question for `VectorStoreClient.search`, empty if it names no reference
+        """
+        filters: Dict[str, Any] = {}
+        chapter = self.chapter(query)
+        if chapter:
+            filters["chapter"] = chapter
+        articles = self.articles(query)
+        if articles:
+            filters["article"] = articles
+        resolutions = Chunker.cited_resolutions(query)
+        if resolutions:
+            filters["resolution"] = resolutions
+        if filters:
+            logger.info(f"Consulta dirigida con los filtros {filters}")
+        return filters
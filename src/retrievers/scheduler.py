@@ -0,0 +1,156 @@
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+import asyncio
+import logging
+import threading
+import time
+from ..monitoring.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+def run_sync(job: Callable[[], Awaitable[Any]], alternative: str) -> Any:
+    """
+    Run the coroutine returned by `job()` from synchronous code.
+    Inside a running event loop (e.g. a notebook) asyncio.run is not possible, the caller
+    has to await the asynchronous method `alternative` instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(job())
+    raise RuntimeError(
+        f"No se puede ejecutar de forma sincronica dentro de un event loop en ejecucion, use await {alternative}"
+    )
+
+
+class QueryScheduler:
+    """
+    Schedules the queries of all the sessions sharing the Controler on one event loop
+    running in a background thread:
+     - at most `max_concurrency` queries run at the same time (LLM and database calls)
+     - each session has its own FIFO queue of at most `max_session_queue` queries and
+       sessions are served round-robin, so a burst from one user does not delay the others
+     - identical queries (same key) already queued or running are coalesced: every
+       requester receives the result of the single execution
+     - queries over the limits are rejected with ConnectionRefusedError
+    Queue depth, wait time and coalesced/rejected counters are recorded in the metrics registry.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_session_queue: int = 4, max_pending: int = 64):
+        self.max_concurrency: int = max_concurrency
+        self.max_session_queue: int = max_session_queue
+        self.max_pending: int = max_pending
+        self._queues: "OrderedDict[str, Deque[Tuple[str, Callable[[], Awaitable[Any]], float]]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._running: int = 0
+        self._pending: int = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready = threading.Event()
+        self.coalesced: int = 0
+        self.rejected: int = 0
+        registry.register_collector("scheduler", self.stats)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Event loop of the scheduler, started on first use
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._run_loop, name="query-scheduler", daemon=True).start()
+        self._ready.wait()
+        return self._loop
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._ready.set)
+        self._loop.run_forever()
+
+    def submit(self, session_id: str, key: str, job: Callable[[], Awaitable[Any]]) -> Tuple[Future, bool]:
+        """
+        Queue the coroutine returned by `job()` for the session
+        Returns the future of the result and whether the job will run (False when the
+        query was coalesced with an identical one already queued or running)
+        """
+        loop = self.loop
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                registry.increment("scheduler_requests_total", result="coalesced")
+                return future, False
+            queue = self._queues.get(session_id)
+            if self._pending >= self.max_pending or (queue is not None and len(queue) >= self.max_session_queue):
+                self.rejected += 1
+                registry.increment("scheduler_requests_total", result="rejected")
+                raise ConnectionRefusedError(
+                    "Hay demasiadas consultas en espera, intente nuevamente en unos segundos"
+                )
+            if queue is None:
+                queue = self._queues[session_id] = deque()
+            future = Future()
+            self._inflight[key] = future
+            queue.append((key, job, time.perf_counter()))
+            self._pending += 1
+            registry.increment("scheduler_requests_total", result="queued")
+        loop.call_soon_threadsafe(self._dispatch)
+        return future, True
+
+    def run(self, session_id: str, key: str, job: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Submit the job and wait for its result
+        """
+        future, _ = self.submit(session_id, key, job)
+        return future.result(timeout=timeout)
+
+    def _next(self) -> Optional[Tuple[str, Callable[[], Awaitable[Any]], float]]:
+        """
+        Pop the oldest query of the next session in round-robin order
+        """
+        with self._lock:
+            if self._running >= self.max_concurrency or not self._queues:
+                return None
+            session_id, queue = next(iter(self._queues.items()))
+            item = queue.popleft()
+            # The session goes to the end of the rotation, or leaves it if it has nothing queued
+            del self._queues[session_id]
+            if queue:
+                self._queues[session_id] = queue
+            self._running += 1
+            self._pending -= 1
+            return item
+
+    def _dispatch(self) -> None:
+        while (item := self._next()) is not None:
+            key, job, queued = item
+            registry.observe("scheduler_wait_ms", (time.perf_counter() - queued) * 1000)
+            self.loop.create_task(self._execute(key, job))
+
+    async def _execute(self, key: str, job: Callable[[], Awaitable[Any]]) -> None:
+        with self._lock:
+            future = self._inflight[key]
+        try:
+            result = await job()
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._inflight.pop(key, None)
+            self._dispatch()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "queue_depth": self._pending,
+                "running": self._running,
+                "sessions_waiting": len(self._queues),
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,38 @@
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import Any, List, Optional
+import asyncio
+import time
+
+"""
+    Chat model without network calls, used by the load tests (PIPE_LLM=stub)
+"""
+
+
+class StubChatModel(FakeListChatModel):
+    """
+    Answers with a fixed text after `latency` seconds, the asynchronous calls
+    sleep without blocking the event loop so concurrent queries overlap as with the API
+    """
+
+    responses: List = ["Respuesta de prueba generada sin modelo de lenguaje."]
+    latency: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat-model"
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        text = self._call(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
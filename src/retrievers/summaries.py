@@ -0,0 +1,121 @@
+from typing import Dict, List, Optional
+from langchain.prompts import ChatPromptTemplate
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from ..chunking.chunker import Chunk
+from ..chunking.tokenizer import count_tokens
+from ..monitoring.metrics import registry
+
+"""
+    Summaries of the chunks computed during the ingestion, used as the context of the enhanced answer
+"""
+logger = logging.getLogger(__name__)
+
+SUMMARY_TEMPLATE = """The following is a fragment of the document {file_name}
+                        {text}
+                    Summarize the main themes of the fragment including all the relevant content,
+                    keep the number of the articles and resolutions mentioned in the fragment.
+                    Always answer in spanish.
+                    Helpful Answer:"""
+
+
+class ChunkSummarizer:
+    """
+    Summarizes the chunks with the LLM, at most `concurrency` requests in flight.
+    Summaries are cached in SQLite by prompt and chunk content, so re-ingesting a document
+    only summarizes its new or modified chunks. Chunks shorter than `min_tokens` are used
+    as their own summary without calling the LLM.
+    """
+
+    def __init__(
+        self,
+        llm,
+        cache_path: str = "./data/staging/summaries_cache.sqlite",
+        concurrency: int = 8,
+        min_tokens: int = 60,
+    ):
+        self.llm = llm
+        self.prompt = ChatPromptTemplate.from_template(SUMMARY_TEMPLATE)
+        self.concurrency: int = concurrency
+        self.min_tokens: int = min_tokens
+        self.hits: int = 0
+        self.misses: int = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(chunk: Chunk) -> str:
+        content = f"{SUMMARY_TEMPLATE}\x00{chunk.metadata}\x00{chunk.contenido}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def cached(self, chunks: List[Chunk]) -> Dict[str, str]:
+        keys = list({self.key(chunk) for chunk in chunks})
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        return dict(rows)
+
+    def store(self, summaries: Dict[str, str]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", list(summaries.items())
+            )
+            self._conn.commit()
+
+    async def summarize(self, chunk: Chunk) -> str:
+        """
+        Summary of one chunk
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        prompt = self.prompt.invoke(input={"file_name": chunk.metadata, "text": chunk.contenido})
+        async with self._semaphore:
+            summary = (await self.llm.ainvoke(prompt)).content
+        registry.increment("llm_tokens_total", count_tokens(prompt.to_string()), chain="chunk_summary", kind="prompt")
+        registry.increment("llm_tokens_total", count_tokens(summary), chain="chunk_summary", kind="completion")
+        registry.increment("llm_requests_total", chain="chunk_summary")
+        return summary
+
+    async def asummarize(self, chunks: List[Chunk]) -> List[Chunk]:
+        """
+        Fill the summary of each chunk, only the chunks not in the cache are sent to the LLM
+        """
+        if not chunks:
+            return []
+        found = await asyncio.to_thread(self.cached, chunks)
+        missing: Dict[str, Chunk] = {}
+        for chunk in chunks:
+            key = self.key(chunk)
+            if key in found:
+                continue
+            if count_tokens(chunk.contenido) < self.min_tokens:
+                found[key] = chunk.contenido
+            else:
+                missing.setdefault(key, chunk)
+        self.hits += len(chunks) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            summaries = await asyncio.gather(*(self.summarize(chunk) for chunk in missing.values()))
+            computed = dict(zip(missing, summaries))
+            await asyncio.to_thread(self.store, computed)
+            found.update(computed)
+        return [chunk._replace(summary=found[self.key(chunk)]) for chunk in chunks]
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
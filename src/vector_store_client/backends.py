@@ -0,0 +1,699 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    Distance,
+    Filter,
+    FilterSelector,
+    HnswConfigDiff,
+    PayloadSchemaType,
+    PointIdsList,
+    PointStruct,
+    QueryRequest,
+    ScalarQuantization,
+    ScoredPoint,
+    SearchParams,
+    VectorParams,
+)
+import json
+import logging
+import os
+import threading
+import numpy as np
+from .filters import condition_values, payload_values
+from .schema import params_from_dict, params_to_dict
+
+"""
+    Storage engines behind the VectorStoreClient
+"""
+logger = logging.getLogger(__name__)
+
+# Number of bits set in each byte, used by the hamming distance of the binary quantization
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class VectorBackend(ABC):
+    """
+    Interface of the storage engines of a collection of points.
+    Points are written as qdrant `PointStruct` and returned as `ScoredPoint`,
+    the payload follows the layout of QdrantVectorStore (page_content + metadata).
+    """
+
+    def __init__(self, collection: str):
+        self.collection: str = collection
+
+    @abstractmethod
+    def collection_exists(self) -> bool:
+        ...
+
+    @abstractmethod
+    def create_collection(self, params: VectorParams) -> None:
+        ...
+
+    @abstractmethod
+    def vector_size(self) -> int:
+        """
+        Dimension of the vectors of the existing collection
+        """
+
+    @abstractmethod
+    def vector_params(self) -> VectorParams:
+        """
+        Parameters of the vectors of the collection (dimension, distance, HNSW and quantization)
+        """
+
+    @abstractmethod
+    def create_payload_indexes(self, indexes: Dict[str, PayloadSchemaType]) -> None:
+        """
+        Index the payload fields used to filter the searches
+        """
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def upsert(self, points: List[PointStruct]) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> None:
+        ...
+
+    @abstractmethod
+    def delete_filter(self, query_filter: Filter) -> None:
+        """
+        Remove the points matching the filter
+        """
+
+    @abstractmethod
+    def search(
+        self, vectors: List[List[float]], limit: int, params: Optional[SearchParams] = None,
+        query_filter: Optional[Filter] = None,
+    ) -> List[List[ScoredPoint]]:
+        """
+        Nearest neighbours of each vector among the points matching `query_filter`,
+        `params` holds the search-time parameters (HNSW ef, oversampling and rescoring
+        of the quantized vectors, exact search)
+        """
+
+    @abstractmethod
+    def scroll(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Iterate over the ids and payloads of all the points
+        """
+
+    @abstractmethod
+    def scroll_vectors(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], List[Dict[str, Any]], np.ndarray]]:
+        """
+        Iterate over the points in batches of ids, payloads and float32 vectors
+        """
+
+
+class QdrantBackend(VectorBackend):
+    """
+    Collection stored in a Qdrant server
+    """
+
+    def __init__(self, client: QdrantClient, collection: str):
+        super().__init__(collection)
+        self.client: QdrantClient = client
+
+    def collection_exists(self) -> bool:
+        return self.client.collection_exists(collection_name=self.collection)
+
+    def create_collection(self, params: VectorParams) -> None:
+        self.client.create_collection(
+            collection_name=self.collection,
+            vectors_config=VectorParams(size=params.size, distance=params.distance, on_disk=params.on_disk),
+            hnsw_config=params.hnsw_config,
+            quantization_config=params.quantization_config)
+
+    def vector_size(self) -> int:
+        return self.client.get_collection(collection_name=self.collection).config.params.vectors.size
+
+    def vector_params(self) -> VectorParams:
+        config = self.client.get_collection(collection_name=self.collection).config
+        return config.params.vectors.model_copy(update={
+            "hnsw_config": config.params.vectors.hnsw_config or HnswConfigDiff(
+                m=config.hnsw_config.m, ef_construct=config.hnsw_config.ef_construct),
+            "quantization_config": config.params.vectors.quantization_config or config.quantization_config,
+        })
+
+    def create_payload_indexes(self, indexes: Dict[str, PayloadSchemaType]) -> None:
+        existing = self.client.get_collection(collection_name=self.collection).payload_schema
+        for field, schema in indexes.items():
+            if field not in existing:
+                self.client.create_payload_index(
+                    collection_name=self.collection, field_name=field, field_schema=schema)
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection).count
+
+    def upsert(self, points: List[PointStruct]) -> None:
+        self.client.upsert(collection_name=self.collection, points=points)
+
+    def delete(self, ids: List[str]) -> None:
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=PointIdsList(points=ids))
+
+    def delete_filter(self, query_filter: Filter) -> None:
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=FilterSelector(filter=query_filter))
+
+    def search(
+        self, vectors: List[List[float]], limit: int, params: Optional[SearchParams] = None,
+        query_filter: Optional[Filter] = None,
+    ) -> List[List[ScoredPoint]]:
+        responses = self.client.query_batch_points(
+            collection_name=self.collection,
+            requests=[QueryRequest(query=vector, limit=limit, with_payload=True, params=params,
+                                   filter=query_filter)
+                      for vector in vectors])
+        return [response.points for response in responses]
+
+    def scroll(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection, limit=batch_size, offset=offset,
+                with_payload=True, with_vectors=False)
+            for point in points:
+                yield str(point.id), point.payload
+            if offset is None:
+                break
+
+    def scroll_vectors(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], List[Dict[str, Any]], np.ndarray]]:
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection, limit=batch_size, offset=offset,
+                with_payload=True, with_vectors=True)
+            if points:
+                yield ([str(point.id) for point in points], [point.payload for point in points],
+                       np.asarray([point.vector for point in points], dtype=np.float32))
+            if offset is None:
+                break
+
+
+class LocalBackend(VectorBackend):
+    """
+    In-process collection stored as a memory-mapped float32 matrix plus a JSON Lines sidecar.
+
+    Files inside `path/collection`:
+     - config.json: parameters of the vectors (qdrant VectorParams)
+     - vectors.f32: normalized vectors, one row per upsert, appended on write
+     - log.jsonl: one line per upsert ({"id", "payload"}) in the same order as the rows,
+       and one line per delete ({"id", "deleted": true})
+    Overwritten and deleted rows are masked out and removed by `compact` once they outnumber
+    the live rows, after an upsert or a delete.
+    Vectors are written (and synced) before their log lines, on load a torn last line is dropped
+    and the rows without a line are truncated, so an interrupted upsert never misaligns the files.
+    Search is an exact cosine top-k; with `index="ivf"` an inverted file index
+    (k-means over the rows) limits the search to the `nprobe` closest clusters. Rows written
+    after the clustering are added to their closest cluster, the clustering is only recomputed
+    when the number of rows grows by `ivf_growth` times.
+    With scalar (int8) or binary quantization the candidates are scored on a quantized
+    copy of the vectors kept in memory, and the best `limit * oversampling` are rescored
+    with the original vectors. The originals are memory-mapped unless `on_disk` is False.
+    Filtered searches only score the rows matching the filter, found with an in-memory
+    index of the values of each filtered field.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        collection: str,
+        index: str = "flat",
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        ivf_growth: float = 2.0,
+    ):
+        super().__init__(collection)
+        self.path: str = os.path.join(path, collection)
+        self.index: str = index
+        self.nlist: Optional[int] = nlist
+        self.nprobe: int = nprobe
+        self.ivf_growth: float = ivf_growth
+        self._lock = threading.RLock()
+        self.params: Optional[VectorParams] = None
+        self.dimension: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._payloads: List[Optional[Dict[str, Any]]] = []
+        self._row_ids: List[Optional[str]] = []
+        self._alive: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._ivf: Optional[Tuple[np.ndarray, List[np.ndarray]]] = None
+        # Rows assigned to the IVF lists and alive rows when the clustering was computed
+        self._ivf_rows: int = 0
+        self._ivf_built: int = 0
+        self._codes: Optional[Tuple[np.ndarray, float, float]] = None
+        self._payload_index: Dict[str, Dict[Any, np.ndarray]] = {}
+        if self.collection_exists():
+            self.load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def collection_exists(self) -> bool:
+        return os.path.exists(self._file("config.json"))
+
+    def create_collection(self, params: VectorParams) -> None:
+        if params.distance != Distance.COSINE:
+            raise ValueError("El backend local solo soporta la distancia coseno")
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file("config.json"), "w", encoding="utf-8") as file:
+            json.dump(params_to_dict(params), file)
+        open(self._file("vectors.f32"), "wb").close()
+        open(self._file("log.jsonl"), "w").close()
+        self.load()
+
+    def load(self) -> None:
+        """
+        Replay the log to rebuild the id -> row mapping
+        """
+        with self._lock:
+            with open(self._file("config.json"), "r", encoding="utf-8") as file:
+                self.params = params_from_dict(json.load(file))
+            self.dimension = self.params.size
+            self._finish_compaction()
+            self._rows = {}
+            self._payloads = []
+            self._row_ids = []
+            complete = 0
+            with open(self._file("log.jsonl"), "rb") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line) if line.endswith(b"\n") else None
+                    except json.JSONDecodeError:
+                        entry = None
+                    if entry is None:
+                        break
+                    complete += len(line)
+                    if entry.get("deleted"):
+                        self._remove(entry["id"])
+                    else:
+                        self._append(entry["id"], entry["payload"])
+            self._repair(complete)
+            self._ivf = None
+            self._invalidate()
+
+    def _repair(self, complete: int) -> None:
+        """
+        Drop the leftovers of an upsert interrupted between the vectors and the log
+        """
+        if os.path.getsize(self._file("log.jsonl")) > complete:
+            logger.warning("El log de la coleccion local termina en una linea incompleta, se descarta")
+            os.truncate(self._file("log.jsonl"), complete)
+        expected = len(self._payloads) * self.dimension * 4
+        size = os.path.getsize(self._file("vectors.f32"))
+        if size < expected:
+            raise ValueError(f"La coleccion local {self.path} esta corrupta: faltan vectores del log")
+        if size > expected:
+            logger.warning(f"Se descartan {size - expected} bytes de vectores sin linea en el log")
+            os.truncate(self._file("vectors.f32"), expected)
+
+    def _append(self, point_id: str, payload: Dict[str, Any]) -> None:
+        self._remove(point_id)
+        self._rows[point_id] = len(self._payloads)
+        self._payloads.append(payload)
+        self._row_ids.append(point_id)
+
+    def _remove(self, point_id: str) -> bool:
+        row = self._rows.pop(point_id, None)
+        if row is None:
+            return False
+        self._payloads[row] = None
+        self._row_ids[row] = None
+        return True
+
+    def _invalidate(self) -> None:
+        self._matrix = None
+        self._alive = None
+        self._codes = None
+        self._payload_index = {}
+
+    def vector_size(self) -> int:
+        return self.dimension
+
+    def vector_params(self) -> VectorParams:
+        return self.params
+
+    def create_payload_indexes(self, indexes: Dict[str, PayloadSchemaType]) -> None:
+        # The filtered fields are indexed in memory on first use
+        pass
+
+    def _index_field(self, key: str) -> Dict[Any, np.ndarray]:
+        rows: Dict[Any, List[int]] = {}
+        for row, payload in enumerate(self._payloads):
+            for value in payload_values(payload, key):
+                rows.setdefault(value, []).append(row)
+        return {value: np.asarray(field_rows, dtype=np.int64) for value, field_rows in rows.items()}
+
+    def filter_mask(self, query_filter: Filter) -> np.ndarray:
+        """
+        Mask of the rows whose payload matches every condition of the filter
+        """
+        mask = np.ones(len(self._payloads), dtype=bool)
+        for condition in query_filter.must or []:
+            if condition.key not in self._payload_index:
+                self._payload_index[condition.key] = self._index_field(condition.key)
+            index = self._payload_index[condition.key]
+            matched = np.zeros(len(self._payloads), dtype=bool)
+            for value in condition_values(condition):
+                if value in index:
+                    matched[index[value]] = True
+            mask &= matched
+        return mask
+
+    def update_params(self, params: VectorParams) -> None:
+        """
+        Change the HNSW, quantization and storage parameters of the collection,
+        the quantized vectors are rebuilt on the next search
+        """
+        if params.size != self.dimension or params.distance != self.params.distance:
+            raise ValueError("No se puede cambiar la dimension ni la distancia de una coleccion existente")
+        with self._lock:
+            with open(self._file("config.json"), "w", encoding="utf-8") as file:
+                json.dump(params_to_dict(params), file)
+            self.params = params
+            self._invalidate()
+
+    def matrix(self) -> np.ndarray:
+        """
+        Memory-mapped matrix of the vectors
+        """
+        with self._lock:
+            if self._matrix is None:
+                rows = len(self._payloads)
+                if rows == 0:
+                    self._matrix = np.zeros((0, self.dimension), dtype=np.float32)
+                else:
+                    self._matrix = np.memmap(
+                        self._file("vectors.f32"), dtype=np.float32, mode="r",
+                        shape=(rows, self.dimension))
+                    if self.params.on_disk is False:
+                        self._matrix = np.array(self._matrix)
+            return self._matrix
+
+    def codes(self) -> Tuple[np.ndarray, float, float]:
+        """
+        Quantized copy of the vectors kept in memory:
+         - scalar: uint8 codes of the values between the `quantile` bounds, with the
+           lower bound and the step used to dequantize them
+         - binary: sign bits of the values packed in bytes
+        """
+        with self._lock:
+            if self._codes is None:
+                matrix = self.matrix()
+                quantization = self.params.quantization_config
+                if isinstance(quantization, ScalarQuantization):
+                    rows = np.flatnonzero(self.alive())
+                    sample = np.asarray(matrix[np.random.default_rng(0).choice(rows, min(len(rows), 10000), replace=False)])
+                    quantile = quantization.scalar.quantile or 0.99
+                    lower, upper = np.quantile(sample, [1 - quantile, quantile])
+                    step = float(upper - lower) / 255 or 1.0
+                    codes = np.empty(matrix.shape, dtype=np.uint8)
+                    for start in range(0, len(matrix), 4096):
+                        block = (np.asarray(matrix[start : start + 4096]) - lower) / step
+                        codes[start : start + 4096] = np.clip(np.rint(block), 0, 255)
+                    self._codes = (codes, float(lower), step)
+                else:
+                    self._codes = (np.packbits(np.asarray(matrix) > 0, axis=1), 0.0, 0.0)
+            return self._codes
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes of the original vectors and of the structures kept in memory to search
+        """
+        matrix = self.matrix()
+        resident = 0 if isinstance(matrix, np.memmap) else matrix.nbytes
+        if self.params.quantization_config is not None and len(matrix):
+            resident += self.codes()[0].nbytes
+        return {"vectors_bytes": int(matrix.nbytes), "resident_bytes": int(resident)}
+
+    def count(self) -> int:
+        return len(self._rows)
+
+    def upsert(self, points: List[PointStruct]) -> None:
+        if not points:
+            return
+        vectors = np.asarray([point.vector for point in points], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self._lock:
+            # The vectors are on disk before their log lines, see `_repair`
+            with open(self._file("vectors.f32"), "ab") as file:
+                file.write(vectors.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            with open(self._file("log.jsonl"), "a", encoding="utf-8") as file:
+                for point in points:
+                    point_id = str(point.id)
+                    file.write(json.dumps({"id": point_id, "payload": point.payload}, ensure_ascii=False) + "\n")
+                    self._append(point_id, point.payload)
+            self._invalidate()
+            self._compact_if_needed()
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            with open(self._file("log.jsonl"), "a", encoding="utf-8") as file:
+                for point_id in map(str, ids):
+                    if self._remove(point_id):
+                        file.write(json.dumps({"id": point_id, "deleted": True}) + "\n")
+            self._invalidate()
+            self._compact_if_needed()
+
+    def _compact_if_needed(self) -> None:
+        # Overwritten and deleted rows are dropped once they outnumber the live ones
+        if len(self._payloads) > 2 * max(len(self._rows), 1):
+            self.compact()
+
+    def delete_filter(self, query_filter: Filter) -> None:
+        with self._lock:
+            if not self._rows:
+                return
+            rows = np.flatnonzero(self.alive() & self.filter_mask(query_filter))
+            self.delete([self._row_ids[int(row)] for row in rows])
+
+    def compact(self) -> None:
+        """
+        Rewrite the files without the overwritten and deleted rows
+        Both files are written and synced as .tmp, then the marker compact.json records that
+        they are complete before they replace the originals. `load` finishes a swap interrupted
+        after the marker and discards the .tmp files of a compaction interrupted before it.
+        """
+        with self._lock:
+            matrix = self.matrix()
+            alive = [(point_id, row) for point_id, row in sorted(self._rows.items(), key=lambda item: item[1])]
+            with open(self._file("vectors.f32.tmp"), "wb") as file:
+                for _, row in alive:
+                    file.write(np.ascontiguousarray(matrix[row]).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            with open(self._file("log.jsonl.tmp"), "w", encoding="utf-8") as file:
+                for point_id, row in alive:
+                    file.write(json.dumps({"id": point_id, "payload": self._payloads[row]}, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            with open(self._file("compact.json.tmp"), "w", encoding="utf-8") as file:
+                json.dump({"points": len(alive)}, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(self._file("compact.json.tmp"), self._file("compact.json"))
+            self._sync_directory()
+            self._matrix = None
+            self._finish_compaction()
+            self.load()
+            logger.info(f"Coleccion local compactada a {len(alive)} puntos")
+
+    def _finish_compaction(self) -> None:
+        """
+        Swap in the files of a compaction: completes it if its marker exists, otherwise
+        the .tmp files are leftovers of an interrupted compaction and the originals are kept
+        """
+        if os.path.exists(self._file("compact.json")):
+            for name in ("vectors.f32", "log.jsonl"):
+                if os.path.exists(self._file(f"{name}.tmp")):
+                    os.replace(self._file(f"{name}.tmp"), self._file(name))
+            self._sync_directory()
+            os.remove(self._file("compact.json"))
+        for name in ("vectors.f32.tmp", "log.jsonl.tmp", "compact.json.tmp"):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+    def _sync_directory(self) -> None:
+        # Renames are durable once the directory is synced
+        descriptor = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def alive(self) -> np.ndarray:
+        """
+        Mask of the rows that are neither overwritten nor deleted
+        """
+        if self._alive is None:
+            self._alive = np.fromiter(
+                (point_id is not None for point_id in self._row_ids), dtype=bool, count=len(self._row_ids))
+        return self._alive
+
+    def _build_ivf(self, matrix: np.ndarray, alive: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        K-means clustering of the alive rows used as inverted file index
+        """
+        rows = np.flatnonzero(alive)
+        nlist = self.nlist or max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        centroids = np.array(matrix[rng.choice(rows, size=min(nlist, len(rows)), replace=False)])
+        for _ in range(10):
+            assignment = np.argmax(np.asarray(matrix[rows]) @ centroids.T, axis=1)
+            for cluster in range(len(centroids)):
+                members = rows[assignment == cluster]
+                if len(members):
+                    centroid = np.asarray(matrix[members]).mean(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+        assignment = np.argmax(np.asarray(matrix[rows]) @ centroids.T, axis=1)
+        lists = [rows[assignment == cluster] for cluster in range(len(centroids))]
+        self._ivf_rows = len(alive)
+        self._ivf_built = len(rows)
+        logger.info(f"Indice IVF construido con {len(centroids)} listas")
+        return centroids, lists
+
+    def _update_ivf(self, matrix: np.ndarray, alive: np.ndarray) -> None:
+        """
+        Recompute the clustering if the rows grew by `ivf_growth` times since it was built,
+        otherwise add the rows written since then to their closest cluster
+        """
+        if self._ivf is None or alive.sum() > self.ivf_growth * max(self._ivf_built, 1):
+            self._ivf = self._build_ivf(matrix, alive)
+            return
+        if self._ivf_rows == len(alive):
+            return
+        centroids, lists = self._ivf
+        rows = np.arange(self._ivf_rows, len(alive))
+        assignment = np.argmax(np.asarray(matrix[rows]) @ centroids.T, axis=1)
+        self._ivf = (centroids, [
+            np.concatenate([members, rows[assignment == cluster]]) for cluster, members in enumerate(lists)
+        ])
+        self._ivf_rows = len(alive)
+
+    def search(
+        self, vectors: List[List[float]], limit: int, params: Optional[SearchParams] = None,
+        query_filter: Optional[Filter] = None,
+    ) -> List[List[ScoredPoint]]:
+        queries = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        exact = params is not None and params.exact
+        quantization = params.quantization if params is not None else None
+        quantized = (
+            self.params.quantization_config is not None and not exact
+            and not (quantization is not None and quantization.ignore)
+        )
+        with self._lock:
+            if not self._rows:
+                return [[] for _ in vectors]
+            matrix = self.matrix()
+            alive = self.alive()
+            # Rows scored for each query, the same rows for all the queries unless the IVF index is used
+            shared = True
+            if query_filter is not None:
+                candidates = [np.flatnonzero(alive & self.filter_mask(query_filter))] * len(queries)
+            elif self.index == "ivf" and not exact:
+                self._update_ivf(matrix, alive)
+                candidates = [self._probe(query, alive) for query in queries]
+                shared = False
+            elif not quantized:
+                # Exact search: one matrix product for all the queries
+                scores = np.asarray(matrix @ queries.T).T
+                scores[:, ~alive] = -np.inf
+                rows = np.arange(len(alive))
+                return [self._top_k(rows, query_scores, limit) for query_scores in scores]
+            else:
+                candidates = [np.flatnonzero(alive)] * len(queries)
+
+            if not quantized:
+                if shared:
+                    rows = candidates[0]
+                    scores = (np.asarray(matrix[rows]) @ queries.T).T
+                    return [self._top_k(rows, query_scores, limit) for query_scores in scores]
+                return [
+                    self._top_k(rows, np.asarray(matrix[rows]) @ query, limit)
+                    for query, rows in zip(queries, candidates)
+                ]
+
+            rescore = quantization is None or quantization.rescore is not False
+            oversampling = (quantization.oversampling if quantization is not None else None) or 1.0
+            if shared:
+                approximate = self._approximate_scores(candidates[0], queries)
+            else:
+                approximate = [self._approximate_scores(rows, query[None])[0] for query, rows in zip(queries, candidates)]
+            results = []
+            for query, rows, scores in zip(queries, candidates, approximate):
+                if rescore:
+                    k = min(len(rows), int(np.ceil(limit * oversampling)))
+                    best = np.argpartition(-scores, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+                    rows = rows[best]
+                    scores = np.asarray(matrix[rows]) @ query
+                results.append(self._top_k(rows, scores, limit))
+            return results
+
+    def _approximate_scores(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """
+        Similarity of each query with the quantized vectors of the rows (queries x rows)
+        """
+        codes, lower, step = self.codes()
+        if isinstance(self.params.quantization_config, ScalarQuantization):
+            # Dequantized product: (lower + step * code) . query, each block is converted once for all the queries
+            scores = np.empty((len(queries), len(rows)), dtype=np.float32)
+            contiguous = len(rows) == len(codes)
+            for start in range(0, len(rows), 4096):
+                block = codes[start : start + 4096] if contiguous else codes[rows[start : start + 4096]]
+                block = block.astype(np.float32)
+                scores[:, start : start + 4096] = step * (queries @ block.T)
+            return scores + lower * queries.sum(axis=1, keepdims=True)
+        # Hamming distance between the sign bits, mapped to [-1, 1]
+        selected = codes[rows]
+        distances = np.stack([
+            POPCOUNT[selected ^ bits].sum(axis=1, dtype=np.int64) for bits in np.packbits(queries > 0, axis=1)
+        ])
+        return 1 - 2 * distances.astype(np.float32) / self.dimension
+
+    def _probe(self, query: np.ndarray, alive: np.ndarray) -> np.ndarray:
+        centroids, lists = self._ivf
+        probes = np.argsort(-(centroids @ query))[: self.nprobe]
+        rows = np.concatenate([lists[probe] for probe in probes])
+        # Lists keep the rows overwritten or deleted since they were built
+        return rows[alive[rows]]
+
+    def _top_k(self, candidates: np.ndarray, scores: np.ndarray, limit: int) -> List[ScoredPoint]:
+        k = min(limit, int(np.isfinite(scores).sum()))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            ScoredPoint(id=self._row_ids[int(candidates[i])], version=0, score=float(scores[i]),
+                        payload=self._payloads[int(candidates[i])])
+            for i in best
+        ]
+
+    def scroll(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            items = [(point_id, self._payloads[row]) for point_id, row in self._rows.items()]
+        yield from items
+
+    def scroll_vectors(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], List[Dict[str, Any]], np.ndarray]]:
+        with self._lock:
+            matrix = self.matrix()
+            items = sorted(self._rows.items(), key=lambda item: item[1])
+            payloads = [self._payloads[row] for _, row in items]
+        for start in range(0, len(items), batch_size):
+            batch = items[start : start + batch_size]
+            rows = [row for _, row in batch]
+            yield ([point_id for point_id, _ in batch], payloads[start : start + batch_size],
+                   np.asarray(matrix[rows], dtype=np.float32))
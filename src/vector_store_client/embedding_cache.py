@@ -0,0 +1,164 @@
+from array import array
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+"""
+    Disk-backed cache placed in front of the embedding model
+"""
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with a SQLite cache keyed by model name and text hash.
+    Vectors are stored as float32 blobs and the least recently used entries are
+    evicted once the cache grows over `max_entries`. Cache hits never call the
+    underlying model.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        path: str = "./data/staging/embeddings_cache.sqlite",
+        max_entries: int = 200_000,
+    ):
+        self.embeddings: Embeddings = embeddings
+        self.model_name: str = model_name
+        self.path: str = path
+        self.max_entries: int = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        """
+        Cache key of a text for the current model
+        """
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def lookup(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Return the cached vector of each text, None for the texts not in the cache
+        """
+        keys = [self.key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+            vectors = [found.get(key) for key in keys]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def store(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        Save vectors in the cache and evict the least recently used entries over the limit
+        """
+        now = time.time()
+        rows = [
+            (self.key(text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            overflow = self._count() - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                logger.info(f"Se eliminaron {overflow} embeddings del cache")
+            self._conn.commit()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _missing(self, texts: List[str], vectors: List[Optional[List[float]]]) -> List[str]:
+        return list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+
+    def _merge(self, texts, vectors, missing, computed) -> List[List[float]]:
+        self.store(missing, computed)
+        by_text = dict(zip(missing, computed))
+        return [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.lookup(texts)
+        missing = self._missing(texts, vectors)
+        if not missing:
+            return vectors
+        computed = self.embeddings.embed_documents(missing)
+        return self._merge(texts, vectors, missing, computed)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.lookup([text])[0]
+        if vector is not None:
+            return vector
+        vector = self.embeddings.embed_query(text)
+        self.store([text], [vector])
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.lookup(texts)
+        missing = self._missing(texts, vectors)
+        if not missing:
+            return vectors
+        computed = await self.embeddings.aembed_documents(missing)
+        return self._merge(texts, vectors, missing, computed)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.lookup([text])[0]
+        if vector is not None:
+            return vector
+        vector = await self.embeddings.aembed_query(text)
+        self.store([text], [vector])
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Hit/miss counters of the cache
+        """
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._count()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Optional
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue, PayloadSchemaType
+
+"""
+    Filters over the structured metadata of the chunks (chapter, article, resolution, table)
+"""
+
+# Payload fields indexed in the collection, the metadata of the chunk is stored under `metadata`
+PAYLOAD_INDEXES = {
+    "metadata.file_name": PayloadSchemaType.KEYWORD,
+    "metadata.chapter": PayloadSchemaType.KEYWORD,
+    "metadata.article": PayloadSchemaType.KEYWORD,
+    "metadata.resolution": PayloadSchemaType.KEYWORD,
+    "metadata.is_table": PayloadSchemaType.BOOL,
+}
+
+
+def build_filter(filters: Optional[Dict[str, Any]]) -> Optional[Filter]:
+    """
+    Qdrant filter of the metadata fields, e.g. {"chapter": "III", "article": ["155", "156"]}:
+    every field must match, a list matches any of its values
+    """
+    if not filters:
+        return None
+    conditions = []
+    for field, value in filters.items():
+        key = f"metadata.{field}"
+        if key not in PAYLOAD_INDEXES:
+            raise ValueError(f"No se puede filtrar por el campo {field}, campos disponibles {list(PAYLOAD_INDEXES)}")
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(FieldCondition(key=key, match=MatchAny(any=list(value))))
+        else:
+            conditions.append(FieldCondition(key=key, match=MatchValue(value=value)))
+    return Filter(must=conditions)
+
+
+def payload_values(payload: Optional[Dict[str, Any]], key: str) -> List[Any]:
+    """
+    Values of a dotted key of the payload, a list for array fields and empty if missing
+    """
+    value: Any = payload
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return []
+        value = value.get(part)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def condition_values(condition: FieldCondition) -> List[Any]:
+    """
+    Accepted values of a condition, only the match conditions of `build_filter` are supported
+    """
+    if isinstance(condition.match, MatchValue):
+        return [condition.match.value]
+    if isinstance(condition.match, MatchAny):
+        return list(condition.match.any)
+    raise ValueError(f"Condicion de filtro no soportada: {condition}")
+
+
+def matches(payload: Optional[Dict[str, Any]], query_filter: Optional[Filter]) -> bool:
+    """
+    Evaluate a filter built by `build_filter` over a payload (backends and indexes without filtering)
+    """
+    if query_filter is None:
+        return True
+    for condition in query_filter.must or []:
+        if not set(payload_values(payload, condition.key)) & set(condition_values(condition)):
+            return False
+    return True
@@ -0,0 +1,182 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from itertools import islice
+import asyncio
+import logging
+import time
+import httpx
+import openai
+from ..monitoring.metrics import registry
+
+"""
+    Asynchronous bulk ingestion of chunks into the vector store
+"""
+logger = logging.getLogger(__name__)
+
+# Status codes of the HTTP APIs (OpenAI, Qdrant REST) and codes of gRPC worth retrying
+TRANSIENT_STATUS = {408, 425, 429}
+TRANSIENT_GRPC = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED", "ABORTED"}
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Connection problems, timeouts, rate limits and server errors, which may succeed if retried.
+    Errors wrapped by the client (`raise ... from e`) are classified by their cause.
+    """
+    if error.__cause__ is not None:
+        return is_transient(error.__cause__)
+    if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in TRANSIENT_STATUS or status >= 500
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            return getattr(code(), "name", None) in TRANSIENT_GRPC
+        except TypeError:
+            return False
+    return False
+
+
+class IngestionPipeline:
+    """
+    Long-lived ingestion pipeline that overlaps embedding requests with database writes.
+
+    Chunks are grouped in batches of `batch_size` and embedded by `concurrency` workers.
+    Embedded batches go through a bounded queue (`queue_size`) to a writer that upserts them,
+    so a slow database applies back-pressure to the embedding workers instead of piling up
+    vectors in memory. Batches failing with a transient error are retried with exponential backoff.
+    With a `summarizer` each batch is summarized before being embedded, the summaries are
+    stored in the payload of the points. `on_written` receives the points of each written batch.
+    """
+
+    def __init__(
+        self,
+        client,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        queue_size: int = 8,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        summarizer=None,
+        on_written: Optional[Callable[[List[Any]], None]] = None,
+    ):
+        self.client = client
+        self.batch_size: int = batch_size
+        self.concurrency: int = concurrency
+        self.queue_size: int = queue_size
+        self.max_retries: int = max_retries
+        self.backoff: float = backoff
+        self.on_progress = on_progress
+        self.summarizer = summarizer
+        self.on_written = on_written
+        self.embedded: int = 0
+        self.written: int = 0
+
+    def batches(self, chunks: Iterable[Any]) -> Iterable[List[Any]]:
+        """
+        Group the chunks in lists of `batch_size`
+        """
+        iterator = iter(chunks)
+        while batch := list(islice(iterator, self.batch_size)):
+            yield batch
+
+    async def retry(self, operation: Callable, *args, description: str = ""):
+        """
+        Run the coroutine returned by `operation(*args)` retrying the transient errors with
+        exponential backoff, other errors (invalid payloads, dimensions, authentication) are
+        raised at once
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await operation(*args)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                if attempt == self.max_retries:
+                    raise ConnectionError(
+                        f"Problema en {description} tras {attempt + 1} intentos: {e}"
+                    )
+                delay = self.backoff * 2**attempt
+                logger.warning(
+                    f"Fallo en {description} (intento {attempt + 1}), reintentando en {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+
+    async def _embed_worker(self, batches: asyncio.Queue, points: asyncio.Queue) -> None:
+        while (batch := await batches.get()) is not None:
+            if self.summarizer is not None:
+                with registry.span("ingestion_summary"):
+                    batch = await self.retry(
+                        self.summarizer.asummarize, batch, description="el resumen"
+                    )
+            with registry.span("ingestion_embedding"):
+                embedded = await self.retry(
+                    self.client.embed_chunks, batch, description="el embedding"
+                )
+            registry.increment("ingested_chunks_total", len(batch), stage="embedded")
+            self.embedded += len(batch)
+            await points.put(embedded)
+
+    async def _upsert(self, embedded) -> List[str]:
+        return await asyncio.to_thread(self.client.upsert_points, embedded)
+
+    async def _writer(self, points: asyncio.Queue, ids: List[str], started: float) -> None:
+        while (embedded := await points.get()) is not None:
+            with registry.span("ingestion_upsert"):
+                ids.extend(await self.retry(self._upsert, embedded, description="la escritura"))
+            if self.on_written:
+                self.on_written(embedded)
+            self.written += len(embedded)
+            registry.increment("ingested_chunks_total", len(embedded), stage="written")
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Ingestados {self.written} chunks ({self.written / elapsed:.1f} chunks/s)"
+            )
+            if self.on_progress:
+                self.on_progress(self.embedded, self.written)
+
+    async def run(self, chunks: Iterable[Any]) -> List[str]:
+        """
+        Embed and write all the chunks
+        Returns the ids of the written points
+        """
+        started = time.perf_counter()
+        batches: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+        points: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        ids: List[str] = []
+
+        workers = [
+            asyncio.create_task(self._embed_worker(batches, points))
+            for _ in range(self.concurrency)
+        ]
+        writer = asyncio.create_task(self._writer(points, ids, started))
+
+        async def produce():
+            # The chunks may come from a blocking generator (extraction, chunking),
+            # batches are pulled in a thread so the event loop keeps serving the workers
+            source = self.batches(chunks)
+            while (batch := await asyncio.to_thread(next, source, None)) is not None:
+                await batches.put(batch)
+            for _ in workers:
+                await batches.put(None)
+            await asyncio.gather(*workers)
+            await points.put(None)
+            await writer
+
+        producer = asyncio.create_task(produce())
+        try:
+            await asyncio.gather(producer, *workers, writer)
+        except Exception:
+            for task in [producer, writer, *workers]:
+                task.cancel()
+            raise
+
+        logger.info(
+            f"Ingesta finalizada: {self.written} chunks en {time.perf_counter() - started:.1f}s"
+        )
+        return ids
+
+    def stats(self) -> Dict[str, int]:
+        return {"embedded": self.embedded, "written": self.written}
@@ -0,0 +1,319 @@
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import itertools
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import threading
+import unicodedata
+import numpy as np
+from qdrant_client.models import Filter
+from .filters import PAYLOAD_INDEXES, condition_values, payload_values
+
+"""
+    In-process BM25 index over the chunks stored in the vector store
+"""
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase the text, remove accents and split it into words and numbers
+    so article numbers and INS codes are kept as terms
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return TOKEN_PATTERN.findall(text)
+
+
+class IndexState(NamedTuple):
+    """
+    Arrays of a built index, replaced as a whole when the index is rebuilt
+    """
+
+    vocab: Dict[str, List[int]]
+    postings_docs: np.ndarray
+    postings_tf: np.ndarray
+    doc_lengths: np.ndarray
+    doc_offsets: np.ndarray
+    avg_length: float
+    documents: Optional[mmap.mmap]
+    fields: Dict[str, Dict[Any, Tuple[int, int]]]
+    field_docs: np.ndarray
+
+
+EMPTY_STATE = IndexState(
+    {}, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32),
+    np.zeros(0, dtype=np.int64), 0.0, None, {}, np.zeros(0, dtype=np.int32))
+
+
+class LexicalIndex:
+    """
+    Compact BM25 inverted index persisted as numpy arrays and loaded by memory-map.
+
+    Files inside `path`:
+     - vocab.json: term -> [offset, document frequency] into the postings arrays
+     - postings_docs.npy / postings_tf.npy: document number and term frequency of each posting
+     - doc_lengths.npy: number of terms of each document
+     - documents.jsonl + doc_offsets.npy: id, file name, content, summary and metadata of each document,
+       read by byte offset so the texts are not loaded in memory
+     - fields.json + field_docs.npy: for each filterable metadata field (PAYLOAD_INDEXES),
+       value -> [offset, count] into the document numbers having that value
+    New chunks are staged in pending.jsonl during the ingestion and merged by `commit`.
+    A build writes a new directory and swaps it in together with the loaded state, searches
+    running meanwhile keep reading the previous state until they finish.
+    """
+
+    def __init__(self, path: str = "./data/staging/lexical_index", k1: float = 1.5, b: float = 0.75):
+        self.path: str = path
+        self.k1: float = k1
+        self.b: float = b
+        self._pending = None
+        self._lock = threading.Lock()
+        self.state: IndexState = EMPTY_STATE
+        self.load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file("vocab.json"))
+
+    def load(self) -> None:
+        """
+        Memory-map the persisted index, an empty index is used if it does not exist
+        An index built without the filterable fields is rebuilt from its documents
+        """
+        self.state = self.read(self.path)
+        if self.exists() and not os.path.exists(self._file("fields.json")):
+            logger.info("El indice lexico no tiene los campos de filtro, se reconstruye")
+            self.build(self.documents())
+
+    @staticmethod
+    def read(path: str) -> IndexState:
+        if not os.path.exists(os.path.join(path, "vocab.json")):
+            return EMPTY_STATE
+        with open(os.path.join(path, "vocab.json"), "r", encoding="utf-8") as file:
+            vocab = json.load(file)
+        doc_lengths = np.load(os.path.join(path, "doc_lengths.npy"), mmap_mode="r")
+        documents = None
+        if len(doc_lengths):
+            with open(os.path.join(path, "documents.jsonl"), "rb") as file:
+                documents = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields: Dict[str, Dict[Any, Tuple[int, int]]] = {}
+        field_docs = np.zeros(0, dtype=np.int32)
+        if os.path.exists(os.path.join(path, "fields.json")):
+            with open(os.path.join(path, "fields.json"), "r", encoding="utf-8") as file:
+                fields = {
+                    key: {value: (offset, count) for value, offset, count in values}
+                    for key, values in json.load(file).items()
+                }
+            field_docs = np.load(os.path.join(path, "field_docs.npy"), mmap_mode="r")
+        return IndexState(
+            vocab,
+            np.load(os.path.join(path, "postings_docs.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "postings_tf.npy"), mmap_mode="r"),
+            doc_lengths,
+            np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode="r"),
+            float(doc_lengths.mean()) if len(doc_lengths) else 0.0,
+            documents,
+            fields,
+            field_docs,
+        )
+
+    def __len__(self) -> int:
+        return len(self.state.doc_lengths)
+
+    @staticmethod
+    def _document(state: IndexState, number: int) -> Dict[str, Any]:
+        start = int(state.doc_offsets[number])
+        end = state.documents.find(b"\n", start)
+        return json.loads(state.documents[start:end])
+
+    def document(self, number: int) -> Dict[str, Any]:
+        """
+        Read a document by its number in the index
+        """
+        return self._document(self.state, number)
+
+    def documents(self) -> Iterator[Dict[str, Any]]:
+        state = self.state
+        for number in range(len(state.doc_lengths)):
+            yield self._document(state, number)
+
+    @staticmethod
+    def filter_mask(state: IndexState, query_filter: Filter) -> np.ndarray:
+        """
+        Mask of the documents whose metadata matches every condition of the filter
+        """
+        total = len(state.doc_lengths)
+        mask = np.ones(total, dtype=bool)
+        for condition in query_filter.must or []:
+            index = state.fields.get(condition.key, {})
+            matched = np.zeros(total, dtype=bool)
+            for value in condition_values(condition):
+                if value in index:
+                    offset, count = index[value]
+                    matched[state.field_docs[offset : offset + count]] = True
+            mask &= matched
+        return mask
+
+    def search(
+        self, query: str, limit: int = 10, query_filter: Optional[Filter] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        BM25 search of the query, only the documents matching `query_filter` (built by
+        `build_filter`) are returned
+        Returns the documents and their scores ordered by score
+        """
+        # The whole search reads one state, a concurrent build does not change it
+        state = self.state
+        terms = [term for term in set(tokenize(query)) if term in state.vocab]
+        total = len(state.doc_lengths)
+        if not terms or not total:
+            return []
+        scores = np.zeros(total, dtype=np.float32)
+        for term in terms:
+            offset, df = state.vocab[term]
+            docs = state.postings_docs[offset : offset + df]
+            tf = state.postings_tf[offset : offset + df]
+            idf = np.log(1 + (total - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * state.doc_lengths[docs] / state.avg_length)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if query_filter is not None:
+            scores[~self.filter_mask(state, query_filter)] = 0
+        limit = min(limit, int(np.count_nonzero(scores)))
+        if limit == 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [(self._document(state, int(number)), float(scores[number])) for number in best]
+
+    def stage(
+        self, point_id: str, file_name: str, content: str, summary: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Stage a chunk written during the ingestion, it becomes searchable after `commit`
+        """
+        if self._pending is None:
+            os.makedirs(self.path, exist_ok=True)
+            # Leftovers of an interrupted ingestion are discarded
+            self._pending = open(self._file("pending.jsonl"), "w", encoding="utf-8")
+        self._pending.write(
+            json.dumps(
+                {"id": point_id, "file_name": file_name, "page_content": content, "summary": summary,
+                 "metadata": metadata},
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+
+    def _staged(self) -> Iterator[Dict[str, Any]]:
+        if self._pending is not None:
+            self._pending.close()
+            self._pending = None
+        pending = self._file("pending.jsonl")
+        if os.path.exists(pending):
+            with open(pending, "r", encoding="utf-8") as file:
+                for line in file:
+                    yield json.loads(line)
+
+    def commit(self, replaced_files: Iterable[str] = ()) -> None:
+        """
+        Rebuild the index with the current documents, except the ones of `replaced_files`,
+        plus the staged documents
+        """
+        replaced = set(replaced_files)
+        current = (doc for doc in self.documents() if doc["file_name"] not in replaced)
+        self.build(itertools.chain(current, self._staged()))
+
+    def build(self, documents: Iterable[Dict[str, Any]]) -> None:
+        """
+        Build the index from the documents in a temporary directory and swap it in
+        """
+        tmp_path = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        field_postings: Dict[str, Dict[Any, List[int]]] = {key: defaultdict(list) for key in PAYLOAD_INDEXES}
+        lengths: List[int] = []
+        offsets: List[int] = []
+        seen = set()
+        with open(os.path.join(tmp_path, "documents.jsonl"), "wb") as file:
+            for doc in documents:
+                if doc["id"] in seen:
+                    continue
+                seen.add(doc["id"])
+                number = len(lengths)
+                terms = tokenize(doc["page_content"])
+                for term, tf in Counter(terms).items():
+                    postings[term].append((number, tf))
+                for key, values in field_postings.items():
+                    for value in set(payload_values(doc, key)):
+                        if isinstance(value, (str, int, float, bool)):
+                            values[value].append(number)
+                lengths.append(len(terms))
+                offsets.append(file.tell())
+                file.write(json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        vocab: Dict[str, List[int]] = {}
+        docs_array = np.empty(sum(len(p) for p in postings.values()), dtype=np.int32)
+        tf_array = np.empty(len(docs_array), dtype=np.float32)
+        offset = 0
+        for term, term_postings in postings.items():
+            vocab[term] = [offset, len(term_postings)]
+            for number, tf in term_postings:
+                docs_array[offset] = number
+                tf_array[offset] = tf
+                offset += 1
+
+        fields: Dict[str, List[List[Any]]] = {}
+        field_docs: List[int] = []
+        for key, values in field_postings.items():
+            fields[key] = []
+            for value, numbers in values.items():
+                fields[key].append([value, len(field_docs), len(numbers)])
+                field_docs.extend(numbers)
+
+        with open(os.path.join(tmp_path, "vocab.json"), "w", encoding="utf-8") as file:
+            json.dump(vocab, file, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "fields.json"), "w", encoding="utf-8") as file:
+            json.dump(fields, file, ensure_ascii=False)
+        np.save(os.path.join(tmp_path, "field_docs.npy"), np.asarray(field_docs, dtype=np.int32))
+        np.save(os.path.join(tmp_path, "postings_docs.npy"), docs_array)
+        np.save(os.path.join(tmp_path, "postings_tf.npy"), tf_array)
+        np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.asarray(lengths, dtype=np.float32))
+        np.save(os.path.join(tmp_path, "doc_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+        # The staged documents were consumed by the build, pending.jsonl is dropped with the old index.
+        # Files of the old index stay readable by the searches holding its state until they finish
+        state = self.read(tmp_path)
+        old_path = f"{self.path}.old-{os.getpid()}-{threading.get_ident()}"
+        with self._lock:
+            if os.path.exists(self.path):
+                os.replace(self.path, old_path)
+            os.replace(tmp_path, self.path)
+            self.state = state
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Indice lexico construido con {len(lengths)} documentos y {len(vocab)} terminos")
+
+    def close(self) -> None:
+        self.state = EMPTY_STATE
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse several rankings of ids, each id scores sum(1 / (k + rank)) over the rankings
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,11 @@
+from collections import namedtuple
+
+"""
+    Result types shared by the search and the answer generation, kept free of heavy
+    imports so they can be used without connecting to the vector store
+"""
+
+# summary: summary of the chunk computed during the ingestion, None if it was not computed
+# metadata: payload metadata of the chunk (offsets, chapter, article, resolution, is_table)
+SearchResult = namedtuple(
+    "SearchResult", ["id", "score", "text", "file_name", "summary", "metadata"], defaults=(None, None))
@@ -0,0 +1,119 @@
+from typing import Any, Dict, Optional
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Distance,
+    HnswConfigDiff,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
+import os
+
+"""
+    Configuration of the collection (dimension, distance, HNSW and quantization)
+    and of the search, shared by the storage engines
+"""
+
+# Dimension of the vectors of the known embedding models, other models are probed
+EMBEDDING_SIZES = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+QUANTIZATIONS = ("none", "scalar", "binary")
+
+
+def vector_params(
+    size: int,
+    distance: Distance = Distance.COSINE,
+    quantization: str = "none",
+    on_disk: Optional[bool] = None,
+    m: Optional[int] = None,
+    ef_construct: Optional[int] = None,
+    quantile: float = 0.99,
+    always_ram: bool = True,
+) -> VectorParams:
+    """
+    Parameters of the vectors of a collection
+    Args:
+        quantization str: "none", "scalar" (int8) or "binary" (one bit per dimension),
+            the quantized vectors are kept in memory (`always_ram`) and the originals
+            are used to rescore the candidates
+        on_disk bool: keep the original vectors on disk
+        m / ef_construct int: HNSW graph parameters, the defaults of the database if None
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Cuantizacion no soportada: {quantization}, opciones {QUANTIZATIONS}")
+    quantization_config = None
+    if quantization == "scalar":
+        quantization_config = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=quantile, always_ram=always_ram))
+    elif quantization == "binary":
+        quantization_config = BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=always_ram))
+    hnsw_config = None
+    if m is not None or ef_construct is not None:
+        hnsw_config = HnswConfigDiff(m=m, ef_construct=ef_construct)
+    return VectorParams(
+        size=size,
+        distance=distance,
+        on_disk=on_disk,
+        hnsw_config=hnsw_config,
+        quantization_config=quantization_config,
+    )
+
+
+def vector_params_from_env(size: int) -> VectorParams:
+    """
+    Parameters of the vectors configured by the PIPE_* variables
+    """
+    on_disk = os.getenv("PIPE_VECTORS_ON_DISK")
+    m = os.getenv("PIPE_HNSW_M")
+    ef_construct = os.getenv("PIPE_HNSW_EF_CONSTRUCT")
+    return vector_params(
+        size,
+        quantization=os.getenv("PIPE_QUANTIZATION", "none"),
+        on_disk=on_disk.lower() == "true" if on_disk else None,
+        m=int(m) if m else None,
+        ef_construct=int(ef_construct) if ef_construct else None,
+        quantile=float(os.getenv("PIPE_QUANTIZATION_QUANTILE", 0.99)),
+    )
+
+
+def quantization_name(params: VectorParams) -> str:
+    if isinstance(params.quantization_config, ScalarQuantization):
+        return "scalar"
+    if isinstance(params.quantization_config, BinaryQuantization):
+        return "binary"
+    return "none"
+
+
+def search_params(
+    ef: Optional[int] = None,
+    oversampling: Optional[float] = None,
+    rescore: Optional[bool] = None,
+    exact: bool = False,
+) -> Optional[SearchParams]:
+    """
+    Search-time parameters: HNSW `ef`, oversampling and rescoring of the quantized
+    candidates, or an `exact` search; None uses the defaults of the collection
+    """
+    if ef is None and oversampling is None and rescore is None and not exact:
+        return None
+    quantization = None
+    if oversampling is not None or rescore is not None:
+        quantization = QuantizationSearchParams(oversampling=oversampling, rescore=rescore)
+    return SearchParams(hnsw_ef=ef, exact=exact, quantization=quantization)
+
+
+def params_to_dict(params: VectorParams) -> Dict[str, Any]:
+    return params.model_dump(mode="json", exclude_none=True)
+
+
+def params_from_dict(data: Dict[str, Any]) -> VectorParams:
+    # Collections created before the schema was configurable only stored their size
+    return VectorParams.model_validate({"distance": Distance.COSINE, **data})
@@ -0,0 +1,213 @@
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from qdrant_client.models import PointStruct
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from .ingestion import IngestionPipeline
+from .schema import params_to_dict
+from ..monitoring.metrics import registry
+from ..retrievers.scheduler import run_sync
+
+"""
+    Snapshots of a collection used to bootstrap a new deployment without extracting
+    the documents nor calling the embedding model
+
+    python -m src.vector_store_client.snapshot export --path ./data/snapshots/reglamentacion
+    python -m src.vector_store_client.snapshot import --path ./data/snapshots/reglamentacion
+"""
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Files of a snapshot, snapshot.json is written last and marks a complete export
+SNAPSHOT_FILE = "snapshot.json"
+VECTORS_FILE = "vectors.npy"
+POINTS_FILE = "points.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+
+def read_snapshot(path: str) -> Dict[str, Any]:
+    """
+    Description of the snapshot (collection, embedding model, number of points and schema)
+    """
+    try:
+        with open(os.path.join(path, SNAPSHOT_FILE), "r", encoding="utf-8") as file:
+            info = json.load(file)
+    except FileNotFoundError:
+        raise ValueError(f"No existe un snapshot completo en {path}")
+    if info.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Version de snapshot no soportada: {info.get('version')}")
+    return info
+
+
+def export_snapshot(
+    client,
+    path: str,
+    manifest_path: Optional[str] = None,
+    batch_size: int = 1000,
+    dtype: str = "float32",
+) -> Dict[str, Any]:
+    """
+    Export the points of the collection of the client
+    Files inside `path`:
+     - vectors.npy: matrix of the vectors (`dtype` float32 or float16), one row per point
+     - points.jsonl: one line per point ({"id", "payload"}) in the same order as the rows
+     - manifest.json: manifest of the ingested documents, if `manifest_path` exists
+     - snapshot.json: collection, embedding model, number of points and parameters of the vectors
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"Tipo de vectores no soportado: {dtype}")
+    backend = client.client
+    count = backend.count()
+    params = backend.vector_params()
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, SNAPSHOT_FILE)):
+        os.remove(os.path.join(path, SNAPSHOT_FILE))
+
+    with registry.span("snapshot_export"):
+        vectors = np.lib.format.open_memmap(
+            os.path.join(path, VECTORS_FILE), mode="w+", dtype=dtype,
+            shape=(count, params.size))
+        written = 0
+        with open(os.path.join(path, POINTS_FILE), "w", encoding="utf-8") as file:
+            for ids, payloads, batch in backend.scroll_vectors(batch_size):
+                if written + len(ids) > count:
+                    raise ValueError("La coleccion cambio durante la exportacion, vuelva a intentarlo")
+                vectors[written : written + len(ids)] = batch
+                for point_id, payload in zip(ids, payloads):
+                    file.write(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n")
+                written += len(ids)
+        vectors.flush()
+        del vectors
+        if written != count:
+            raise ValueError("La coleccion cambio durante la exportacion, vuelva a intentarlo")
+        if manifest_path and os.path.exists(manifest_path):
+            shutil.copyfile(manifest_path, os.path.join(path, MANIFEST_FILE))
+
+    info = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "collection": backend.collection,
+        "model_name": client.model_name,
+        "count": count,
+        "dimension": params.size,
+        "dtype": dtype,
+        "vector_params": params_to_dict(params),
+        "manifest": os.path.exists(os.path.join(path, MANIFEST_FILE)),
+    }
+    with open(os.path.join(path, SNAPSHOT_FILE), "w", encoding="utf-8") as file:
+        json.dump(info, file, ensure_ascii=False, indent=2)
+    logger.info(f"Snapshot de {count} puntos de la coleccion {backend.collection} guardado en {path}")
+    return info
+
+
+def snapshot_points(path: str, batch_size: int) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+    """
+    Stream the lines of points.jsonl in batches with the row of their first point
+    """
+    with open(os.path.join(path, POINTS_FILE), "r", encoding="utf-8") as file:
+        start = 0
+        while batch := list(islice(file, batch_size)):
+            yield start, [json.loads(line) for line in batch]
+            start += len(batch)
+
+
+async def aimport_snapshot(
+    client,
+    path: str,
+    replace: bool = False,
+    batch_size: int = 500,
+    concurrency: int = 4,
+) -> Dict[str, Any]:
+    """
+    Bulk load a snapshot into the collection of the client with `concurrency` parallel upserts
+    The collection must be empty unless `replace`, in which case the points that are not
+    in the snapshot are deleted. The lexical index is rebuilt from the imported payloads.
+    """
+    info = read_snapshot(path)
+    backend = client.client
+    if info["model_name"] != client.model_name:
+        raise ValueError(
+            f"El snapshot fue generado con el modelo {info['model_name']} y el cliente usa "
+            f"{client.model_name}, las consultas no serian comparables")
+    if info["dimension"] != backend.vector_size():
+        raise ValueError(
+            f"El snapshot tiene vectores de dimension {info['dimension']} y la coleccion "
+            f"{backend.collection} de dimension {backend.vector_size()}")
+    existing = {point_id for point_id, _ in backend.scroll()}
+    if existing and not replace:
+        raise ValueError(
+            f"La coleccion {backend.collection} ya tiene {len(existing)} puntos, use replace para sobrescribirla")
+
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    pipeline = IngestionPipeline(client, batch_size=batch_size, concurrency=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    imported: List[str] = []
+
+    async def upsert(start: int, records: List[Dict[str, Any]]) -> None:
+        try:
+            batch = np.asarray(vectors[start : start + len(records)], dtype=np.float32)
+            points = [
+                PointStruct(id=record["id"], vector=vector.tolist(), payload=record["payload"])
+                for record, vector in zip(records, batch)
+            ]
+            ids = await pipeline.retry(
+                asyncio.to_thread, client.upsert_points, points, description="la importacion del snapshot")
+            imported.extend(ids)
+            registry.increment("snapshot_points_total", len(ids), operation="import")
+        finally:
+            semaphore.release()
+
+    with registry.span("snapshot_import"):
+        tasks = []
+        for start, records in snapshot_points(path, batch_size):
+            # Bounded number of batches in flight, the snapshot is not loaded in memory
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(upsert(start, records)))
+        await asyncio.gather(*tasks)
+        client.delete_points(list(existing - set(imported)))
+    with registry.span("lexical_index"):
+        client.rebuild_lexical_index()
+    logger.info(f"Se importaron {len(imported)} puntos en la coleccion {backend.collection} desde {path}")
+    return {**info, "imported": len(imported), "deleted": len(existing - set(imported))}
+
+
+def import_snapshot(client, path: str, **kwargs) -> Dict[str, Any]:
+    """
+    Synchronous wrapper of `aimport_snapshot`, use `aimport_snapshot` inside a running event loop
+    """
+    return run_sync(lambda: aimport_snapshot(client, path, **kwargs), "aimport_snapshot(...)")
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Exportar o importar un snapshot de la coleccion")
+    parser.add_argument("operation", choices=["export", "import"])
+    parser.add_argument("--path", required=True, help="directorio del snapshot")
+    parser.add_argument("--data-path", default=os.getenv("PIPE_STAGING_PATH", "./data/staging"),
+                        help="directorio de staging con el manifiesto de los documentos")
+    parser.add_argument("--collection", default=None, help="coleccion, PIPE_COLLECTION_NAME por defecto")
+    parser.add_argument("--float16", action="store_true", help="exportar los vectores en float16")
+    parser.add_argument("--replace", action="store_true", help="sobrescribir una coleccion con puntos")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    from ..controler import Controler
+
+    kwargs = {"collection": args.collection} if args.collection else {}
+    controler = Controler(data_path=args.data_path, **kwargs)
+    if args.operation == "export":
+        return controler.export_snapshot(args.path, dtype="float16" if args.float16 else "float32")
+    return controler.import_snapshot(
+        args.path, replace=args.replace, batch_size=args.batch_size, concurrency=args.concurrency)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=" %(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
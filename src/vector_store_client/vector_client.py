@@ -1,13 +1,20 @@
 from dotenv import load_dotenv
 import logging
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance
-from typing import Dict, List, Any
+from qdrant_client.models import PointStruct, SearchParams, VectorParams
+from typing import Dict, List, Any, Optional, Tuple
+import time
 import uuid
+import hashlib
 import os
-from langchain_qdrant import QdrantVectorStore
-from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
+from .embedding_cache import CachedEmbeddings
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .backends import LocalBackend, QdrantBackend, VectorBackend
+from .results import SearchResult
+from .filters import PAYLOAD_INDEXES, build_filter
+from .schema import EMBEDDING_SIZES, search_params, vector_params_from_env
+from ..monitoring.metrics import registry
 
 
 """
@@ -18,12 +25,14 @@ logger = logging.getLogger(__name__)
 
 class VectorStoreClient:
 
-    def init_client(self, **kwargs):
+    def init_client(self, **kwargs) -> VectorBackend:
         """ 
         Initialize the connection with the vector store client
+        type 'qdrant' connects to the Qdrant server, type 'local' uses the in-process backend
         if the connection is not possible raise an error ConnectionRefusedError
         """
-        if kwargs.get('type') == 'qdrant':
+        store_type = kwargs.get('type', os.getenv('PIPE_DB_TYPE', 'qdrant'))
+        if store_type == 'qdrant':
             try:
                 client = QdrantClient(
                     url=self._url_db,
@@ -35,41 +44,125 @@ class VectorStoreClient:
                 raise ConnectionRefusedError(
                     "No se puede conectar a la base de datos")
 
-            return client
+            return QdrantBackend(client, self._collection)
+        if store_type == 'local':
+            return LocalBackend(
+                kwargs.get('path', os.getenv('PIPE_LOCAL_STORE', './data/staging/local_store')),
+                self._collection,
+                index=kwargs.get('index', os.getenv('PIPE_LOCAL_INDEX', 'flat')))
+        raise ValueError(f"Tipo de base de datos no soportado: {store_type}")
 
     def __init__(self, **kwargs):
         load_dotenv()
         os.getenv('OPENAI_API_KEY')
         self._url_db: str = os.getenv('PIPE_DB_ENDPOINT', 'None')
         self._data: str = os.getenv('PIPE_DATA_PATH')
-        self._collection: str = os.getenv('PIPE_COLLECTION_NAME')
-        self.model_name: str = os.getenv('PIPE_EMBEDDING_MODEL')
-        self._model: str = OpenAIEmbeddings(model=self.model_name)
+        self._collection: str = kwargs.get('collection', os.getenv('PIPE_COLLECTION_NAME'))
+        self.model_name: str = kwargs.get('model_name', os.getenv('PIPE_EMBEDDING_MODEL', 'text-embedding-ada-002'))
+        # Any langchain Embeddings can replace the OpenAI model (e.g. recorded embeddings in the benchmarks)
+        self._model: CachedEmbeddings = CachedEmbeddings(
+            kwargs.get('embeddings') or OpenAIEmbeddings(model=self.model_name),
+            self.model_name,
+            path=kwargs.get('embedding_cache', os.getenv('PIPE_EMBEDDING_CACHE',
+                                                         './data/staging/embeddings_cache.sqlite')),
+            max_entries=int(os.getenv('PIPE_EMBEDDING_CACHE_SIZE', 200000)))
+        # Parameters of the collection (dimension, HNSW, quantization), from the PIPE_* variables by default
+        self._vector_params: Optional[VectorParams] = kwargs.get('vector_params')
+        ef, oversampling = os.getenv('PIPE_SEARCH_EF'), os.getenv('PIPE_SEARCH_OVERSAMPLING')
+        self.search_defaults: Dict[str, Any] = {
+            'ef': int(ef) if ef else None,
+            'oversampling': float(oversampling) if oversampling else None,
+        }
+        self.lexical_index: LexicalIndex = LexicalIndex(
+            kwargs.get('lexical_index', os.getenv('PIPE_LEXICAL_INDEX', './data/staging/lexical_index')))
         self.client = self.init_client(**kwargs)
         self.collection_check()
-        self.qdrant_vector_store = QdrantVectorStore(
-            self.client, self._collection, embedding=self._model)
+        self.timings: Dict[str, float] = {}
+
+    @staticmethod
+    def point_id(file_name: str, content: str) -> str:
+        """
+        Deterministic point id derived from the file name and the hash of the chunk content,
+        re-ingesting the same chunk overwrites the existing point instead of duplicating it
+        """
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_name}:{content_hash}"))
 
-    async def insert_embeddings(self, data: List[Dict[str, Any]]):
+    async def embed_chunks(self, data: List[Dict[str, Any]]) -> List[PointStruct]:
         """
-        Parse data from chunks generated into Document objects and insert them into the database using the Asynchronous Add Documents method
+        Embed a batch of chunks and build the points to upsert, the payload follows the
+        layout used by QdrantVectorStore (page_content + metadata)
         """
-        documents = [
-            Document(
-                id=str(uuid.uuid4()),
-                page_content=vector.contenido,
-                metadata={'file_name': vector.metadata}
-            ) for vector in data
+        vectors = await self._model.aembed_documents([chunk.contenido for chunk in data])
+        return [
+            PointStruct(
+                id=self.point_id(chunk.metadata, chunk.contenido),
+                vector=vector,
+                payload={'page_content': chunk.contenido,
+                         'summary': chunk.summary,
+                         'metadata': {'file_name': chunk.metadata,
+                                      'start': chunk.start, 'end': chunk.end,
+                                      **(chunk.fields or {})}}
+            ) for chunk, vector in zip(data, vectors)
         ]
 
+    def upsert_points(self, points: List[PointStruct]) -> List[str]:
+        """
+        Write the points into the collection
+        Returns the ids of the written points
+        """
         try:
-            await self.qdrant_vector_store.aadd_documents(documents)
+            self.client.upsert(points)
         except Exception as e:
-            raise ConnectionError(f"Problema insertando los datos {e}")
+            raise ConnectionError(f"Problema insertando los datos {e}") from e
+        return [point.id for point in points]
+
+    async def insert_embeddings(self, data: List[Dict[str, Any]]) -> List[str]:
+        """
+        Embed the chunks generated and insert them into the database
+        Returns the ids of the inserted points
+        """
+        points = await self.embed_chunks(data)
+        return self.upsert_points(points)
+
+    def delete_points(self, ids: List[str]) -> None:
+        """
+        Remove the points with the given ids from the collection
+        """
+        if not ids:
+            return
+        try:
+            self.client.delete(ids)
+        except Exception as e:
+            raise ConnectionError(f"Problema eliminando los datos {e}") from e
+        logger.info(f"Se eliminaron {len(ids)} puntos de la coleccion")
+
+    def delete_files(self, file_names: List[str]) -> None:
+        """
+        Remove every point of the given documents, whatever their ids
+        """
+        if not file_names:
+            return
+        try:
+            self.client.delete_filter(build_filter({'file_name': list(file_names)}))
+        except Exception as e:
+            raise ConnectionError(f"Problema eliminando los datos {e}") from e
+        logger.info(f"Se eliminaron los puntos de {len(file_names)} documentos de la coleccion")
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embedding of the user query, served from the embedding cache when possible
+        """
+        return self._model.embed_query(query)
+
+    def cache_stats(self) -> Dict[str, float]:
+        """
+        Hit/miss counters of the embedding cache
+        """
+        return self._model.stats()
 
     def vector_check(self) -> None:
-        number_vectors = self.client.count(
-            collection_name=self._collection).count
+        number_vectors = self.client.count()
         logger.info(
             f"Se encontraron {number_vectors} vectores en la base de datos")
         if number_vectors > 0:
@@ -77,49 +170,161 @@ class VectorStoreClient:
         else:
             return False
 
-    def collection_check(self) -> None:
+    def embedding_size(self) -> int:
         """
-        Validates if collection exists inside the database. If it does not exist, it creates it.
-        If any problem raises while creating the collection, it raises a ValueError.
+        Dimension of the vectors of the embedding model: PIPE_VECTOR_SIZE, the known size
+        of the model or the size of an embedding computed once (and cached)
         """
-        default_params = {
-            "index_name": self._collection,
-            "vectors_config": {
-                "size": 1536,
-                "distance": Distance.COSINE
-            }
-        }
+        size = os.getenv('PIPE_VECTOR_SIZE') or EMBEDDING_SIZES.get(self.model_name)
+        if size:
+            return int(size)
+        return len(self._model.embed_query("dimension"))
 
-        status_collection = self.client.collection_exists(
-            collection_name=self._collection)
+    @property
+    def vector_params(self) -> VectorParams:
+        if self._vector_params is None:
+            self._vector_params = vector_params_from_env(self.embedding_size())
+        return self._vector_params
+
+    def collection_check(self) -> None:
+        """
+        Validates if collection exists inside the database. If it does not exist, it creates it
+        with the configured parameters. If any problem raises while creating the collection or
+        the dimension of the collection does not match the embedding model, it raises a ValueError.
+        The payload indexes of the filterable fields are created if they are missing.
+        """
+        status_collection = self.client.collection_exists()
         if not status_collection:
             try:
-                vector_config = VectorParams(
-                    size=default_params.get('vectors_config').get('size'),
-                    distance=default_params.get(
-                        'vectors_config').get('distance')
-                )
-                self.client.create_collection(
-                    collection_name=self._collection, vectors_config=vector_config)
+                self.client.create_collection(self.vector_params)
             except ValueError:
                 raise ValueError("Problema creando la colección")
+        else:
+            size = self.client.vector_size()
+            if size != self.vector_params.size:
+                raise ValueError(
+                    f"La colección {self._collection} tiene vectores de dimensión {size} y el modelo "
+                    f"{self.model_name} genera vectores de dimensión {self.vector_params.size}, "
+                    f"use otra colección o vuelva a ingestar los documentos")
+        # Only the missing indexes are created, collections created before a field was
+        # filterable get its index on the next check
+        self.client.create_payload_indexes(PAYLOAD_INDEXES)
         return status_collection
 
-    def search(self, query: str, limit=10, **kwargs) -> List[Document]:
+    def search_params(self, ef: Optional[int] = None, oversampling: Optional[float] = None,
+                      exact: bool = False) -> Optional[SearchParams]:
+        """
+        Search-time parameters, PIPE_SEARCH_EF and PIPE_SEARCH_OVERSAMPLING by default
+        """
+        return search_params(
+            ef=ef if ef is not None else self.search_defaults['ef'],
+            oversampling=oversampling if oversampling is not None else self.search_defaults['oversampling'],
+            exact=exact)
+
+    def search(self, query: str, limit=10, hybrid=True, ef: Optional[int] = None,
+               oversampling: Optional[float] = None, exact: bool = False,
+               filters: Optional[Dict[str, Any]] = None, **kwargs) -> List[SearchResult]:
         """
         Perform a search query in the database
+        When the lexical index is available the dense results are fused with the BM25
+        results using reciprocal rank fusion
         Args:
             query str: user input query
+            limit int: number of documents to return
+            hybrid bool: fuse the dense results with the lexical index
+            ef int: size of the HNSW candidate list, larger is slower and more accurate
+            oversampling float: candidates scored on the quantized vectors per result,
+                rescored with the original vectors
+            exact bool: exact search, without the HNSW index nor the quantized vectors
+            filters dict: metadata the results must match, e.g. {"chapter": "III", "article": ["155"]},
+                fields: file_name, chapter, article, resolution, is_table; a list matches any of its values
         Returns:
-            results: results from the query
-        """
-        vector_retriever = self.qdrant_vector_store.as_retriever(search_kwargs={
-                                                                 "k": limit})
-        query_results: List[Document] = vector_retriever.invoke(query)
-        lista_documentos = []
-        for result in query_results:
-            documento = {}
-            documento['page_content'] = result.page_content
-            documento['metadata'] = result.id
-            lista_documentos.append(documento)
-        return lista_documentos, query_results
+            results: results from the query ordered by score, the score is the cosine
+            similarity for dense results and the fused score for hybrid results
+        """
+        return self.search_batch([query], limit=limit, hybrid=hybrid, ef=ef,
+                                 oversampling=oversampling, exact=exact, filters=filters)[0]
+
+    def search_batch(self, queries: List[str], limit=10, hybrid=True, ef: Optional[int] = None,
+                     oversampling: Optional[float] = None, exact: bool = False,
+                     filters: Optional[Dict[str, Any]] = None) -> List[List[SearchResult]]:
+        """
+        Perform several search queries with one embedding request and one batch query to the database
+        The time spent embedding, in the database and in the rest of the search
+        (overhead) is kept in `self.timings`
+        Args:
+            queries List[str]: user input queries
+            limit int: number of documents to return for each query
+            hybrid bool: fuse the dense results with the lexical index
+            ef, oversampling, exact, filters: search-time parameters and filters, see `search`
+        Returns:
+            results: the results of each query, in the same format as `search`
+        """
+        if not queries:
+            return []
+        started = time.perf_counter()
+        hybrid = hybrid and len(self.lexical_index) > 0
+        candidates = limit * 3 if hybrid else limit
+        vectors = self._model.embed_documents(queries)
+        embedded = time.perf_counter()
+        query_filter = build_filter(filters)
+        responses = self.client.search(
+            vectors, candidates, self.search_params(ef, oversampling, exact), query_filter)
+        searched = time.perf_counter()
+        results = []
+        for query, points in zip(queries, responses):
+            query_results = [
+                SearchResult(
+                    id=str(point.id),
+                    score=point.score,
+                    text=point.payload.get('page_content', ''),
+                    file_name=(point.payload.get('metadata') or {}).get('file_name'),
+                    summary=point.payload.get('summary'),
+                    metadata=point.payload.get('metadata'))
+                for point in points]
+            if hybrid:
+                lexical = self.lexical_index.search(query, candidates, query_filter)
+                query_results = self.fuse(query_results, lexical, limit)
+            results.append(query_results)
+        finished = time.perf_counter()
+        self.timings = {
+            'embedding_ms': (embedded - started) * 1000,
+            'database_ms': (searched - embedded) * 1000,
+            'overhead_ms': (finished - searched) * 1000,
+        }
+        for stage, value in self.timings.items():
+            registry.observe("stage_latency_ms", value, stage=f"search_{stage[:-3]}")
+        registry.increment("search_queries_total", len(queries), hybrid=hybrid)
+        logger.debug(f"Tiempos de busqueda: {self.timings}")
+        return results
+
+    @staticmethod
+    def fuse(dense: List[SearchResult], lexical: List[Tuple[Dict[str, Any], float]], limit: int) -> List[SearchResult]:
+        """
+        Reciprocal rank fusion of the dense and lexical results
+        """
+        results: Dict[str, SearchResult] = {result.id: result for result in dense}
+        for doc, score in lexical:
+            results.setdefault(doc['id'], SearchResult(
+                id=doc['id'], score=score, text=doc['page_content'], file_name=doc['file_name'],
+                summary=doc.get('summary'), metadata=doc.get('metadata')))
+        ranking = reciprocal_rank_fusion([
+            [result.id for result in dense],
+            [doc['id'] for doc, _ in lexical],
+        ])
+        return [results[point_id]._replace(score=score) for point_id, score in ranking[:limit]]
+
+    def rebuild_lexical_index(self) -> None:
+        """
+        Build the lexical index from the payloads stored in the collection
+        """
+        def documents():
+            for point_id, payload in self.client.scroll():
+                yield {'id': point_id,
+                       'file_name': payload.get('metadata', {}).get('file_name'),
+                       'page_content': payload.get('page_content', ''),
+                       'summary': payload.get('summary'),
+                       'metadata': payload.get('metadata')}
+
+        logger.info("Construyendo el indice lexico a partir de la coleccion")
+        self.lexical_index.build(documents())
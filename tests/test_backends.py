@@ -0,0 +1,193 @@
+import os
+import uuid
+import numpy as np
+import pytest
+from qdrant_client.models import PointStruct
+from src.vector_store_client import backends
+from src.vector_store_client.backends import LocalBackend
+from src.vector_store_client.filters import build_filter
+from src.vector_store_client.schema import search_params, vector_params
+
+DIMENSION = 32
+CHAPTERS = ["I", "II", "III"]
+
+
+def point_id(number: int) -> str:
+    return str(uuid.UUID(int=number))
+
+
+def make_points(vectors: np.ndarray, start: int = 0):
+    return [
+        PointStruct(
+            id=point_id(start + i),
+            vector=vector.tolist(),
+            payload={"page_content": f"chunk {start + i}",
+                     "metadata": {"chapter": CHAPTERS[(start + i) % len(CHAPTERS)], "is_table": (start + i) % 5 == 0}},
+        )
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, limit: int, rows=None):
+    """
+    Ids and cosine scores of the exact top-k over `rows` (all the rows by default)
+    """
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    best = rows[np.argsort(-scores[rows])[:limit]]
+    return [point_id(int(row)) for row in best], scores[best]
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(400, DIMENSION)).astype(np.float32)
+
+
+@pytest.fixture
+def queries():
+    return np.random.default_rng(1).normal(size=(5, DIMENSION)).astype(np.float32)
+
+
+def make_backend(path, vectors, quantization="none", **kwargs) -> LocalBackend:
+    backend = LocalBackend(str(path), "test", **kwargs)
+    backend.create_collection(vector_params(DIMENSION, quantization=quantization))
+    backend.upsert(make_points(vectors))
+    return backend
+
+
+def test_exact_search_matches_brute_force(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors)
+    for query, found in zip(queries, backend.search(queries.tolist(), 10)):
+        ids, scores = brute_force(vectors, query, 10)
+        assert [point.id for point in found] == ids
+        assert np.allclose([point.score for point in found], scores, atol=1e-5)
+
+
+def test_filtered_search_only_scores_matching_rows(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors)
+    query_filter = build_filter({"chapter": ["I", "III"], "is_table": False})
+    rows = [row for row in range(len(vectors)) if row % 3 in (0, 2) and row % 5 != 0]
+    for query, found in zip(queries, backend.search(queries.tolist(), 10, query_filter=query_filter)):
+        ids, _ = brute_force(vectors, query, 10, rows)
+        assert [point.id for point in found] == ids
+        assert all(point.payload["metadata"]["chapter"] in ("I", "III") for point in found)
+
+
+def test_filter_without_matches_returns_nothing(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors)
+    found = backend.search(queries.tolist(), 10, query_filter=build_filter({"chapter": "XX"}))
+    assert found == [[] for _ in queries]
+
+
+def test_overwritten_and_deleted_points_are_not_returned(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors)
+    query = queries[0]
+    best, _ = brute_force(vectors, query, 2)
+    backend.delete([best[0]])
+    # The second best point is moved away from the query
+    backend.upsert([PointStruct(id=best[1], vector=(-query).tolist(), payload={"page_content": "moved"})])
+    found = [point.id for point in backend.search([query.tolist()], 10)[0]]
+    assert best[0] not in found and best[1] not in found
+    assert backend.count() == len(vectors) - 1
+
+
+def test_ivf_probing_every_list_matches_exact(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors, index="ivf", nlist=8, nprobe=8)
+    for query, found in zip(queries, backend.search(queries.tolist(), 10)):
+        ids, _ = brute_force(vectors, query, 10)
+        assert [point.id for point in found] == ids
+
+
+def test_ivf_includes_rows_written_after_clustering(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors[:300], index="ivf", nlist=8, nprobe=8)
+    backend.search(queries.tolist(), 10)
+    backend.upsert(make_points(vectors[300:], start=300))
+    for query, found in zip(queries, backend.search(queries.tolist(), 10)):
+        ids, _ = brute_force(vectors, query, 10)
+        assert [point.id for point in found] == ids
+
+
+@pytest.mark.parametrize("quantization", ["scalar", "binary"])
+def test_quantized_search_is_rescored_with_the_original_vectors(tmp_path, vectors, queries, quantization):
+    backend = make_backend(tmp_path, vectors, quantization=quantization)
+    found = backend.search(queries.tolist(), 10, search_params(oversampling=float(len(vectors))))
+    for query, points in zip(queries, found):
+        ids, scores = brute_force(vectors, query, 10)
+        # Every row is rescored, the results are the exact ones
+        assert [point.id for point in points] == ids
+        assert np.allclose([point.score for point in points], scores, atol=1e-5)
+
+
+def test_exact_parameter_ignores_quantization(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors, quantization="binary")
+    for query, found in zip(queries, backend.search(queries.tolist(), 10, search_params(exact=True))):
+        ids, _ = brute_force(vectors, query, 10)
+        assert [point.id for point in found] == ids
+
+
+def test_interrupted_upsert_is_discarded_on_load(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors)
+    # Vectors of an upsert whose log line was torn
+    with open(backend._file("vectors.f32"), "ab") as file:
+        file.write(np.ones(DIMENSION, dtype=np.float32).tobytes())
+    with open(backend._file("log.jsonl"), "a", encoding="utf-8") as file:
+        file.write('{"id": "torn", "payl')
+
+    reloaded = LocalBackend(str(tmp_path), "test")
+    assert reloaded.count() == len(vectors)
+    ids, _ = brute_force(vectors, queries[0], 10)
+    assert [point.id for point in reloaded.search([queries[0].tolist()], 10)[0]] == ids
+
+
+def test_delete_filter_removes_every_matching_point(tmp_path, vectors, queries):
+    backend = make_backend(tmp_path, vectors)
+    backend.delete_filter(build_filter({"chapter": "II"}))
+    rows = [row for row in range(len(vectors)) if row % 3 != 1]
+    assert backend.count() == len(rows)
+    ids, _ = brute_force(vectors, queries[0], 10, rows)
+    assert [point.id for point in backend.search([queries[0].tolist()], 10)[0]] == ids
+
+
+def crash_on_replace(monkeypatch, allowed: int) -> None:
+    """
+    Make the compaction fail after `allowed` renames, as if the process died
+    """
+    calls = []
+    replace = os.replace
+
+    def failing(source, target):
+        calls.append(source)
+        if len(calls) > allowed:
+            raise KeyboardInterrupt("crash")
+        replace(source, target)
+
+    monkeypatch.setattr(backends.os, "replace", failing)
+
+
+@pytest.mark.parametrize("allowed", [0, 1, 2])
+def test_interrupted_compaction_keeps_the_collection_readable(tmp_path, vectors, queries, monkeypatch, allowed):
+    # 0: before the marker, 1: after the marker, 2: after swapping the vectors
+    backend = make_backend(tmp_path, vectors)
+    # Half of the rows are deleted, one more delete starts a compaction
+    backend.delete([point_id(row) for row in range(0, len(vectors), 2)])
+    crash_on_replace(monkeypatch, allowed)
+    with pytest.raises(KeyboardInterrupt):
+        backend.delete([point_id(1)])
+    monkeypatch.undo()
+
+    reloaded = LocalBackend(str(tmp_path), "test")
+    rows = list(range(3, len(vectors), 2))
+    # The delete line is written before the compaction starts
+    assert reloaded.count() == len(rows)
+    ids, _ = brute_force(vectors, queries[0], 10, rows)
+    assert [point.id for point in reloaded.search([queries[0].tolist()], 10)[0]] == ids
+    assert sorted(os.listdir(reloaded.path)) == ["config.json", "log.jsonl", "vectors.f32"]
+
+
+def test_repeated_upserts_are_compacted(tmp_path, vectors):
+    backend = make_backend(tmp_path, vectors[:10])
+    for _ in range(10):
+        backend.upsert(make_points(vectors[:10]))
+    assert backend.count() == 10
+    assert os.path.getsize(backend._file("vectors.f32")) <= 2 * 10 * DIMENSION * 4
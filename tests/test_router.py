@@ -0,0 +1,59 @@
+import pytest
+from src.chunking import tokenizer
+from src.chunking.chunker import Chunker
+from src.retrievers.router import QueryRouter
+from src.vector_store_client.filters import build_filter, matches
+
+CHAPTER = """CAPÍTULO XIII
+BEBIDAS FERMENTADAS
+Artículo 1080 - (Resolución Conjunta SPRyRS N° 63/02 y SAGPyA N° 345/02)
+Con la denominación de Cerveza se entiende la bebida resultante de fermentar el mosto.
+Artículo 1081 - (Res 1546, 11.09.90)
+Se entiende por Extracto primitivo el extracto del mosto de malta de origen.
+Artículo 1082 bis - (Resolución GMC N° 169/2013)
+Las cervezas se clasificarán según su color.
+"""
+
+
+@pytest.fixture
+def chunks(tmp_path, monkeypatch):
+    # The approximate tokenizer does not need the tiktoken encoding
+    monkeypatch.setenv("PIPE_TOKENIZER", "regex")
+    tokenizer.get_tokenizer.cache_clear()
+    chunker = Chunker(
+        [{"file_name": "BEBIDAS FERMENTADAS.pdf", "text": CHAPTER, "tables": []}],
+        max_chunk_size=200, overlap_size=0, output_path=str(tmp_path))
+    yield list(chunker.chunking_hybrid())
+    tokenizer.get_tokenizer.cache_clear()
+
+
+def routed(chunks, query):
+    query_filter = build_filter(QueryRouter().route(query))
+    return [chunk.contenido for chunk in chunks if matches({"metadata": chunk.fields}, query_filter)]
+
+
+def test_resolution_ids_are_normalized():
+    assert Chunker.resolution_id("0169", "13") == "169/2013"
+    assert Chunker.resolution_id("1546", "90") == "1546/1990"
+    assert Chunker.resolution_id("169", "2013") == "169/2013"
+    assert Chunker.resolution_id("1546") == "1546"
+    assert Chunker.resolutions("Res. GMC N° 169/13") == ["169/2013", "169"]
+    assert Chunker.resolutions("(Res 1546, 11.09.90)") == ["1546"]
+    assert Chunker.resolutions("Resto de los N° 5") == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("¿Qué dice la Resolución GMC N° 169/13?", "clasificarán"),
+    ("¿Qué establece la Resolución 169/2013?", "clasificarán"),
+    ("¿Qué indica la Resolución 63/2002?", "Cerveza"),
+    ("¿Qué indica la Res. 1546?", "Extracto primitivo"),
+    ("¿Qué dice el artículo 1082 bis del capítulo 13?", "clasificarán"),
+])
+def test_routed_questions_match_their_chunks(chunks, query, expected):
+    found = routed(chunks, query)
+    assert found
+    assert all(expected in text for text in found)
+
+
+def test_other_year_does_not_match(chunks):
+    assert routed(chunks, "¿Qué dice la Resolución 169/2014?") == []
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+import pytest
+from src.retrievers.scheduler import QueryScheduler, run_sync
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("La condicion no se cumplio a tiempo")
+        time.sleep(0.01)
+
+
+class Blocked:
+    """
+    Job that runs until `release` is called, counting its executions
+    """
+
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = 0
+        self.released = threading.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        while not self.released.is_set():
+            await asyncio.sleep(0.01)
+        return self.result
+
+    def release(self) -> None:
+        self.released.set()
+
+
+def finished(result=None) -> Blocked:
+    job = Blocked(result)
+    job.release()
+    return job
+
+
+def test_identical_queries_are_coalesced():
+    scheduler = QueryScheduler(max_concurrency=2)
+    job = Blocked(result="respuesta")
+    first, runs = scheduler.submit("a", "pregunta", job)
+    assert runs
+    wait_until(lambda: job.calls == 1)
+    # Another session asks the same question while it is running
+    second, runs = scheduler.submit("b", "pregunta", finished())
+    assert not runs
+    assert second is first
+
+    job.release()
+    assert first.result(timeout=5) == "respuesta"
+    assert job.calls == 1
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_queued_queries_are_coalesced():
+    scheduler = QueryScheduler(max_concurrency=1)
+    running = Blocked()
+    scheduler.submit("a", "primera", running)
+    wait_until(lambda: running.calls == 1)
+    queued = Blocked(result="segunda")
+    future, _ = scheduler.submit("a", "segunda", queued)
+    coalesced, runs = scheduler.submit("b", "segunda", finished())
+    assert not runs and coalesced is future
+
+    running.release()
+    queued.release()
+    assert future.result(timeout=5) == "segunda"
+    assert queued.calls == 1
+
+
+def test_finished_query_runs_again():
+    scheduler = QueryScheduler()
+    job = finished(1)
+    assert scheduler.run("a", "pregunta", job, timeout=5) == 1
+    assert scheduler.run("a", "pregunta", job, timeout=5) == 1
+    assert job.calls == 2
+
+
+def test_full_session_queue_is_rejected():
+    scheduler = QueryScheduler(max_concurrency=1, max_session_queue=1)
+    running = Blocked()
+    scheduler.submit("a", "primera", running)
+    wait_until(lambda: scheduler.stats()["running"] == 1)
+    scheduler.submit("a", "segunda", finished())
+    with pytest.raises(ConnectionRefusedError):
+        scheduler.submit("a", "tercera", finished())
+    # Other sessions still have room
+    _, runs = scheduler.submit("b", "cuarta", finished())
+    assert runs
+    assert scheduler.stats()["rejected"] == 1
+    running.release()
+
+
+def test_too_many_pending_queries_are_rejected():
+    scheduler = QueryScheduler(max_concurrency=1, max_session_queue=4, max_pending=2)
+    running = Blocked()
+    scheduler.submit("a", "primera", running)
+    wait_until(lambda: scheduler.stats()["running"] == 1)
+    scheduler.submit("b", "segunda", finished())
+    scheduler.submit("c", "tercera", finished())
+    with pytest.raises(ConnectionRefusedError):
+        scheduler.submit("d", "cuarta", finished())
+    assert scheduler.stats()["queue_depth"] == 2
+    running.release()
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = QueryScheduler(max_concurrency=1)
+    order = []
+
+    def job(name, gate=None):
+        async def run():
+            if gate is not None:
+                while not gate.is_set():
+                    await asyncio.sleep(0.01)
+            order.append(name)
+        return run
+
+    gate = threading.Event()
+    scheduler.submit("a", "a0", job("a0", gate))
+    wait_until(lambda: scheduler.stats()["running"] == 1)
+    futures = [scheduler.submit(session, name, job(name))[0]
+               for session, name in [("a", "a1"), ("a", "a2"), ("b", "b1")]]
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["a0", "a1", "b1", "a2"]
+
+
+def test_run_sync_inside_event_loop_is_refused():
+    async def inside():
+        async def job():
+            return 1
+        with pytest.raises(RuntimeError):
+            run_sync(job, "job()")
+
+    asyncio.run(inside())
@@ -0,0 +1,54 @@
+import os
+import pytest
+from src.loaders.staging import StagingFile, StagingStore
+
+
+def records(total: int):
+    return [{"number": number, "text": f"pagina {number} " + "ñ" * number} for number in range(total)]
+
+
+def test_records_are_read_by_position(tmp_path):
+    staging = StagingFile(str(tmp_path / "doc.chunks.jsonl"))
+    assert staging.write(records(50)) == 50
+    assert os.path.exists(tmp_path / "doc.chunks.idx.npy")
+    assert len(staging) == 50
+    assert staging[37] == records(50)[37]
+    assert staging[-1] == records(50)[-1]
+    assert list(staging) == records(50)
+
+
+def test_rewrite_replaces_the_index(tmp_path):
+    staging = StagingFile(str(tmp_path / "doc.chunks.jsonl"))
+    staging.write(records(50))
+    staging[10]
+    staging.write(records(5)[::-1])
+    assert len(staging) == 5
+    assert staging[0] == records(5)[4]
+
+
+def test_index_is_rebuilt_for_files_staged_without_it(tmp_path):
+    staging = StagingFile(str(tmp_path / "doc.pages.jsonl"))
+    staging.write(records(20))
+    os.remove(staging.index_path)
+    reopened = StagingFile(staging.path)
+    assert reopened[13] == records(20)[13]
+    assert os.path.exists(staging.index_path)
+
+
+def test_interrupted_writer_keeps_the_previous_file(tmp_path):
+    staging = StagingFile(str(tmp_path / "doc.chunks.jsonl"))
+    staging.write(records(3))
+    with pytest.raises(RuntimeError):
+        with staging.writer() as append:
+            append(records(1)[0])
+            raise RuntimeError("fallo")
+    assert len(StagingFile(staging.path)) == 3
+    assert sorted(os.listdir(tmp_path)) == ["doc.chunks.idx.npy", "doc.chunks.jsonl"]
+
+
+def test_store_reads_single_pages_and_chunks(tmp_path):
+    store = StagingStore(str(tmp_path))
+    store.pages("data/Capitulo I.pdf").write(records(4))
+    store.chunks("Capitulo I.pdf").write(records(9))
+    assert store.page("Capitulo I.pdf", 2) == records(4)[2]
+    assert store.chunk("data/Capitulo I.pdf", 8) == records(9)[8]